@@ -0,0 +1,102 @@
+import numpy as np
+
+import epochedSpikesStore
+
+
+def get_bins_edges(trials_start_times, trials_end_times, bin_size):
+    """Returns the edges of ``bin_size`` bins starting at the start time of
+    every trial, as an ``n_trials`` x ``(n_bins + 1)`` array, and the
+    ``n_trials`` x ``n_bins`` mask of the bins that start before the end of
+    their trial.
+
+    All trials have the ``n_bins`` bins needed to cover the longest trial;
+    bins past the end of shorter trials are masked out, and so are all bins
+    of trials with NaN start or end times (e.g., a missing epoch event).
+    """
+    trials_start_times = np.asarray(trials_start_times, dtype=np.float64)
+    trials_end_times = np.asarray(trials_end_times, dtype=np.float64)
+    trials_durations = trials_end_times - trials_start_times
+    valid_trials = np.logical_not(np.isnan(trials_durations))
+    if valid_trials.any():
+        n_bins = int(np.ceil(np.nanmax(trials_durations) / bin_size))
+    else:
+        n_bins = 0
+    bins_starts = np.arange(n_bins + 1) * bin_size
+    bins_edges = trials_start_times[:, None] + bins_starts[None, :]
+    bins_mask = (bins_starts[None, :-1] < trials_durations[:, None]) & \
+        valid_trials[:, None]
+    return bins_edges, bins_mask
+
+
+def bin_spikes_counts(epoched_spikes, bin_size, trials_indices=None,
+                      units_indices=None, sparse=False):
+    """Counts the spikes of the trials at ``trials_indices`` and the units at
+    ``units_indices`` (all if None) of ``epoched_spikes`` (see
+    :func:`epochedSpikesStore.load`) in ``bin_size`` bins, in one vectorized
+    pass over the flat spikes times.
+
+    Bins start at the start time of every trial (see :func:`get_bins_edges`)
+    and spikes after the end of their trial, or of trials with NaN start or
+    end times, are not counted.
+
+    Returns ``(spikes_counts, bins_edges, bins_mask)``, where
+    ``spikes_counts`` is an ``n_trials`` x ``n_units`` x ``n_bins`` array or,
+    if ``sparse`` is True, an ``(n_trials * n_units)`` x ``n_bins``
+    ``scipy.sparse.csr_array``, with the counts of trial ``r`` and unit
+    ``n`` in row ``r * n_units + n``.
+    """
+    subset_spikes = epochedSpikesStore.subset(epoched_spikes=epoched_spikes,
+                                              trials_indices=trials_indices,
+                                              units_indices=units_indices)
+    n_trials = subset_spikes["n_trials"]
+    n_units = subset_spikes["n_units"]
+    trials_start_times = subset_spikes["trials_start_times"]
+    trials_end_times = subset_spikes["trials_end_times"]
+    bins_edges, bins_mask = get_bins_edges(
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times, bin_size=bin_size)
+    n_bins = bins_mask.shape[1]
+
+    # (trial, unit) block, and trial, of every spike
+    blocks_counts = np.diff(subset_spikes["epoched_offsets"])
+    spikes_blocks = np.repeat(np.arange(n_trials * n_units), blocks_counts)
+    spikes_trials = spikes_blocks // max(n_units, 1)
+    spikes_times = np.asarray(subset_spikes["epoched_spikes_times"]) - \
+        subset_spikes["spikes_shifts"][spikes_trials]
+    valid_trials = np.logical_not(np.isnan(trials_start_times) |
+                                  np.isnan(trials_end_times))
+    spikes_valid = valid_trials[spikes_trials]
+    spikes_bins = np.zeros(len(spikes_times), dtype=np.int64)
+    spikes_bins[spikes_valid] = np.floor(
+        (spikes_times[spikes_valid] -
+         trials_start_times[spikes_trials[spikes_valid]]) /
+        bin_size).astype(np.int64)
+    in_trial = spikes_valid & (spikes_bins >= 0) & (spikes_bins < n_bins) & \
+        (spikes_times < trials_end_times[spikes_trials])
+    spikes_blocks = spikes_blocks[in_trial]
+    spikes_bins = spikes_bins[in_trial]
+
+    if sparse:
+        import scipy.sparse
+
+        spikes_counts = scipy.sparse.csr_array(
+            (np.ones(len(spikes_bins), dtype=np.int64),
+             (spikes_blocks, spikes_bins)),
+            shape=(n_trials * n_units, n_bins))
+        # csr construction leaves duplicate (block, bin) entries unsummed
+        spikes_counts.sum_duplicates()
+    else:
+        spikes_counts = np.bincount(
+            spikes_blocks * n_bins + spikes_bins,
+            minlength=n_trials * n_units * n_bins).reshape(
+                n_trials, n_units, n_bins)
+    return spikes_counts, bins_edges, bins_mask
+
+
+def get_binned_rates(spikes_counts, bin_size, bins_mask):
+    """Returns the spikes rates of the ``n_trials`` x ``n_units`` x
+    ``n_bins`` ``spikes_counts`` returned by :func:`bin_spikes_counts`, with
+    NaN in the bins masked out by ``bins_mask``."""
+    spikes_rates = np.where(bins_mask[:, None, :], spikes_counts / bin_size,
+                            np.nan)
+    return spikes_rates
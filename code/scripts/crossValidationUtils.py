@@ -0,0 +1,138 @@
+import copy
+import numpy as np
+import torch
+
+import epochedSpikesStore
+import estimationUtils
+import modelExport
+import warmStartUtils
+
+
+def get_folds(n_trials, n_folds, random_seed=None):
+    """Splits ``n_trials`` trials, shuffled with ``random_seed`` (in order if
+    None), into ``n_folds`` folds of almost equal size.
+
+    Returns a list with the (sorted) trials indices of every fold.
+    """
+    if n_folds < 2 or n_folds > n_trials:
+        raise ValueError(f"The number of folds ({n_folds}) should be between "
+                         f"2 and the number of trials ({n_trials})")
+    if random_seed is None:
+        trials_indices = np.arange(n_trials)
+    else:
+        trials_indices = np.random.default_rng(random_seed).permutation(
+            n_trials)
+    folds = [np.sort(fold) for fold in np.array_split(trials_indices,
+                                                        n_folds)]
+    return folds
+
+
+def get_heldout_units(n_units, heldout_units_fraction, random_seed=None):
+    """Returns the sorted indices of the held-in and of the held-out units,
+    a random ``heldout_units_fraction`` of the ``n_units`` units (no unit
+    is held out if ``heldout_units_fraction`` is zero)."""
+    n_heldout_units = int(round(heldout_units_fraction * n_units))
+    if n_heldout_units >= n_units:
+        raise ValueError(f"Holding out {n_heldout_units} of {n_units} units "
+                         f"leaves no unit to infer the latents")
+    permuted_units = np.random.default_rng(random_seed).permutation(n_units)
+    heldin_units = np.sort(permuted_units[n_heldout_units:])
+    heldout_units = np.sort(permuted_units[:n_heldout_units])
+    return heldin_units, heldout_units
+
+
+def get_estep_optim_params(optim_params, em_max_iter):
+    """Returns a copy of ``optim_params`` that only estimates the variational
+    parameters, for ``em_max_iter`` EM iterations."""
+    estep_optim_params = copy.deepcopy(optim_params)
+    estep_optim_params["em_max_iter"] = em_max_iter
+    estep_optim_params["estep_estimate"] = True
+    for step in ("mstep_embedding", "mstep_kernels", "mstep_indpointslocs"):
+        estep_optim_params[f"{step}_estimate"] = False
+    return estep_optim_params
+
+
+def evaluate_heldout(estimated_params, epoched_spikes, trials_indices,
+                     heldin_units, heldout_units, get_params_fn,
+                     em_max_iter=5):
+    """Computes the expected log-likelihood of held-out trials under the
+    model estimated from the training trials.
+
+    The kernels and embedding of the estimation (``estimated_params``, see
+    :func:`warmStartUtils.load_estimated_params`) are kept fixed, and the
+    posterior on the latents of the held-out trials, at ``trials_indices``
+    of ``epoched_spikes``, is estimated from the spikes of the units at
+    ``heldin_units`` with ``em_max_iter`` E-step only EM iterations. The
+    expected log-likelihood is then evaluated on the spikes of the units at
+    ``heldout_units`` (co-smoothing), or on those of the held-in units if
+    no unit is held out.
+
+    ``get_params_fn(n_neurons, n_trials, trials_start_times,
+    trials_end_times)`` returns the initial parameters and kernels types of
+    a model of the held-out trials (see
+    :func:`estimationUtils.get_params_and_kernels_types`).
+
+    Returns ``(expected_log_likelihood, n_spikes)`` of the evaluated spikes.
+    """
+    trials_ids = epoched_spikes["trials_ids"][trials_indices]
+    units_ids = epoched_spikes["units_ids"]
+    trials_start_times = \
+        epoched_spikes["trials_start_times"][trials_indices].tolist()
+    trials_end_times = \
+        epoched_spikes["trials_end_times"][trials_indices].tolist()
+    n_trials = len(trials_indices)
+    if len(heldout_units) == 0:
+        heldout_units = heldin_units
+
+    # estimate the posterior on the latents of the held-out trials from the
+    # held-in units
+    heldin_spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes, trials_indices=trials_indices,
+        units_indices=heldin_units)
+    params, kernels_types = get_params_fn(
+        n_neurons=len(heldin_units), n_trials=n_trials,
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times)
+    warmStartUtils.warm_start(params=params,
+                              estimated_params=estimated_params,
+                              trials_ids=trials_ids,
+                              units_ids=units_ids[heldin_units])
+    params["optim_params"] = get_estep_optim_params(
+        optim_params=params["optim_params"], em_max_iter=em_max_iter)
+    model = estimationUtils.build_model(kernels_types=kernels_types,
+                                        params=params,
+                                        spikes_times=heldin_spikes_times)
+    estimationUtils.maximize(model=model, params=params,
+                             printIterationModelParams=False)
+    posterior_params = modelExport.get_estimated_params(model=model)
+    posterior_params["trials_ids"] = trials_ids
+    posterior_params["units_ids"] = units_ids[heldin_units]
+
+    # evaluate the expected log-likelihood of the held-out units, with the
+    # posterior on the latents of the held-out trials and the embedding of
+    # the estimation
+    heldout_spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes, trials_indices=trials_indices,
+        units_indices=heldout_units)
+    params, kernels_types = get_params_fn(
+        n_neurons=len(heldout_units), n_trials=n_trials,
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times)
+    warmStartUtils.warm_start(params=params,
+                              estimated_params=posterior_params,
+                              trials_ids=trials_ids,
+                              units_ids=units_ids[heldout_units])
+    warmStartUtils.warm_start(params=params,
+                              estimated_params=estimated_params,
+                              trials_ids=trials_ids,
+                              units_ids=units_ids[heldout_units])
+    model = estimationUtils.build_model(kernels_types=kernels_types,
+                                        params=params,
+                                        spikes_times=heldout_spikes_times)
+    with torch.no_grad():
+        expected_log_likelihood = model.evalELLSumAcrossTrialsAndNeurons(
+            svPosteriorOnLatentsStats=None).item()
+    n_spikes = sum(len(unit_spikes_times)
+                   for trial_spikes_times in heldout_spikes_times
+                   for unit_spikes_times in trial_spikes_times)
+    return expected_log_likelihood, n_spikes
@@ -0,0 +1,86 @@
+import sys
+import argparse
+import traceback
+
+import resultsIndex
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_index_filename",
+                        help="SQLite index of estimation results",
+                        type=str,
+                        default="../../results/estimationResults.sqlite")
+    parser.add_argument("--estim_res_metadata_filename_pattern",
+                        help="estimation result metadata filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--est_init_config_filename_pattern",
+                        help="estimation initialization filename pattern",
+                        type=str,
+                        default="../../init/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--model_save_filename_pattern",
+                        help="model save filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.pickle")
+    parser.add_argument("--model_export_filename_pattern",
+                        help=("filename pattern of the exported estimated "
+                              "parameters"),
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.npz")
+    parser.add_argument("--history_filename_pattern",
+                        help="estimation history filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimationHistory.npz")
+    parser.add_argument("--reindex",
+                        help="also index again results already in the index",
+                        action="store_true")
+    args = parser.parse_args()
+
+    results_index_filename = args.results_index_filename
+    estim_res_metadata_filename_pattern = \
+        args.estim_res_metadata_filename_pattern
+    est_init_config_filename_pattern = args.est_init_config_filename_pattern
+    model_save_filename_pattern = args.model_save_filename_pattern
+    model_export_filename_pattern = args.model_export_filename_pattern
+    history_filename_pattern = args.history_filename_pattern
+    reindex = args.reindex
+
+    estim_res_numbers = resultsIndex.find_estim_res_numbers(
+        estim_res_metadata_filename_pattern=
+        estim_res_metadata_filename_pattern)
+    if not reindex:
+        indexed_numbers = resultsIndex.get_indexed_numbers(
+            index_filename=results_index_filename)
+        estim_res_numbers = [estim_res_number for estim_res_number in
+                             estim_res_numbers
+                             if estim_res_number not in indexed_numbers]
+    summaries = []
+    for estim_res_number in estim_res_numbers:
+        try:
+            summary = resultsIndex.get_run_summary(
+                estResNumber=estim_res_number,
+                estim_res_metadata_filename=
+                estim_res_metadata_filename_pattern.format(estim_res_number),
+                est_init_config_filename_pattern=
+                est_init_config_filename_pattern,
+                model_save_filename=
+                model_save_filename_pattern.format(estim_res_number),
+                model_export_filename=
+                model_export_filename_pattern.format(estim_res_number),
+                history_filename=
+                history_filename_pattern.format(estim_res_number))
+        except Exception:
+            print(f"Could not index estimation result "
+                  f"{estim_res_number:08d}")
+            print(traceback.format_exc())
+            continue
+        summaries.append(summary)
+    resultsIndex.record_runs(index_filename=results_index_filename,
+                             summaries=summaries)
+    print(f"Indexed {len(summaries)} estimation results in "
+          f"{results_index_filename}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
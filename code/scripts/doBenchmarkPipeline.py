@@ -0,0 +1,466 @@
+import sys
+import os
+import io
+import gc
+import time
+import json
+import pickle
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+import torch
+
+import svGPFA.utils.initUtils
+
+import socialMiceUtils
+import spikesTimesLoader
+import epochedSpikesStore
+import estimationUtils
+import estimationProfiler
+import binningUtils
+import syntheticSession
+
+stages_names = ["load_units", "load_units_cached", "epoch_per_unit",
+                "epoch_vectorized", "to_lists", "pickle_save", "pickle_load",
+                "store_save", "store_load", "subset_trials", "subset_units",
+                "store_subset", "bin_counts", "svem_fit"]
+
+
+def benchmark(stage_fn, n_repeats):
+    """Calls ``stage_fn`` ``n_repeats`` times, timing every call, and once
+    more tracing its memory allocations (tracing slows down the call, so it
+    is not timed).
+
+    Returns ``(result, elapsed_times, peak_traced_mb)``, with ``result``
+    the value returned by the last call.
+    """
+    elapsed_times = []
+    for i in range(n_repeats):
+        result = None
+        gc.collect()
+        start_time = time.perf_counter()
+        result = stage_fn()
+        elapsed_times.append(time.perf_counter() - start_time)
+    result = None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = stage_fn()
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed_times, peak_traced / 2**20
+
+
+def epoch_units_one_by_one(units_spikes_times, units_offsets, epoch_times,
+                           epoch_start_times, epoch_end_times):
+    n_units = len(units_offsets) - 1
+    epoched_spikes_times = [
+        socialMiceUtils.epoch_neuron_spikes_times(
+            neuron_spikes_times=units_spikes_times[units_offsets[n]:
+                                                   units_offsets[n+1]],
+            epoch_times=epoch_times, epoch_start_times=epoch_start_times,
+            epoch_end_times=epoch_end_times)
+        for n in range(n_units)]
+    return epoched_spikes_times
+
+
+def fit_svgpfa(spikes_times, trials_start_times, trials_end_times, n_latents,
+               common_n_ind_points, em_max_iter):
+    """Runs a short svEM maximization with svGPFA's default initial
+    parameters. Returns ``(lowerBoundHist, elapsedTimeHist,
+    terminationInfo)``."""
+    n_trials = len(spikes_times)
+    n_neurons = len(spikes_times[0])
+    # svGPFA logs every extracted parameter
+    with contextlib.redirect_stdout(io.StringIO()):
+        default_params_spec = svGPFA.utils.initUtils.getDefaultParamsDict(
+            n_neurons=n_neurons, n_trials=n_trials, n_latents=n_latents,
+            common_n_ind_points=common_n_ind_points, em_max_iter=em_max_iter)
+        params, kernels_types = \
+            svGPFA.utils.initUtils.getParamsAndKernelsTypes(
+                n_neurons=n_neurons, n_trials=n_trials, n_latents=n_latents,
+                trials_start_times=trials_start_times,
+                trials_end_times=trials_end_times,
+                default_params_spec=default_params_spec)
+    model = estimationUtils.build_model(kernels_types=kernels_types,
+                                        params=params,
+                                        spikes_times=spikes_times)
+    lowerBoundHist, elapsedTimeHist, terminationInfo, _ = \
+        estimationUtils.maximize(model=model, params=params,
+                                 printIterationModelParams=False)
+    return lowerBoundHist, elapsedTimeHist, terminationInfo
+
+
+def run_scale_benchmarks(n_units, n_trials, stages, n_repeats, work_dirname,
+                         session_params, n_workers, fit_params,
+                         fitted_sizes):
+    """Generates a synthetic session with ``n_units`` units and ``n_trials``
+    trials in ``work_dirname`` and benchmarks on it the preprocessing and
+    estimation ``stages``. Stages not in ``stages`` are run, untimed, only
+    when a later stage needs their results.
+
+    Returns a list with one row per benchmarked stage.
+    """
+    rows = []
+    subject_name = f"SYN{n_units:d}x{n_trials:d}"
+    region = "SYN"
+
+    start_time = time.perf_counter()
+    session = syntheticSession.generate_session(n_units=n_units,
+                                                n_trials=n_trials,
+                                                **session_params)
+    spikes_dirname = syntheticSession.save_session(
+        session=session, data_dirname=work_dirname,
+        subject_name=subject_name, region=region)
+    n_spikes = int(session["units_offsets"][-1])
+    session = None
+    print(f"Generated session {subject_name} with {n_spikes} spikes in "
+          f"{time.perf_counter()-start_time:.2f} secs")
+
+    trials_info = pd.read_csv(os.path.join(work_dirname, subject_name,
+                                           "behavior_data.csv"))
+    epoch_times = trials_info["DoorOpen"]
+    epoch_start_times = trials_info["TrialOn"]
+    epoch_end_times = trials_info["TrialOff"]
+    trials_ids = np.arange(n_trials)
+    trials_start_times = (epoch_start_times - epoch_times).tolist()
+    trials_end_times = (epoch_end_times - epoch_times).tolist()
+
+    def run_stage(stage, stage_fn, n_items, items="spikes"):
+        if stage not in stages:
+            return stage_fn()
+        result, elapsed_times, peak_traced_mb = benchmark(
+            stage_fn=stage_fn, n_repeats=n_repeats)
+        elapsed_time = float(np.median(elapsed_times))
+        rows.append({"stage": stage, "n_units": n_units,
+                     "n_trials": n_trials, "n_items": n_items,
+                     "items": items, "n_repeats": n_repeats,
+                     "median_time": elapsed_time,
+                     "min_time": float(np.min(elapsed_times)),
+                     "throughput": n_items / elapsed_time,
+                     "peak_traced_mb": peak_traced_mb,
+                     "peak_rss_mb": estimationProfiler.get_peak_rss_mb()})
+        print(f"{stage:>18s} {n_units:5d} units {n_trials:5d} trials: "
+              f"{elapsed_time:10.4f} secs, "
+              f"{n_items/elapsed_time:14.1f} {items}/sec, "
+              f"{peak_traced_mb:10.1f} MB")
+        return result
+
+    units_ids, units_spikes_times, units_offsets = run_stage(
+        "load_units",
+        lambda: spikesTimesLoader.load_units_spikes_times(
+            spikes_dirname=spikes_dirname, n_workers=n_workers),
+        n_items=n_spikes)
+    units_ids = np.asarray(units_ids)
+    if "load_units_cached" in stages:
+        cache_filename_pattern = os.path.join(
+            work_dirname, f"spikesTimes_subject_{subject_name}.{{:s}}")
+
+        def load_cached_units_spikes_times():
+            # silences the cache loading message
+            with contextlib.redirect_stdout(io.StringIO()):
+                loaded = spikesTimesLoader.load_units_spikes_times(
+                    spikes_dirname=spikes_dirname,
+                    cache_filename_pattern=cache_filename_pattern,
+                    n_workers=n_workers)
+            return loaded
+
+        # the first call builds the cache
+        load_cached_units_spikes_times()
+        run_stage("load_units_cached", load_cached_units_spikes_times,
+                  n_items=n_spikes)
+
+    if "epoch_per_unit" in stages:
+        run_stage("epoch_per_unit",
+                  lambda: epoch_units_one_by_one(
+                      units_spikes_times=units_spikes_times,
+                      units_offsets=units_offsets,
+                      epoch_times=epoch_times.to_numpy(),
+                      epoch_start_times=epoch_start_times.to_numpy(),
+                      epoch_end_times=epoch_end_times.to_numpy()),
+                  n_items=n_spikes)
+    epoched_spikes_times, epoched_offsets = run_stage(
+        "epoch_vectorized",
+        lambda: socialMiceUtils.epoch_units_spikes_times(
+            units_spikes_times=units_spikes_times,
+            units_offsets=units_offsets, epoch_times=epoch_times,
+            epoch_start_times=epoch_start_times,
+            epoch_end_times=epoch_end_times),
+        n_items=n_spikes)
+    n_epoched_spikes = int(epoched_offsets[-1])
+
+    if stages.isdisjoint(["to_lists", "pickle_save", "pickle_load",
+                          "subset_trials", "subset_units", "svem_fit"]):
+        spikes_times = None
+    else:
+        spikes_times = run_stage(
+            "to_lists",
+            lambda: socialMiceUtils.epoched_spikes_times_to_lists(
+                epoched_spikes_times=epoched_spikes_times,
+                epoched_offsets=epoched_offsets, n_trials=n_trials,
+                n_units=n_units),
+            n_items=n_epoched_spikes)
+
+    if not stages.isdisjoint(["pickle_save", "pickle_load"]):
+        pickle_filename = os.path.join(
+            work_dirname, f"epochedSpikes_subject_{subject_name}.pickle")
+        results_to_save = {"spikes_times": spikes_times,
+                           "units_ids": units_ids,
+                           "trials_ids": trials_ids,
+                           "trials_start_times": trials_start_times,
+                           "trials_end_times": trials_end_times,
+                           "trials_info": trials_info}
+
+        def save_pickle():
+            with open(pickle_filename, "wb") as f:
+                pickle.dump(results_to_save, f)
+
+        def load_pickle():
+            with open(pickle_filename, "rb") as f:
+                load_res = pickle.load(f)
+            return load_res
+
+        run_stage("pickle_save", save_pickle, n_items=n_epoched_spikes)
+        run_stage("pickle_load", load_pickle, n_items=n_epoched_spikes)
+
+    if not stages.isdisjoint(["store_save", "store_load"]):
+        store_filename_pattern = os.path.join(
+            work_dirname, f"epochedSpikes_subject_{subject_name}.{{:s}}")
+        run_stage("store_save",
+                  lambda: epochedSpikesStore.save(
+                      filename_pattern=store_filename_pattern,
+                      epoched_spikes_times=epoched_spikes_times,
+                      epoched_offsets=epoched_offsets,
+                      units_ids=units_ids,
+                      trials_ids=trials_ids,
+                      trials_start_times=trials_start_times,
+                      trials_end_times=trials_end_times,
+                      trials_info=trials_info),
+                  n_items=n_epoched_spikes)
+        run_stage("store_load",
+                  lambda: epochedSpikesStore.get_spikes_times(
+                      epoched_spikes=epochedSpikesStore.load(
+                          filename_pattern=store_filename_pattern)),
+                  n_items=n_epoched_spikes)
+
+    if "subset_trials" in stages:
+        run_stage("subset_trials",
+                  lambda: socialMiceUtils.subset_trials_ids_data(
+                      selected_trials_ids=trials_ids[::2],
+                      trials_ids=trials_ids, spikes_times=spikes_times,
+                      trials_start_times=trials_start_times,
+                      trials_end_times=trials_end_times),
+                  n_items=n_epoched_spikes)
+    if "subset_units" in stages:
+        run_stage("subset_units",
+                  lambda: socialMiceUtils.subset_clusters_ids_data(
+                      selected_clusters_ids=units_ids[::2],
+                      clusters_ids=units_ids, spikes_times=spikes_times),
+                  n_items=n_epoched_spikes)
+
+    if not stages.isdisjoint(["store_subset", "bin_counts"]):
+        epoched_spikes = {"epoched_spikes_times": epoched_spikes_times,
+                          "epoched_offsets": epoched_offsets,
+                          "n_trials": n_trials,
+                          "n_units": n_units,
+                          "units_ids": units_ids,
+                          "trials_ids": trials_ids,
+                          "trials_start_times": np.asarray(trials_start_times),
+                          "trials_end_times": np.asarray(trials_end_times),
+                          "trials_info": trials_info,
+                          "epoch_times": epoch_times.to_numpy(),
+                          "spikes_shifts": np.zeros(n_trials)}
+    if "store_subset" in stages:
+        run_stage("store_subset",
+                  lambda: epochedSpikesStore.subset_ids(
+                      epoched_spikes=epoched_spikes,
+                      trials_ids=trials_ids[::2], units_ids=units_ids[::2]),
+                  n_items=n_epoched_spikes)
+    if "bin_counts" in stages:
+        run_stage("bin_counts",
+                  lambda: binningUtils.bin_spikes_counts(
+                      epoched_spikes=epoched_spikes, bin_size=0.05),
+                  n_items=n_epoched_spikes)
+
+    if "svem_fit" in stages:
+        fit_n_units = min(n_units, fit_params["max_units"])
+        fit_n_trials = min(n_trials, fit_params["max_trials"])
+        # the fit only depends on the capped sizes, which may repeat across
+        # scales
+        if (fit_n_units, fit_n_trials) not in fitted_sizes:
+            fitted_sizes.add((fit_n_units, fit_n_trials))
+            fit_spikes_times = [spikes_times[r][:fit_n_units]
+                                for r in range(fit_n_trials)]
+            lowerBoundHist, elapsedTimeHist, terminationInfo = run_stage(
+                "svem_fit",
+                lambda: fit_svgpfa(
+                    spikes_times=fit_spikes_times,
+                    trials_start_times=trials_start_times[:fit_n_trials],
+                    trials_end_times=trials_end_times[:fit_n_trials],
+                    n_latents=fit_params["n_latents"],
+                    common_n_ind_points=fit_params["common_n_ind_points"],
+                    em_max_iter=fit_params["em_max_iter"]),
+                n_items=fit_params["em_max_iter"], items="iterations")
+            rows[-1].update({"n_units": fit_n_units,
+                             "n_trials": fit_n_trials,
+                             "lower_bound": lowerBoundHist[-1],
+                             "termination": terminationInfo.message})
+    return rows
+
+
+def get_environment():
+    environment = {"python_version": platform.python_version(),
+                   "platform": platform.platform(),
+                   "processor": platform.processor(),
+                   "n_cpus": os.cpu_count(),
+                   "numpy_version": np.__version__,
+                   "pandas_version": pd.__version__,
+                   "torch_version": torch.__version__,
+                   "torch_n_threads": torch.get_num_threads(),
+                   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return environment
+
+
+def compare_with_baseline(results, baseline_filename):
+    """Returns, for every stage and scale benchmarked both in ``results``
+    and in the benchmark report ``baseline_filename``, the ratio of the
+    baseline to the current median times (values larger than one are
+    speedups)."""
+    with open(baseline_filename, "r") as f:
+        baseline = json.load(f)
+    keys = ["stage", "n_units", "n_trials"]
+    comparison = pd.DataFrame(results)[keys + ["median_time"]].merge(
+        pd.DataFrame(baseline["results"])[keys + ["median_time"]],
+        on=keys, suffixes=("", "_baseline"))
+    comparison["speedup"] = comparison["median_time_baseline"] / \
+        comparison["median_time"]
+    return comparison
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales",
+                        help=("scales to benchmark, each as <number of "
+                              "units>x<number of trials> (e.g., "
+                              "[6x10,12x20])"),
+                        type=str,
+                        default="[50x100,500x100,50x5000,500x5000]")
+    parser.add_argument("--stages",
+                        help=("stages to benchmark (e.g., "
+                              "[store_load,bin_counts]; all if not given)"),
+                        type=str, default=f"[{','.join(stages_names)}]")
+    parser.add_argument("--n_repeats",
+                        help="number of timed runs of every stage",
+                        type=int, default=3)
+    parser.add_argument("--min_rate", help="minimum spikes rate (Hz)",
+                        type=float, default=0.5)
+    parser.add_argument("--max_rate", help="maximum spikes rate (Hz)",
+                        type=float, default=5.0)
+    parser.add_argument("--random_seed",
+                        help="random seed of the synthetic sessions",
+                        type=int, default=0)
+    parser.add_argument("--n_workers",
+                        help="number of workers used to read units files",
+                        type=int, default=None)
+    parser.add_argument("--fit_max_units",
+                        help="maximum number of units of svEM fits",
+                        type=int, default=50)
+    parser.add_argument("--fit_max_trials",
+                        help="maximum number of trials of svEM fits",
+                        type=int, default=20)
+    parser.add_argument("--fit_n_latents",
+                        help="number of latent processes of svEM fits",
+                        type=int, default=3)
+    parser.add_argument("--fit_common_n_ind_points",
+                        help="common number of inducing points of svEM fits",
+                        type=int, default=10)
+    parser.add_argument("--fit_em_max_iter",
+                        help="number of EM iterations of svEM fits",
+                        type=int, default=2)
+    parser.add_argument("--n_threads", help="number of threads for PyTorch",
+                        type=int, default=6)
+    parser.add_argument("--work_dirname",
+                        help=("directory for the synthetic sessions and "
+                              "intermediate files (a temporary directory, "
+                              "removed at the end, if not given)"),
+                        type=str, default=None)
+    parser.add_argument("--label",
+                        help="label of the benchmark report (default: now)",
+                        type=str, default=None)
+    parser.add_argument("--report_filename_pattern",
+                        help="benchmark report filename pattern",
+                        type=str,
+                        default="../../results/benchmarks/pipeline_{:s}.{:s}")
+    parser.add_argument("--baseline_filename",
+                        help="JSON benchmark report to compare against",
+                        type=str, default=None)
+    args = parser.parse_args()
+
+    scales = [tuple(int(size) for size in scale.split("x"))
+              for scale in args.scales[1:-1].split(",")]
+    stages = set(args.stages[1:-1].split(","))
+    n_repeats = args.n_repeats
+    random_seed = args.random_seed
+    n_workers = args.n_workers
+    n_threads = args.n_threads
+    work_dirname = args.work_dirname
+    label = args.label
+    report_filename_pattern = args.report_filename_pattern
+    baseline_filename = args.baseline_filename
+    session_params = {"min_rate": args.min_rate, "max_rate": args.max_rate}
+    fit_params = {"max_units": args.fit_max_units,
+                  "max_trials": args.fit_max_trials,
+                  "n_latents": args.fit_n_latents,
+                  "common_n_ind_points": args.fit_common_n_ind_points,
+                  "em_max_iter": args.fit_em_max_iter}
+
+    invalid_stages = stages.difference(stages_names)
+    if len(invalid_stages) > 0:
+        raise ValueError("Invalid stages {:s}. Supported stages are "
+                         "{:s}".format(", ".join(sorted(invalid_stages)),
+                                       ", ".join(stages_names)))
+    if label is None:
+        label = time.strftime("%Y%m%d%H%M%S")
+    torch.set_num_threads(n_threads)
+
+    results = []
+    fitted_sizes = set()
+    with contextlib.ExitStack() as stack:
+        if work_dirname is None:
+            work_dirname = stack.enter_context(tempfile.TemporaryDirectory())
+        for i, (n_units, n_trials) in enumerate(scales):
+            results.extend(run_scale_benchmarks(
+                n_units=n_units, n_trials=n_trials, stages=stages,
+                n_repeats=n_repeats, work_dirname=work_dirname,
+                session_params=dict(session_params,
+                                    random_seed=random_seed + i),
+                n_workers=n_workers, fit_params=fit_params,
+                fitted_sizes=fitted_sizes))
+
+    report = {"label": label,
+              "environment": get_environment(),
+              "args": vars(args),
+              "results": results}
+    report_filename = report_filename_pattern.format(label, "json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_filename)),
+                exist_ok=True)
+    with open(report_filename, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved {report_filename}")
+    results_filename = report_filename_pattern.format(label, "csv")
+    pd.DataFrame(results).to_csv(results_filename, index=False)
+    print(f"Saved {results_filename}")
+
+    if baseline_filename is not None:
+        comparison = compare_with_baseline(
+            results=results, baseline_filename=baseline_filename)
+        print(comparison.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
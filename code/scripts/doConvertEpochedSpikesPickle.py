@@ -0,0 +1,53 @@
+import sys
+import argparse
+import pickle
+
+import epochedSpikesStore
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subject_name", help="subject name",
+                        type=str, default="BLA00")
+    parser.add_argument("--region", help="brain region",
+                        type=str, default="BLA")
+    parser.add_argument("--epoch_event_name", help="epoch event name",
+                        type=str, default="DoorOpen")
+    parser.add_argument("--epoched_spikes_times_filename_pattern",
+                        help="epoched spikes times filename pattern",
+                        type=str,
+                        default=("../../results/epochedSpikes_subject_{:s}_"
+                                 "region_{:s}_epochedBy_{:s}.{:s}"))
+    args = parser.parse_args()
+
+    subject_name = args.subject_name
+    region = args.region
+    epoch_event_name = args.epoch_event_name
+    epoched_spikes_times_filename_pattern = \
+        args.epoched_spikes_times_filename_pattern
+
+    epoched_spikes_times_filename = \
+        epoched_spikes_times_filename_pattern.format(
+            subject_name, region, epoch_event_name, "pickle")
+    with open(epoched_spikes_times_filename, "rb") as f:
+        load_res = pickle.load(f)
+
+    epoched_spikes_times, epoched_offsets = \
+        epochedSpikesStore.lists_to_epoched_spikes_times(
+            spikes_times=load_res["spikes_times"])
+    saved_filenames = epochedSpikesStore.save(
+        filename_pattern=epoched_spikes_times_filename_pattern.format(
+            subject_name, region, epoch_event_name, "{:s}"),
+        epoched_spikes_times=epoched_spikes_times,
+        epoched_offsets=epoched_offsets,
+        units_ids=load_res["units_ids"],
+        trials_ids=load_res["trials_ids"],
+        trials_start_times=load_res["trials_start_times"],
+        trials_end_times=load_res["trials_end_times"],
+        trials_info=load_res["trials_info"],
+        epoch_times=load_res["trials_info"][epoch_event_name])
+    print(f"Converted {epoched_spikes_times_filename} to {saved_filenames}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,315 @@
+import sys
+import os
+import argparse
+import configparser
+import itertools
+import traceback
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import torch
+
+import epochedSpikesStore
+import estimationUtils
+import crossValidationUtils
+import modelExport
+
+# epoched spikes store and selected trials, opened once by every worker
+# process
+worker_data = {}
+
+
+def init_worker(n_threads, epoched_spikes_times_filename, trials_ids_filename,
+                align_event_name):
+    torch.set_num_threads(n_threads)
+    epoched_spikes, trials_indices, _, _, _ = \
+        estimationUtils.load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+    worker_data["epoched_spikes"] = epoched_spikes
+    worker_data["trials_indices"] = trials_indices
+
+
+def estimate_fold(job):
+    epoched_spikes = worker_data["epoched_spikes"]
+    trials_indices = worker_data["trials_indices"]
+    train_trials_indices = trials_indices[job["train_trials"]]
+    test_trials_indices = trials_indices[job["test_trials"]]
+    n_latents = job["n_latents"]
+
+    est_init_config = configparser.ConfigParser()
+    est_init_config.read(job["est_init_config_filename"])
+    args = dict(job["args"])
+    args["common_n_ind_points"] = job["common_n_ind_points"]
+
+    def get_params_fn(n_neurons, n_trials, trials_start_times,
+                      trials_end_times):
+        return estimationUtils.get_params_and_kernels_types(
+            est_init_config=est_init_config, args=args, n_latents=n_latents,
+            n_neurons=n_neurons, n_trials=n_trials,
+            trials_start_times=trials_start_times,
+            trials_end_times=trials_end_times)
+
+    spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes, trials_indices=train_trials_indices)
+    params, kernels_types = get_params_fn(
+        n_neurons=epoched_spikes["n_units"],
+        n_trials=len(train_trials_indices),
+        trials_start_times=epoched_spikes["trials_start_times"][
+            train_trials_indices].tolist(),
+        trials_end_times=epoched_spikes["trials_end_times"][
+            train_trials_indices].tolist())
+    model = estimationUtils.build_model(kernels_types=kernels_types,
+                                        params=params,
+                                        spikes_times=spikes_times)
+    lowerBoundHist, elapsedTimeHist, terminationInfo, _ = \
+        estimationUtils.maximize(model=model, params=params,
+                                 printIterationModelParams=False)
+    estimated_params = modelExport.get_estimated_params(model=model)
+    estimated_params["trials_ids"] = \
+        epoched_spikes["trials_ids"][train_trials_indices]
+    estimated_params["units_ids"] = epoched_spikes["units_ids"]
+
+    heldout_ell, heldout_n_spikes = crossValidationUtils.evaluate_heldout(
+        estimated_params=estimated_params, epoched_spikes=epoched_spikes,
+        trials_indices=test_trials_indices,
+        heldin_units=job["heldin_units"], heldout_units=job["heldout_units"],
+        get_params_fn=get_params_fn, em_max_iter=job["heldout_em_max_iter"])
+    summary = {"train_lower_bound": lowerBoundHist[-1],
+               "n_iterations": len(lowerBoundHist) - 1,
+               "elapsed_time": elapsedTimeHist[-1],
+               "termination": terminationInfo.message,
+               "heldout_ell": heldout_ell,
+               "heldout_n_spikes": heldout_n_spikes}
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("est_init_number", help="estimation init number",
+                        type=int)
+    parser.add_argument("--n_latents_grid",
+                        help="numbers of latent processes (e.g., [2,5,10])",
+                        type=str, default="[10]")
+    parser.add_argument("--common_n_ind_points_grid",
+                        help=("common numbers of inducing points (e.g., "
+                              "[10,15])"),
+                        type=str, default="[15]")
+    parser.add_argument("--n_folds", help="number of trials folds",
+                        type=int, default=5)
+    parser.add_argument("--folds_random_seed",
+                        help=("random seed shuffling the trials before "
+                              "splitting them into folds"),
+                        type=int, default=0)
+    parser.add_argument("--heldout_units_fraction",
+                        help=("fraction of units whose spikes in held-out "
+                              "trials are predicted from the latents "
+                              "inferred from the other units (if zero, "
+                              "the spikes of all units are used to infer the "
+                              "latents and to evaluate them)"),
+                        type=float, default=0.2)
+    parser.add_argument("--heldout_units_random_seed",
+                        help="random seed choosing the held-out units",
+                        type=int, default=0)
+    parser.add_argument("--heldout_em_max_iter",
+                        help=("number of E-step only EM iterations inferring "
+                              "the latents of held-out trials"),
+                        type=int, default=5)
+    parser.add_argument("--n_threads",
+                        help="total number of threads for PyTorch",
+                        type=int, default=os.cpu_count())
+    parser.add_argument("--n_workers",
+                        help="number of folds estimated in parallel",
+                        type=int, default=None)
+    parser.add_argument("--epoched_spikes_times_filename_pattern",
+                        help="epoched spikes times filename pattern",
+                        type=str,
+                        default=("../../results/epochedSpikes_subject_{:s}_"
+                                 "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to the epoch event of the "
+                              "session store instead of read from an "
+                              "epoched store)"),
+                        type=str, default=None)
+    parser.add_argument("--est_init_config_filename_pattern",
+                        help="estimation initialization filename pattern",
+                        type=str,
+                        default="../../init/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--trials_ids_filename", help="trials ids filename",
+                        type=str, default="../../init/trialsIDs_0_49.csv")
+    parser.add_argument("--folds_summary_filename",
+                        help="filename of the folds estimations table",
+                        type=str,
+                        default="../../results/crossValidationFolds.csv")
+    parser.add_argument("--summary_filename",
+                        help="filename of the configurations summary table",
+                        type=str,
+                        default="../../results/crossValidation.csv")
+    parser.add_argument("--best_config_filename",
+                        help="filename of the best configuration",
+                        type=str,
+                        default="../../results/crossValidationBest.ini")
+    parsed, unknown = parser.parse_known_args()
+    for arg in unknown:
+        if arg.startswith(("-", "--")):
+            # you can pass any arguments to add_argument
+            parser.add_argument(arg.split('=')[0], type=str)
+    args = parser.parse_args()
+
+    est_init_number = args.est_init_number
+    n_latents_grid = [int(str) for str in args.n_latents_grid[1:-1].split(",")]
+    common_n_ind_points_grid = \
+        [int(str) for str in args.common_n_ind_points_grid[1:-1].split(",")]
+    n_folds = args.n_folds
+    folds_random_seed = args.folds_random_seed
+    heldout_units_fraction = args.heldout_units_fraction
+    heldout_units_random_seed = args.heldout_units_random_seed
+    heldout_em_max_iter = args.heldout_em_max_iter
+    n_threads = args.n_threads
+    n_workers = args.n_workers
+    epoched_spikes_times_filename_pattern = \
+        args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
+    est_init_config_filename_pattern = args.est_init_config_filename_pattern
+    trials_ids_filename = args.trials_ids_filename
+    folds_summary_filename = args.folds_summary_filename
+    summary_filename = args.summary_filename
+    best_config_filename = args.best_config_filename
+
+    est_init_config_filename = est_init_config_filename_pattern.format(
+        est_init_number)
+    est_init_config = configparser.ConfigParser()
+    est_init_config.read(est_init_config_filename)
+    subject_name = est_init_config["data_params"]["subject_name"]
+    region = est_init_config["data_params"]["region"]
+    epoch_event_name = est_init_config["data_params"]["epoch_event_name"]
+
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        align_event_name = None
+    else:
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        align_event_name = epoch_event_name
+    # every worker opens the store itself; only the folds are sent to them
+    epoched_spikes, trials_indices, _, _, _ = \
+        estimationUtils.load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+    folds = crossValidationUtils.get_folds(n_trials=len(trials_indices),
+                                           n_folds=n_folds,
+                                           random_seed=folds_random_seed)
+    heldin_units, heldout_units = crossValidationUtils.get_heldout_units(
+        n_units=epoched_spikes["n_units"],
+        heldout_units_fraction=heldout_units_fraction,
+        random_seed=heldout_units_random_seed)
+
+    jobs = []
+    for n_latents, common_n_ind_points in itertools.product(
+            n_latents_grid, common_n_ind_points_grid):
+        for fold_index, test_trials in enumerate(folds):
+            train_trials = np.setdiff1d(np.arange(len(trials_indices)),
+                                        test_trials)
+            jobs.append({
+                "n_latents": n_latents,
+                "common_n_ind_points": common_n_ind_points,
+                "fold": fold_index,
+                "train_trials": train_trials,
+                "test_trials": test_trials,
+                "heldin_units": heldin_units,
+                "heldout_units": heldout_units,
+                "heldout_em_max_iter": heldout_em_max_iter,
+                "est_init_config_filename": est_init_config_filename,
+                "args": vars(args),
+            })
+
+    if n_workers is None:
+        n_workers = min(len(jobs), n_threads)
+    n_threads_per_worker = max(1, n_threads // n_workers)
+    print(f"Running {len(jobs)} fold estimations in {n_workers} workers with "
+          f"{n_threads_per_worker} threads each")
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(n_threads_per_worker, epoched_spikes_times_filename,
+                      trials_ids_filename, align_event_name)) as executor:
+        futures = {executor.submit(estimate_fold, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            row = {"n_latents": job["n_latents"],
+                   "common_n_ind_points": job["common_n_ind_points"],
+                   "fold": job["fold"]}
+            try:
+                row.update(future.result())
+            except Exception as e:
+                print(traceback.format_exc())
+                row.update({"train_lower_bound": np.nan, "n_iterations": 0,
+                            "elapsed_time": np.nan,
+                            "termination": f"Error: {e}",
+                            "heldout_ell": np.nan, "heldout_n_spikes": 0})
+            row["heldout_ell_per_spike"] = \
+                row["heldout_ell"] / max(row["heldout_n_spikes"], 1)
+            print(f"Finished fold {row['fold']} of {row['n_latents']} "
+                  f"latents and {row['common_n_ind_points']} inducing "
+                  f"points: held-out expected log-likelihood per spike "
+                  f"{row['heldout_ell_per_spike']}")
+            rows.append(row)
+
+    folds_summary = pd.DataFrame(rows).sort_values(
+        by=["n_latents", "common_n_ind_points", "fold"])
+    folds_summary.to_csv(folds_summary_filename, index=False)
+    print(f"Saved {folds_summary_filename}")
+
+    # all configurations are evaluated on the same held-out spikes, so their
+    # summed expected log-likelihoods are comparable; configurations with a
+    # failed fold rank last
+    grouped = folds_summary.groupby(["n_latents", "common_n_ind_points"])
+    summary = grouped.agg(
+        heldout_ell=("heldout_ell", lambda ell: ell.sum(min_count=n_folds)),
+        heldout_n_spikes=("heldout_n_spikes", "sum"),
+        heldout_ell_per_spike_sem=("heldout_ell_per_spike", "sem"),
+        train_lower_bound=("train_lower_bound", "mean"),
+        elapsed_time=("elapsed_time", "sum")).reset_index()
+    summary.insert(4, "heldout_ell_per_spike",
+                   summary["heldout_ell"] /
+                   summary["heldout_n_spikes"].clip(lower=1))
+    summary = summary.sort_values(
+        by=["heldout_ell_per_spike", "elapsed_time"], ascending=[False, True],
+        na_position="last")
+    summary.insert(0, "rank", np.arange(1, len(summary) + 1))
+    summary.to_csv(summary_filename, index=False)
+    print(summary.to_string(index=False))
+    print(f"Saved {summary_filename}")
+
+    best = summary.iloc[0]
+    best_config = configparser.ConfigParser()
+    best_config["cross_validation_params"] = {
+        "est_init_number": est_init_number,
+        "n_latents": int(best["n_latents"]),
+        "common_n_ind_points": int(best["common_n_ind_points"]),
+        "heldout_ell_per_spike": best["heldout_ell_per_spike"],
+        "n_folds": n_folds,
+        "folds_random_seed": folds_random_seed,
+        "heldout_units_fraction": heldout_units_fraction,
+        "heldout_units_random_seed": heldout_units_random_seed,
+        "trials_ids_filename": trials_ids_filename,
+    }
+    with open(best_config_filename, "w") as f:
+        best_config.write(f)
+    print(f"Best configuration: --n_latents {int(best['n_latents'])} "
+          f"--common_n_ind_points {int(best['common_n_ind_points'])}")
+    print(f"Saved {best_config_filename}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,249 @@
+import sys
+import os
+import time
+import argparse
+import traceback
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+import spikesTimesLoader
+import epochingUtils
+
+
+def discover_subjects_regions(data_dirname, trials_info_filename,
+                              subjects_names=None, regions=None):
+    """Returns the ``(subject_name, region)`` pairs under ``data_dirname``:
+    every directory with a ``trials_info_filename`` file is a subject and
+    every directory inside it a region. ``subjects_names`` and ``regions``,
+    if given, restrict the returned pairs."""
+    subjects_regions = []
+    for subject_name in sorted(os.listdir(data_dirname)):
+        subject_dirname = os.path.join(data_dirname, subject_name)
+        if not os.path.isfile(os.path.join(subject_dirname,
+                                           trials_info_filename)):
+            continue
+        if subjects_names is not None and subject_name not in subjects_names:
+            continue
+        for region in sorted(os.listdir(subject_dirname)):
+            if not os.path.isdir(os.path.join(subject_dirname, region)):
+                continue
+            if regions is not None and region not in regions:
+                continue
+            subjects_regions.append((subject_name, region))
+    return subjects_regions
+
+
+def run_job(job):
+    """Runs a spikes cache (``job["type"] == "cache"``) or an epoching
+    (``job["type"] == "epoch"``) job and returns its elapsed time."""
+    start_time = time.time()
+    if job["type"] == "cache":
+        spikesTimesLoader.load_units_spikes_times(**job["kwargs"])
+    elif job["type"] == "epoch":
+        epochingUtils.epoch_spikes_times(**job["kwargs"])
+    else:
+        raise ValueError(f"Invalid job type {job['type']}")
+    elapsed_time = time.time() - start_time
+    return elapsed_time
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dirname", help="data dirname", type=str,
+                        default="../../data")
+    parser.add_argument("--trials_info_filename",
+                        help="trails info filename", type=str,
+                        default="behavior_data.csv")
+    parser.add_argument("--subjects_names",
+                        help=("subjects to epoch (e.g., [subject1,subject2]; "
+                              "all subjects in data_dirname if not given)"),
+                        type=str, default=None)
+    parser.add_argument("--regions",
+                        help=("regions to epoch (e.g., [region1,region2]; all "
+                              "regions of every subject if not given)"),
+                        type=str, default=None)
+    parser.add_argument("--epoch_events_names",
+                        help="epoch events names (e.g., [DoorOpen,TrialOn])",
+                        type=str, default="[DoorOpen]")
+    parser.add_argument("--session_store",
+                        help=("also save a session store for every subject "
+                              "and region"),
+                        action="store_true")
+    parser.add_argument("--epoch_start_event_name",
+                        help="trial start event name", type=str,
+                        default="TrialOn")
+    parser.add_argument("--epoch_end_event_name", help="trial end event name",
+                        type=str, default="TrialOff")
+    parser.add_argument("--results_filename_pattern",
+                        help="results filename pattern",
+                        type=str,
+                        default=("../../results/epochedSpikes_subject_{:s}_"
+                                 "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_store_filename_pattern",
+                        help="session store filename pattern",
+                        type=str,
+                        default=("../../results/sessionSpikes_subject_{:s}_"
+                                 "region_{:s}.{:s}"))
+    parser.add_argument("--spikes_cache_filename_pattern",
+                        help=("filename pattern of the consolidated spikes "
+                              "times cache (empty string to disable it)"),
+                        type=str,
+                        default=("../../results/spikesTimes_subject_{:s}_"
+                                 "region_{:s}.{:s}"))
+    parser.add_argument("--n_workers",
+                        help="number of jobs run concurrently",
+                        type=int, default=os.cpu_count())
+    parser.add_argument("--n_read_workers",
+                        help=("number of threads used by every job to read "
+                              "units files"),
+                        type=int, default=4)
+    parser.add_argument("--force",
+                        help="epoch even if the results are up to date",
+                        action="store_true")
+    parser.add_argument("--summary_filename",
+                        help="jobs summary filename", type=str,
+                        default="../../results/epochSpikesTimesBatch.csv")
+    args = parser.parse_args()
+
+    data_dirname = args.data_dirname
+    trials_info_filename = args.trials_info_filename
+    if args.subjects_names is not None:
+        subjects_names = [str for str in
+                          args.subjects_names[1:-1].split(",")]
+    else:
+        subjects_names = None
+    if args.regions is not None:
+        regions = [str for str in args.regions[1:-1].split(",")]
+    else:
+        regions = None
+    epoch_events_names = [str for str in
+                          args.epoch_events_names[1:-1].split(",")]
+    session_store = args.session_store
+    epoch_start_event_name = args.epoch_start_event_name
+    epoch_end_event_name = args.epoch_end_event_name
+    results_filename_pattern = args.results_filename_pattern
+    session_store_filename_pattern = args.session_store_filename_pattern
+    spikes_cache_filename_pattern = args.spikes_cache_filename_pattern
+    n_workers = args.n_workers
+    n_read_workers = args.n_read_workers
+    force = args.force
+    summary_filename = args.summary_filename
+
+    subjects_regions = discover_subjects_regions(
+        data_dirname=data_dirname, trials_info_filename=trials_info_filename,
+        subjects_names=subjects_names, regions=regions)
+
+    # epoching jobs of a subject and region depend on the job building their
+    # spikes cache, so units files are only read once per subject and region;
+    # jobs without dependencies are in first_jobs
+    rows = []
+    first_jobs = []
+    dependent_jobs = {}
+    for subject_name, region in subjects_regions:
+        inputs_signature = epochingUtils.get_inputs_signature(
+            data_dirname=data_dirname, subject_name=subject_name,
+            region=region, trials_info_filename=trials_info_filename)
+        if len(spikes_cache_filename_pattern) > 0:
+            cache_filename_pattern = spikes_cache_filename_pattern.format(
+                subject_name, region, "{:s}")
+        else:
+            cache_filename_pattern = None
+        stores_params = [(epoch_event_name, False)
+                         for epoch_event_name in epoch_events_names]
+        if session_store:
+            stores_params.append(("None", True))
+        epoch_jobs = []
+        for epoch_event_name, is_session_store in stores_params:
+            if is_session_store:
+                job_name = f"{subject_name}/{region}/session"
+            else:
+                job_name = f"{subject_name}/{region}/{epoch_event_name}"
+            store_filename_pattern = epochingUtils.get_store_filename_pattern(
+                subject_name=subject_name, region=region,
+                epoch_event_name=epoch_event_name,
+                results_filename_pattern=results_filename_pattern,
+                session_store=is_session_store,
+                session_store_filename_pattern=session_store_filename_pattern)
+            epoch_params = epochingUtils.get_epoch_params(
+                subject_name=subject_name, region=region,
+                epoch_event_name=epoch_event_name,
+                epoch_start_event_name=epoch_start_event_name,
+                epoch_end_event_name=epoch_end_event_name,
+                data_dirname=data_dirname,
+                trials_info_filename=trials_info_filename,
+                session_store=is_session_store)
+            if not force and epochingUtils.is_up_to_date(
+                    store_filename_pattern=store_filename_pattern,
+                    epoch_params=epoch_params,
+                    inputs_signature=inputs_signature):
+                rows.append({"job": job_name, "status": "up to date",
+                             "elapsed_time": 0.0})
+                continue
+            epoch_jobs.append({
+                "name": job_name, "type": "epoch",
+                "kwargs": dict(
+                    epoch_params,
+                    results_filename_pattern=results_filename_pattern,
+                    session_store=is_session_store,
+                    session_store_filename_pattern=(
+                        session_store_filename_pattern),
+                    cache_filename_pattern=cache_filename_pattern,
+                    n_workers=n_read_workers)})
+        if len(epoch_jobs) == 0:
+            continue
+        if cache_filename_pattern is not None:
+            cache_job = {"name": f"{subject_name}/{region}/cache",
+                         "type": "cache",
+                         "kwargs": {"spikes_dirname": os.path.join(
+                                        data_dirname, subject_name, region),
+                                    "cache_filename_pattern":
+                                        cache_filename_pattern,
+                                    "n_workers": n_read_workers}}
+            first_jobs.append(cache_job)
+            dependent_jobs[cache_job["name"]] = epoch_jobs
+        else:
+            first_jobs.extend(epoch_jobs)
+    n_jobs = len(first_jobs) + sum(len(jobs)
+                                   for jobs in dependent_jobs.values())
+    print(f"Running {n_jobs} jobs for {len(subjects_regions)} subjects and "
+          f"regions in {n_workers} workers ({len(rows)} up to date)")
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(run_job, job): job for job in first_jobs}
+        while len(futures) > 0:
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                next_jobs = dependent_jobs.get(job["name"], [])
+                try:
+                    elapsed_time = future.result()
+                    status = "done"
+                    for next_job in next_jobs:
+                        futures[executor.submit(run_job, next_job)] = \
+                            next_job
+                except Exception as e:
+                    print(traceback.format_exc())
+                    elapsed_time = np.nan
+                    status = f"Error: {e}"
+                    for next_job in next_jobs:
+                        rows.append({"job": next_job["name"],
+                                     "status": (f"Error: {job['name']} "
+                                                "failed"),
+                                     "elapsed_time": np.nan})
+                rows.append({"job": job["name"], "status": status,
+                             "elapsed_time": elapsed_time})
+                print(f"Finished {job['name']}: {status}")
+
+    summary = pd.DataFrame(rows, columns=["job", "status", "elapsed_time"])
+    summary.to_csv(summary_filename, index=False)
+    print(summary.to_string(index=False))
+    print(f"Saved {summary_filename}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,21 +1,22 @@
+import os
 import sys
-import os.path
-import random
+import copy
 import torch
-import pickle
 import argparse
 import configparser
 import numpy as np
 
-import gcnu_common.utils.neural_data_analysis
-import gcnu_common.utils.config_dict
-import svGPFA.stats.svGPFAModelFactory
-import svGPFA.stats.svEM
-import svGPFA.utils.configUtils
-import svGPFA.utils.miscUtils
-import svGPFA.utils.initUtils
-
-import socialMiceUtils
+import epochedSpikesStore
+import estimationUtils
+import estimationProfiler
+import durationBuckets
+import indPointsAllocation
+import socialMiceSVEM
+import modelExport
+import performanceTuning
+import resultsCache
+import resultsIndex
+import warmStartUtils
 
 # import svGPFA.utils.my_globals
 
@@ -28,6 +29,31 @@ def main(argv):
                         type=int, default=10)
     parser.add_argument("--n_threads", help="number of threads for PyTorch",
                         type=int, default=6)
+    parser.add_argument("--n_interop_threads",
+                        help="number of inter-op threads for PyTorch",
+                        type=int, default=None)
+    parser.add_argument("--autotune_threads",
+                        help=("calibrate the number of threads for PyTorch "
+                              "on a short estimation and use the fastest"),
+                        action="store_true")
+    parser.add_argument("--autotune_n_threads_candidates",
+                        help=("numbers of threads to calibrate (e.g., "
+                              "[1,2,4,8]; if not given, powers of two up to "
+                              "the number of CPUs, and --n_threads)"),
+                        type=str, default=None)
+    parser.add_argument("--autotune_n_trials",
+                        help="number of trials of calibration estimations",
+                        type=int, default=4)
+    parser.add_argument("--autotune_n_iter",
+                        help=("number of iterations of every EM step of "
+                              "calibration estimations"),
+                        type=int, default=2)
+    parser.add_argument("--reduced_precision",
+                        help=("evaluate the expected log-likelihood in "
+                              "single precision (kernel matrices of inducing "
+                              "points, their Cholesky factors and the KL "
+                              "divergence stay in double precision)"),
+                        action="store_true")
     parser.add_argument("--common_n_ind_points",
                         help="common number of inducing points",
                         type=int, default=15)
@@ -36,6 +62,12 @@ def main(argv):
                         type=str,
                         default=("../../results/epochedSpikes_subject_{:s}_"
                                  "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to the epoch event of the "
+                              "session store instead of read from an "
+                              "epoched store)"),
+                        type=str, default=None)
     parser.add_argument("--est_init_config_filename_pattern",
                         help="estimation initialization filename pattern",
                         type=str,
@@ -50,6 +82,148 @@ def main(argv):
                         help="model save filename pattern",
                         type=str,
                         default="../../results/{:08d}_estimatedModel.pickle")
+    parser.add_argument("--model_export_filename_pattern",
+                        help=("filename pattern of the exported estimated "
+                              "parameters"),
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.npz")
+    parser.add_argument("--history_filename_pattern",
+                        help="estimation history filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimationHistory.npz")
+    parser.add_argument("--save_history",
+                        help=("save the lower bound, elapsed time and model "
+                              "parameters of every iteration next to the "
+                              "exported parameters"),
+                        action="store_true")
+    parser.add_argument("--training_data_filename_pattern",
+                        help="training data filename pattern",
+                        type=str,
+                        default=("../../results/{:08d}_trainingData."
+                                 "{:s}"))
+    parser.add_argument("--save_training_data",
+                        help=("save the spikes of the estimation trials "
+                              "next to the exported parameters"),
+                        action="store_true")
+    parser.add_argument("--skip_results_pickle",
+                        help=("do not save the results pickle with the "
+                              "model, training data and iterations history"),
+                        action="store_true")
+    parser.add_argument("--checkpoint_filename_pattern",
+                        help="checkpoint filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_checkpoint.pickle")
+    parser.add_argument("--checkpoint_every_n_iter",
+                        help="save a checkpoint every this many EM iterations",
+                        type=int, default=None)
+    parser.add_argument("--checkpoint_every_n_secs",
+                        help="save a checkpoint every this many seconds",
+                        type=float, default=1800.0)
+    parser.add_argument("--resume_from",
+                        help="checkpoint filename to resume estimation from",
+                        type=str, default=None)
+    parser.add_argument("--warm_start_from",
+                        help=("estimated model filename whose parameters "
+                              "initialize the latents, trials and units it "
+                              "shares with this estimation"),
+                        type=str, default=None)
+    parser.add_argument("--duration_bucket_tol",
+                        help=("group trials whose durations differ by less "
+                              "than this relative tolerance into buckets "
+                              "sharing padded windows, inducing points and "
+                              "kernel matrices (if not given every trial has "
+                              "its own)"),
+                        type=float, default=None)
+    parser.add_argument("--ind_points_per_sec",
+                        help=("allocate to every trial this many inducing "
+                              "points per second of its duration (if not "
+                              "given every trial has --common_n_ind_points "
+                              "inducing points)"),
+                        type=float, default=None)
+    parser.add_argument("--ind_points_per_spike",
+                        help=("additionally allocate to every trial this "
+                              "many inducing points per spike"),
+                        type=float, default=0.0)
+    parser.add_argument("--min_n_ind_points",
+                        help="minimum number of inducing points of a trial",
+                        type=int, default=5)
+    parser.add_argument("--max_n_ind_points",
+                        help=("maximum number of inducing points of a trial "
+                              "(if not given --common_n_ind_points)"),
+                        type=int, default=None)
+    parser.add_argument("--n_ind_points_step",
+                        help=("round the numbers of inducing points up to a "
+                              "multiple of this step, to limit the number of "
+                              "distinct allocations"),
+                        type=int, default=5)
+    parser.add_argument("--convergence_rel_tol",
+                        help=("stop when the relative improvement of the "
+                              "lower bound over the last "
+                              "--convergence_window iterations falls below "
+                              "this tolerance"),
+                        type=float, default=None)
+    parser.add_argument("--convergence_window",
+                        help=("number of EM iterations over which the "
+                              "relative improvement of the lower bound is "
+                              "measured"),
+                        type=int, default=5)
+    parser.add_argument("--convergence_min_iter",
+                        help=("minimum number of EM iterations before the "
+                              "relative improvement criterion can stop the "
+                              "estimation"),
+                        type=int, default=1)
+    parser.add_argument("--max_elapsed_secs",
+                        help=("stop before an EM iteration would end after "
+                              "this many seconds of estimation"),
+                        type=float, default=None)
+    parser.add_argument("--max_step_secs",
+                        help=("stop after an EM iteration with a step longer "
+                              "than this many seconds"),
+                        type=float, default=None)
+    parser.add_argument("--results_cache_index_filename",
+                        help=("index of the estimation results, used to "
+                              "reuse the result of an identical estimation "
+                              "and to evict least recently used results"),
+                        type=str,
+                        default="../../results/estimationResultsCache.json")
+    parser.add_argument("--results_cache_max_gb",
+                        help=("delete the files of the least recently used "
+                              "estimation results in the index beyond this "
+                              "size in GB (if not given results are never "
+                              "deleted)"),
+                        type=float, default=None)
+    parser.add_argument("--results_index_filename",
+                        help=("SQLite index where a summary of the "
+                              "estimation is recorded"),
+                        type=str,
+                        default="../../results/estimationResults.sqlite")
+    parser.add_argument("--ignore_results_cache",
+                        help=("estimate even if an identical estimation "
+                              "already terminated, replacing its results"),
+                        action="store_true")
+    parser.add_argument("--profile_filename_pattern",
+                        help="estimation profile filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimation_profile.{:s}")
+    parser.add_argument("--profile_mode",
+                        help=("additionally profile the estimation with "
+                              "cProfile or torch.profiler (none, cprofile "
+                              "or torch)"),
+                        type=str, default="none")
+    parser.add_argument("--trials_batch_size",
+                        help=("number of trials per minibatch (if not given "
+                              "all trials are used at once)"),
+                        type=int, default=None)
+    parser.add_argument("--trials_batch_schedule",
+                        help="minibatch schedule (sequential or shuffled)",
+                        type=str, default="shuffled")
+    parser.add_argument("--n_iter_per_trials_batch",
+                        help=("number of iterations of the EM steps per "
+                              "minibatch and EM iteration"),
+                        type=int, default=1)
+    parser.add_argument("--trials_batch_random_seed",
+                        help="random seed of shuffled minibatches",
+                        type=int, default=None)
     parsed, unknown = parser.parse_known_args()
     for arg in unknown:
         if arg.startswith(("-", "--")):
@@ -60,174 +234,553 @@ def main(argv):
     est_init_number = args.est_init_number
     n_latents = args.n_latents
     n_threads = args.n_threads
+    n_interop_threads = args.n_interop_threads
+    autotune_threads = args.autotune_threads
+    if args.autotune_n_threads_candidates is None:
+        autotune_n_threads_candidates = \
+            performanceTuning.get_n_threads_candidates()
+    else:
+        autotune_n_threads_candidates = \
+            [int(str) for str in
+             args.autotune_n_threads_candidates[1:-1].split(",")]
+    if n_threads not in autotune_n_threads_candidates:
+        autotune_n_threads_candidates = sorted(
+            autotune_n_threads_candidates + [n_threads])
+    autotune_n_trials = args.autotune_n_trials
+    autotune_n_iter = args.autotune_n_iter
+    reduced_precision = args.reduced_precision
     common_n_ind_points = args.common_n_ind_points
     epoched_spikes_times_filename_pattern = \
         args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
     est_init_config_filename_pattern = args.est_init_config_filename_pattern
     estim_res_metadata_filename_pattern = \
         args.estim_res_metadata_filename_pattern
     trials_ids_filename = args.trials_ids_filename
     model_save_filename_pattern = args.model_save_filename_pattern
+    model_export_filename_pattern = args.model_export_filename_pattern
+    history_filename_pattern = args.history_filename_pattern
+    save_history = args.save_history
+    training_data_filename_pattern = args.training_data_filename_pattern
+    save_training_data = args.save_training_data
+    skip_results_pickle = args.skip_results_pickle
+    checkpoint_filename_pattern = args.checkpoint_filename_pattern
+    checkpoint_every_n_iter = args.checkpoint_every_n_iter
+    checkpoint_every_n_secs = args.checkpoint_every_n_secs
+    resume_from = args.resume_from
+    warm_start_from = args.warm_start_from
+    duration_bucket_tol = args.duration_bucket_tol
+    ind_points_per_sec = args.ind_points_per_sec
+    ind_points_per_spike = args.ind_points_per_spike
+    min_n_ind_points = args.min_n_ind_points
+    max_n_ind_points = args.max_n_ind_points
+    if max_n_ind_points is None:
+        max_n_ind_points = common_n_ind_points
+    n_ind_points_step = args.n_ind_points_step
+    convergence_rel_tol = args.convergence_rel_tol
+    convergence_window = args.convergence_window
+    convergence_min_iter = args.convergence_min_iter
+    max_elapsed_secs = args.max_elapsed_secs
+    max_step_secs = args.max_step_secs
+    results_cache_index_filename = args.results_cache_index_filename
+    if args.results_cache_max_gb is None:
+        results_cache_max_bytes = None
+    else:
+        results_cache_max_bytes = int(args.results_cache_max_gb * 2**30)
+    ignore_results_cache = args.ignore_results_cache
+    results_index_filename = args.results_index_filename
+    profile_filename_pattern = args.profile_filename_pattern
+    profile_mode = args.profile_mode
+    trials_batch_size = args.trials_batch_size
+    trials_batch_schedule = args.trials_batch_schedule
+    n_iter_per_trials_batch = args.n_iter_per_trials_batch
+    trials_batch_random_seed = args.trials_batch_random_seed
 
     est_init_config_filename = est_init_config_filename_pattern.format(
         est_init_number)
     est_init_config = configparser.ConfigParser()
     est_init_config.read(est_init_config_filename)
 
-    # fixing a bug in PyTorch
+    # setting the number of threads explicitly also fixes a bug in PyTorch
     # https://github.com/pytorch/pytorch/issues/90760
-    torch.set_num_threads(torch.get_num_threads())
+    torch.set_num_threads(n_threads)
+    if n_interop_threads is not None:
+        # can only be set before any inter-op parallel work
+        torch.set_num_interop_threads(n_interop_threads)
 
     subject_name = est_init_config["data_params"]["subject_name"]
     region = est_init_config["data_params"]["region"]
     epoch_event_name = est_init_config["data_params"]["epoch_event_name"]
 
+    if resume_from is not None:
+        checkpoint = socialMiceSVEM.load_checkpoint(
+            checkpoint_filename=resume_from)
+        # a resumed estimation keeps the minibatch settings it started with
+        minibatch_params = checkpoint.get("minibatch_params", None)
+    elif trials_batch_size is not None or ind_points_per_sec is not None:
+        # trials with different numbers of inducing points are estimated in
+        # different minibatches
+        minibatch_params = {"batch_size": trials_batch_size,
+                            "schedule": trials_batch_schedule,
+                            "n_iter_per_batch": n_iter_per_trials_batch,
+                            "random_seed": trials_batch_random_seed}
+    else:
+        minibatch_params = None
+    if reduced_precision and duration_bucket_tol is not None:
+        raise ValueError("Duration buckets cannot be used in reduced "
+                         "precision")
+    if minibatch_params is not None and duration_bucket_tol is not None:
+        raise ValueError("Duration buckets cannot be used with minibatches "
+                         "or per-trial inducing points allocations")
+    if ind_points_per_sec is not None and warm_start_from is not None:
+        raise ValueError("Per-trial inducing points allocations cannot be "
+                         "warm started")
+
     # get spike_times
-    epoched_spikes_times_filename = \
-        epoched_spikes_times_filename_pattern.format(
-            subject_name, region, epoch_event_name, "pickle")
-    with open(epoched_spikes_times_filename, "rb") as f:
-        load_res = pickle.load(f)
-    spikes_times = load_res["spikes_times"]
-    trials_start_times = load_res["trials_start_times"]
-    trials_end_times = load_res["trials_end_times"]
-    trials_info = load_res["trials_info"]
-
-    # subset selected_trials_ids
-    n_trials = len(spikes_times)
-    trials_ids = np.arange(n_trials)
-    selected_trials_ids = np.genfromtxt(trials_ids_filename, dtype=np.uint64)
-    spikes_times, trials_start_times, trials_end_times = \
-        socialMiceUtils.subset_trials_ids_data(
-            selected_trials_ids=selected_trials_ids,
-            trials_ids=trials_ids,
-            spikes_times=spikes_times,
-            trials_start_times=trials_start_times,
-            trials_end_times=trials_end_times)
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        align_event_name = None
+    else:
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        align_event_name = epoch_event_name
+
+    # estimation results are identified by a hash of the estimation inputs
+    # and of the arguments that change the estimated parameters
+    results_cache = resultsCache.ResultsCache(
+        index_filename=results_cache_index_filename,
+        filename_patterns=[estim_res_metadata_filename_pattern,
+                           model_save_filename_pattern,
+                           model_export_filename_pattern,
+                           history_filename_pattern,
+                           training_data_filename_pattern,
+                           checkpoint_filename_pattern,
+                           profile_filename_pattern],
+        max_bytes=results_cache_max_bytes)
 
-    n_trials = len(spikes_times)
+    def record_run(estResNumber, model_save_filename):
+        run_summary = resultsIndex.get_run_summary(
+            estResNumber=estResNumber,
+            estim_res_metadata_filename=estim_res_metadata_filename_pattern.
+            format(estResNumber),
+            est_init_config_filename_pattern=est_init_config_filename_pattern,
+            model_save_filename=model_save_filename,
+            model_export_filename=model_export_filename_pattern.format(
+                estResNumber),
+            history_filename=history_filename_pattern.format(estResNumber))
+        resultsIndex.record_runs(index_filename=results_index_filename,
+                                 summaries=[run_summary])
+        print(f"Recorded estimation result {estResNumber:08d} in "
+              f"{results_index_filename}")
 
-    n_neurons = len(spikes_times[0])
+    if resume_from is None:
+        not_estimation_args = [
+            "est_init_number", "n_threads", "n_interop_threads",
+            "autotune_threads", "autotune_n_threads_candidates",
+            "autotune_n_trials", "autotune_n_iter", "trials_ids_filename",
+            "save_history", "save_training_data", "skip_results_pickle",
+            "checkpoint_every_n_iter", "checkpoint_every_n_secs",
+            "resume_from", "warm_start_from", "results_cache_index_filename",
+            "results_cache_max_gb", "ignore_results_cache",
+            "results_index_filename", "profile_mode"]
+        estimation_args = {
+            key: value for key, value in vars(args).items()
+            if key not in not_estimation_args and
+            not key.endswith("_filename_pattern")}
+        # files referenced by the initialization (e.g., initial parameters)
+        init_filenames = [value for section in est_init_config.sections()
+                          for value in est_init_config[section].values()
+                          if os.path.isfile(value)]
+        estimation_filenames = \
+            epochedSpikesStore.get_filenames(
+                filename_pattern=epoched_spikes_times_filename) + \
+            [trials_ids_filename, est_init_config_filename] + init_filenames
+        if warm_start_from is not None:
+            estimation_filenames.append(warm_start_from)
+        cache_key = resultsCache.get_estimation_key(
+            filenames=estimation_filenames, params=estimation_args)
+        estResNumber, completed = resultsCache.find_estim_res_number(
+            estim_res_metadata_filename_pattern=
+            estim_res_metadata_filename_pattern, key=cache_key)
+        if completed and not ignore_results_cache:
+            evicted = results_cache.touch(key=cache_key,
+                                          estResNumber=estResNumber)
+            resultsIndex.delete_runs(index_filename=results_index_filename,
+                                     estim_res_numbers=evicted)
+            print(f"Estimation result {estResNumber:08d} was estimated with "
+                  "identical inputs, not estimating again")
+            record_run(estResNumber=estResNumber,
+                       model_save_filename=model_save_filename_pattern.format(
+                           estResNumber))
+            return
+    else:
+        cache_key, _ = resultsCache.read_estimation_key(
+            estim_res_metadata_filename=estim_res_metadata_filename_pattern.
+            format(checkpoint["estResNumber"]))
+
+    epoched_spikes, trials_indices, trials_start_times, trials_end_times, \
+        trials_info = estimationUtils.load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+    trials_ids = epoched_spikes["trials_ids"][trials_indices]
+    units_ids = epoched_spikes["units_ids"]
+    if minibatch_params is None:
+        spikes_times = epochedSpikesStore.get_spikes_times(
+            epoched_spikes=epoched_spikes, trials_indices=trials_indices)
+    else:
+        # spikes times are read from the store one minibatch at a time
+        spikes_times = None
+    n_trials = len(trials_indices)
+    n_neurons = epoched_spikes["n_units"]
     neurons_indices = np.arange(n_neurons)
+    if minibatch_params is not None and minibatch_params["batch_size"] is None:
+        # one minibatch per inducing points allocation
+        minibatch_params["batch_size"] = n_trials
 
-    #    build dynamic parameter specifications
-    args_info = svGPFA.utils.initUtils.getArgsInfo()
-    dynamic_params_spec = svGPFA.utils.initUtils.getParamsDictFromArgs(
-        n_latents=n_latents, n_trials=n_trials, args=vars(args),
-        args_info=args_info)
-    #   build config file parameters specification
-    strings_dict = gcnu_common.utils.config_dict.GetDict(
-        config=est_init_config).get_dict()
-    config_file_params_spec = \
-        svGPFA.utils.initUtils.getParamsDictFromStringsDict(
-            n_latents=n_latents, n_trials=n_trials,
-            strings_dict=strings_dict, args_info=args_info)
-    #    build default parameter specificiations
-    default_params_spec = svGPFA.utils.initUtils.getDefaultParamsDict(
-        n_neurons=n_neurons, n_trials=n_trials, n_latents=n_latents,
-        common_n_ind_points=common_n_ind_points)
-    #    finally, get the parameters from the dynamic,
-    #    configuration file and default parameter specifications
-    params, kernels_types, = \
-        svGPFA.utils.initUtils.getParamsAndKernelsTypes(
-            n_trials=n_trials, n_neurons=n_neurons, n_latents=n_latents,
+    if resume_from is not None:
+        ind_points_allocation_params = checkpoint.get(
+            "ind_points_allocation_params", None)
+    elif ind_points_per_sec is not None:
+        if ind_points_per_spike > 0:
+            trials_n_spikes = indPointsAllocation.get_trials_n_spikes(
+                epoched_spikes=epoched_spikes, trials_indices=trials_indices)
+        else:
+            trials_n_spikes = None
+        trials_n_ind_points = indPointsAllocation.get_trials_n_ind_points(
             trials_start_times=trials_start_times,
             trials_end_times=trials_end_times,
-            dynamic_params_spec=dynamic_params_spec,
-            config_file_params_spec=config_file_params_spec)
-            # config_file_params_spec=config_file_params_spec,
-            # default_params_spec=default_params_spec)
+            ind_points_per_sec=ind_points_per_sec,
+            min_n_ind_points=min_n_ind_points,
+            max_n_ind_points=max_n_ind_points,
+            trials_n_spikes=trials_n_spikes,
+            ind_points_per_spike=ind_points_per_spike,
+            n_ind_points_step=n_ind_points_step)
+        ind_points_allocation_params = {
+            "ind_points_per_sec": ind_points_per_sec,
+            "ind_points_per_spike": ind_points_per_spike,
+            "min_n_ind_points": min_n_ind_points,
+            "max_n_ind_points": max_n_ind_points,
+            "n_ind_points_step": n_ind_points_step,
+            "n_allocations": len(np.unique(trials_n_ind_points)),
+            "trials_n_ind_points": trials_n_ind_points.tolist()}
+        print(f"Allocated between {trials_n_ind_points.min()} and "
+              f"{trials_n_ind_points.max()} inducing points to {n_trials} "
+              f"trials ({ind_points_allocation_params['n_allocations']} "
+              f"distinct allocations)")
+    else:
+        ind_points_allocation_params = None
+    if ind_points_allocation_params is None:
+        trials_n_ind_points = None
+        params_args = vars(args)
+    else:
+        trials_n_ind_points = np.asarray(
+            ind_points_allocation_params["trials_n_ind_points"])
+        # parameters hold the largest allocation, padded for other trials
+        params_args = dict(vars(args),
+                           common_n_ind_points=int(trials_n_ind_points.max()))
 
-    kernels_params0 = params["initial_params"]["posterior_on_latents"]["kernels_matrices_store"]["kernels_params0"]
+    if duration_bucket_tol is None:
+        duration_buckets = None
+        duration_buckets_params = None
+        params_trials_end_times = trials_end_times
+    else:
+        duration_buckets = durationBuckets.get_duration_buckets(
+            trials_start_times=trials_start_times,
+            trials_end_times=trials_end_times, rel_tol=duration_bucket_tol)
+        duration_buckets_params = {
+            "rel_tol": duration_bucket_tol,
+            "n_buckets": len(duration_buckets["representatives"])}
+        # inducing points and quadrature points span the padded windows
+        params_trials_end_times = \
+            duration_buckets["padded_trials_end_times"].tolist()
+        print(f"Grouped {n_trials} trials into "
+              f"{duration_buckets_params['n_buckets']} duration buckets")
 
-    # build modelSaveFilename
-    estPrefixUsed = True
-    while estPrefixUsed:
-        estResNumber = random.randint(0, 10**8)
+    params, kernels_types = estimationUtils.get_params_and_kernels_types(
+        est_init_config=est_init_config, args=params_args, n_latents=n_latents,
+        n_neurons=n_neurons, n_trials=n_trials,
+        trials_start_times=trials_start_times,
+        trials_end_times=params_trials_end_times)
+    if duration_buckets is not None:
+        # the padding after the end of every trial is masked from the
+        # integral of the expected log-likelihood
+        ell_calculation_params = params["ell_calculation_params"]
+        ell_calculation_params["leg_quad_weights"] = \
+            durationBuckets.mask_leg_quad_weights(
+                leg_quad_points=ell_calculation_params["leg_quad_points"],
+                leg_quad_weights=ell_calculation_params["leg_quad_weights"],
+                trials_end_times=trials_end_times)
+    if resume_from is None and trials_n_ind_points is not None:
+        indPointsAllocation.allocate_params(
+            params=params, kernels_types=kernels_types,
+            trials_n_ind_points=trials_n_ind_points,
+            trials_start_times=trials_start_times,
+            trials_end_times=trials_end_times)
+
+    if resume_from is None and warm_start_from is not None:
+        estimated_params = warmStartUtils.load_estimated_params(
+            model_save_filename=warm_start_from)
+        n_shared_latents, n_shared_trials, n_shared_units = \
+            warmStartUtils.warm_start(params=params,
+                                      estimated_params=estimated_params,
+                                      trials_ids=trials_ids,
+                                      units_ids=units_ids)
+        print(f"Warm started {n_shared_latents} latents, {n_shared_trials} "
+              f"trials and {n_shared_units} units from {warm_start_from}")
+
+    performance_params = {"n_threads": n_threads,
+                          "n_interop_threads": torch.get_num_interop_threads(),
+                          "reduced_precision": reduced_precision,
+                          "autotune_threads": autotune_threads}
+    if autotune_threads:
+        # calibrate on the first trials (with equal numbers of inducing
+        # points), without duration buckets
+        calibration_trials = socialMiceSVEM.get_trials_batches(
+            n_trials=n_trials, batch_size=autotune_n_trials,
+            trials_groups=trials_n_ind_points)[0]
+        if trials_n_ind_points is None:
+            calibration_n_ind_points = None
+        else:
+            calibration_n_ind_points = \
+                int(trials_n_ind_points[calibration_trials[0]])
+        calibration_spikes_times = epochedSpikesStore.get_spikes_times(
+            epoched_spikes=epoched_spikes,
+            trials_indices=trials_indices[calibration_trials])
+
+        def build_calibration_model(reduced_precision=reduced_precision):
+            calibration_params = copy.deepcopy(
+                socialMiceSVEM.subset_trials_params(
+                    params=params, trials_indices=calibration_trials,
+                    n_ind_points=calibration_n_ind_points))
+            model = estimationUtils.build_model(
+                kernels_types=kernels_types, params=calibration_params,
+                spikes_times=calibration_spikes_times,
+                reduced_precision=reduced_precision)
+            return model
+
+        tuned_n_threads, elapsed_times = \
+            performanceTuning.calibrate_n_threads(
+                build_model_fn=build_calibration_model,
+                optim_params=params["optim_params"],
+                n_threads_candidates=autotune_n_threads_candidates,
+                n_iter=autotune_n_iter)
+        performance_params["n_threads"] = tuned_n_threads
+        performance_params["requested_n_threads"] = n_threads
+        performance_params["calibration_n_trials"] = len(calibration_trials)
+        performance_params["calibration_n_iter"] = autotune_n_iter
+        performance_params["calibration_elapsed_times"] = elapsed_times
+        performance_params["threads_speedup"] = \
+            elapsed_times[n_threads] / elapsed_times[tuned_n_threads]
+        print(f"Using {tuned_n_threads} threads, "
+              f"{performance_params['threads_speedup']:.2f} times faster "
+              f"than {n_threads} threads")
+        n_threads = tuned_n_threads
+        if reduced_precision:
+            calibration_optim_params = \
+                performanceTuning.get_calibration_optim_params(
+                    optim_params=params["optim_params"],
+                    n_iter=autotune_n_iter)
+            double_precision_elapsed_time = \
+                performanceTuning.time_maximization(
+                    model=build_calibration_model(reduced_precision=False),
+                    optim_params=calibration_optim_params)
+            performance_params["reduced_precision_speedup"] = \
+                double_precision_elapsed_time / elapsed_times[n_threads]
+            print("Reduced precision is "
+                  f"{performance_params['reduced_precision_speedup']:.2f} "
+                  "times faster than double precision")
+
+    if resume_from is None:
         estim_res_metadata_filename = \
             estim_res_metadata_filename_pattern.format(estResNumber)
-        if not os.path.exists(estim_res_metadata_filename):
-            estPrefixUsed = False
+
+        # create model
+        if minibatch_params is None:
+            model = estimationUtils.build_model(
+                kernels_types=kernels_types, params=params,
+                spikes_times=spikes_times, duration_buckets=duration_buckets,
+                reduced_precision=reduced_precision)
+        else:
+            # parameters and data are set for every minibatch
+            model = estimationUtils.create_model(
+                kernels_types=kernels_types, params=params,
+                reduced_precision=reduced_precision)
+
+        # save estimated values
+        estimationUtils.save_estim_res_metadata(
+            estim_res_metadata_filename=estim_res_metadata_filename,
+            params=params, est_init_number=est_init_number,
+            n_threads=n_threads, neurons_indices=neurons_indices,
+            n_latents=n_latents, common_n_ind_points=common_n_ind_points,
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            minibatch_params=minibatch_params,
+            warm_start_from=warm_start_from,
+            duration_buckets_params=duration_buckets_params,
+            ind_points_allocation_params=ind_points_allocation_params,
+            performance_params=performance_params, cache_key=cache_key,
+            trials_ids_filename=trials_ids_filename)
+        resume_state = None
+    else:
+        # continue the estimation saved in the checkpoint
+        estResNumber = checkpoint["estResNumber"]
+        estim_res_metadata_filename = \
+            estim_res_metadata_filename_pattern.format(estResNumber)
+        if minibatch_params is not None:
+            # the model only holds the last minibatch, the parameters of all
+            # trials are saved separately
+            params = checkpoint["params"]
+        params["optim_params"] = checkpoint["optim_params"]
+        model = checkpoint["model"]
+        resume_state = checkpoint
     modelSaveFilename = model_save_filename_pattern.format(estResNumber)
 
-    # build kernels
-    kernels = svGPFA.utils.miscUtils.buildKernels(
-        kernels_types=kernels_types, kernels_params=kernels_params0)
-
-    # create model
-    kernelMatrixInvMethod = svGPFA.stats.svGPFAModelFactory.kernelMatrixInvChol
-    indPointsCovRep = svGPFA.stats.svGPFAModelFactory.indPointsCovChol
-    model = svGPFA.stats.svGPFAModelFactory.SVGPFAModelFactory.buildModelPyTorch(
-        conditionalDist=svGPFA.stats.svGPFAModelFactory.PointProcess,
-        linkFunction=svGPFA.stats.svGPFAModelFactory.ExponentialLink,
-        embeddingType=svGPFA.stats.svGPFAModelFactory.LinearEmbedding,
-        kernels=kernels, kernelMatrixInvMethod=kernelMatrixInvMethod,
-        indPointsCovRep=indPointsCovRep)
-
-    model.setParamsAndData(
-        measurements=spikes_times,
-        initial_params=params["initial_params"],
-        eLLCalculationParams=params["ell_calculation_params"],
-        priorCovRegParam=params["optim_params"]["prior_cov_reg_param"])
-
-    # save estimated values
-    estim_res_config = configparser.ConfigParser()
-    estim_res_config["data_params"] = {
-        "n_threads": n_threads,
-        "neurons_indices": neurons_indices,
-        "nLatents": n_latents,
-        "common_n_ind_points": common_n_ind_points,
-        # "max_trial_duration": max_trial_duration,
-        "epoched_spikes_times_filename": epoched_spikes_times_filename,
-    }
-    estim_res_config["optim_params"] = params["optim_params"]
-    estim_res_config["estimation_params"] = {"est_init_number":
-                                             est_init_number}
-    with open(estim_res_metadata_filename, "w") as f:
-        estim_res_config.write(f)
-    print(f"Saved {estim_res_metadata_filename}")
+    extra_state = {"estResNumber": estResNumber,
+                   "optim_params": params["optim_params"]}
+    if minibatch_params is not None:
+        extra_state["minibatch_params"] = minibatch_params
+        extra_state["params"] = params
+    if ind_points_allocation_params is not None:
+        extra_state["ind_points_allocation_params"] = \
+            ind_points_allocation_params
+    checkpointer = socialMiceSVEM.Checkpointer(
+        checkpoint_filename=checkpoint_filename_pattern.format(estResNumber),
+        every_n_iter=checkpoint_every_n_iter,
+        every_n_secs=checkpoint_every_n_secs,
+        extra_state=extra_state)
+    profile_filename_pattern = profile_filename_pattern.format(estResNumber,
+                                                               "{:s}")
+    profiler = estimationProfiler.EstimationProfiler(
+        profile_filename_pattern=profile_filename_pattern,
+        resume=resume_state is not None,
+        resume_iteration=None if resume_state is None
+        else resume_state["iteration"])
+    convergence_monitor = socialMiceSVEM.ConvergenceMonitor(
+        rel_tol=convergence_rel_tol, window=convergence_window,
+        min_iter=convergence_min_iter, max_elapsed_secs=max_elapsed_secs,
+        max_step_secs=max_step_secs)
 
     # maximize lower bound
-    def getSVPosteriorOnIndPointsParams(model, get_mean=True, latent=0,
-                                        trial=0):
-        params = model.getSVPosteriorOnIndPointsParams()
-        base_index = 0
-        if not get_mean:
-            base_index = len(params)/2 - 1
-        answer = params[base_index][trial, :, 0]
-        return answer
-
-    def getKernelsParams(model):
-        params = model.getKernelsParams()
-        return params
+    if minibatch_params is None:
+        with estimationProfiler.profiling(
+                profile_mode=profile_mode,
+                profile_filename_pattern=profile_filename_pattern):
+            lowerBoundHist, elapsedTimeHist, terminationInfo, \
+                iterationsModelParams = estimationUtils.maximize(
+                    model=model, params=params,
+                    iteration_callbacks=[profiler, checkpointer,
+                                         convergence_monitor],
+                    step_callbacks=[profiler.step_callback,
+                                    convergence_monitor.step_callback],
+                    resume_state=resume_state)
 
-    # maximize lower bound
-    svEM = svGPFA.stats.svEM.SVEM_PyTorch()
-
-    lowerBoundHist, elapsedTimeHist, terminationInfo, iterationsModelParams = \
-        svEM.maximize(model=model, optim_params=params["optim_params"],
-                      method=params["optim_params"]["optim_method"],
-                      # getIterationModelParamsFn=getSVPosteriorOnIndPointsParams,
-                      getIterationModelParamsFn=getKernelsParams,
-                      printIterationModelParams=True)
-
-    resultsToSave = {
-                     "trials_start_times": trials_start_times,
-                     "trials_end_times": trials_end_times,
-                     "lowerBoundHist": lowerBoundHist,
-                     "elapsedTimeHist": elapsedTimeHist,
-                     "terminationInfo": terminationInfo,
-                     "iterationModelParams": iterationsModelParams,
-                     "spikes_times": spikes_times,
-                     "trials_info": trials_info,
-                     "model": model,
-                    }
-    with open(modelSaveFilename, "wb") as f:
-        pickle.dump(resultsToSave, f)
-        print("Saved results to {:s}".format(modelSaveFilename))
+        if not skip_results_pickle:
+            estimationUtils.save_estimation_results(
+                model_save_filename=modelSaveFilename, model=model,
+                lowerBoundHist=lowerBoundHist,
+                elapsedTimeHist=elapsedTimeHist,
+                terminationInfo=terminationInfo,
+                iterationsModelParams=iterationsModelParams,
+                spikes_times=spikes_times,
+                trials_start_times=trials_start_times,
+                trials_end_times=trials_end_times, trials_info=trials_info,
+                trials_ids=trials_ids, units_ids=units_ids)
+    else:
+        with estimationProfiler.profiling(
+                profile_mode=profile_mode,
+                profile_filename_pattern=profile_filename_pattern):
+            lowerBoundHist, elapsedTimeHist, terminationInfo, \
+                iterationsModelParams = \
+                estimationUtils.maximize_in_minibatches(
+                    model=model, params=params, epoched_spikes=epoched_spikes,
+                    trials_indices=trials_indices,
+                    batch_size=minibatch_params["batch_size"],
+                    schedule=minibatch_params["schedule"],
+                    n_iter_per_batch=minibatch_params["n_iter_per_batch"],
+                    random_seed=minibatch_params["random_seed"],
+                    iteration_callbacks=[profiler, checkpointer,
+                                         convergence_monitor],
+                    step_callbacks=[profiler.step_callback,
+                                    convergence_monitor.step_callback],
+                    resume_state=resume_state,
+                    trials_n_ind_points=trials_n_ind_points)
+
+        if not skip_results_pickle:
+            estimationUtils.save_estimation_results(
+                model_save_filename=modelSaveFilename, model=None,
+                lowerBoundHist=lowerBoundHist,
+                elapsedTimeHist=elapsedTimeHist,
+                terminationInfo=terminationInfo,
+                iterationsModelParams=iterationsModelParams,
+                spikes_times=spikes_times,
+                trials_start_times=trials_start_times,
+                trials_end_times=trials_end_times, trials_info=trials_info,
+                estimated_params=params, kernels_types=kernels_types,
+                trials_ids=trials_ids, units_ids=units_ids)
+
+    estimationUtils.save_termination_metadata(
+        estim_res_metadata_filename=estim_res_metadata_filename,
+        terminationInfo=terminationInfo, lowerBoundHist=lowerBoundHist,
+        elapsedTimeHist=elapsedTimeHist,
+        convergence_params=convergence_monitor.get_params())
+    print(terminationInfo.message)
 
+    if minibatch_params is None:
+        estimated_params = modelExport.get_estimated_params(model=model)
+    else:
+        estimated_params = modelExport.get_estimated_params(
+            initial_params=params["initial_params"])
+    model_export_filename = model_export_filename_pattern.format(estResNumber)
+    modelExport.export_model(
+        export_filename=model_export_filename,
+        estimated_params=estimated_params, kernels_types=kernels_types,
+        trials_ids=trials_ids, units_ids=units_ids,
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times,
+        prior_cov_reg_param=params["optim_params"]["prior_cov_reg_param"],
+        n_quad=params["optim_params"]["n_quad"])
+    print(f"Saved {model_export_filename}")
+    if save_history:
+        history_filename = history_filename_pattern.format(estResNumber)
+        modelExport.save_history(history_filename=history_filename,
+                                 lowerBoundHist=lowerBoundHist,
+                                 elapsedTimeHist=elapsedTimeHist,
+                                 terminationInfo=terminationInfo,
+                                 iterationsModelParams=iterationsModelParams)
+        print(f"Saved {history_filename}")
+    if save_training_data:
+        training_data_filenames = modelExport.save_training_data(
+            filename_pattern=training_data_filename_pattern.format(
+                estResNumber, "{:s}"),
+            epoched_spikes=epoched_spikes, trials_indices=trials_indices)
+        print(f"Saved {training_data_filenames}")
+    if not hasattr(terminationInfo, "error"):
+        # the checkpoint is only kept to resume estimations that failed
+        checkpointer.remove()
+
+    profiler.save()
+    profiler.print_summary()
     print(f"Elapsed time {elapsedTimeHist[-1]}")
 
+    if cache_key is not None:
+        evicted = results_cache.touch(key=cache_key,
+                                      estResNumber=estResNumber)
+        for evicted_number in evicted:
+            print(f"Evicted estimation result {evicted_number:08d} from "
+                  f"{results_cache_index_filename}")
+        resultsIndex.delete_runs(index_filename=results_index_filename,
+                                 estim_res_numbers=evicted)
+
+    if skip_results_pickle:
+        # do not index a pickle left by a former estimation
+        record_run(estResNumber=estResNumber, model_save_filename=None)
+    else:
+        record_run(estResNumber=estResNumber,
+                   model_save_filename=modelSaveFilename)
+
     breakpoint()
 
 
@@ -0,0 +1,283 @@
+import sys
+import os
+import random
+import argparse
+import configparser
+import traceback
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import torch
+
+import epochedSpikesStore
+import estimationUtils
+import initializationUtils
+
+# epoched spikes store and selected trials, opened once by every worker
+# process and shared, read only, by all its estimations
+worker_data = {}
+
+
+def init_worker(n_threads, epoched_spikes_times_filename, trials_ids_filename,
+                align_event_name):
+    torch.set_num_threads(n_threads)
+    # every worker memory maps the store, instead of receiving spikes times
+    epoched_spikes, trials_indices, trials_start_times, trials_end_times, \
+        trials_info = estimationUtils.load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+    worker_data["epoched_spikes"] = epoched_spikes
+    worker_data["trials_indices"] = trials_indices
+    worker_data["trials_start_times"] = trials_start_times
+    worker_data["trials_end_times"] = trials_end_times
+    worker_data["trials_info"] = trials_info
+
+
+def estimate(job):
+    epoched_spikes = worker_data["epoched_spikes"]
+    trials_indices = worker_data["trials_indices"]
+    trials_start_times = worker_data["trials_start_times"]
+    trials_end_times = worker_data["trials_end_times"]
+    trials_info = worker_data["trials_info"]
+    spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes, trials_indices=trials_indices)
+    n_trials = len(trials_indices)
+    n_neurons = epoched_spikes["n_units"]
+
+    est_init_config = configparser.ConfigParser()
+    est_init_config.read(job["est_init_config_filename"])
+    random_seed = job["random_seed"]
+    if random_seed is not None:
+        random.seed(random_seed)
+        np.random.seed(random_seed)
+        torch.manual_seed(random_seed)
+        if "embedding_params0" not in est_init_config:
+            est_init_config["embedding_params0"] = {}
+        est_init_config["embedding_params0"]["c0_random_seed"] = \
+            str(random_seed)
+        est_init_config["embedding_params0"]["d0_random_seed"] = \
+            str(random_seed + 1)
+
+    params, kernels_types = estimationUtils.get_params_and_kernels_types(
+        est_init_config=est_init_config, args=job["args"],
+        n_latents=job["n_latents"], n_neurons=n_neurons, n_trials=n_trials,
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times)
+    model = estimationUtils.build_model(kernels_types=kernels_types,
+                                        params=params,
+                                        spikes_times=spikes_times)
+    estimationUtils.save_estim_res_metadata(
+        estim_res_metadata_filename=job["estim_res_metadata_filename"],
+        params=params, est_init_number=job["est_init_number"],
+        n_threads=torch.get_num_threads(),
+        neurons_indices=np.arange(n_neurons), n_latents=job["n_latents"],
+        common_n_ind_points=job["common_n_ind_points"],
+        epoched_spikes_times_filename=job["epoched_spikes_times_filename"])
+    lowerBoundHist, elapsedTimeHist, terminationInfo, iterationsModelParams = \
+        estimationUtils.maximize(model=model, params=params,
+                                 printIterationModelParams=False)
+    estimationUtils.save_estimation_results(
+        model_save_filename=job["model_save_filename"], model=model,
+        lowerBoundHist=lowerBoundHist, elapsedTimeHist=elapsedTimeHist,
+        terminationInfo=terminationInfo,
+        iterationsModelParams=iterationsModelParams,
+        spikes_times=spikes_times, trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times, trials_info=trials_info)
+    summary = {"lower_bound": lowerBoundHist[-1],
+               "n_iterations": len(lowerBoundHist) - 1,
+               "elapsed_time": elapsedTimeHist[-1],
+               "termination": terminationInfo.message,
+               "lowerBoundHist": lowerBoundHist}
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--est_init_numbers",
+                        help="estimation init numbers (e.g., [1,2,3])",
+                        type=str, default="[1]")
+    parser.add_argument("--random_seeds",
+                        help=("random seeds used with every estimation init "
+                              "number (e.g., [0,1,2])"),
+                        type=str, default="[]")
+    parser.add_argument("--n_latents", help="number of latent processes",
+                        type=int, default=10)
+    parser.add_argument("--n_threads",
+                        help="total number of threads for PyTorch",
+                        type=int, default=os.cpu_count())
+    parser.add_argument("--n_workers",
+                        help="number of estimations run in parallel",
+                        type=int, default=None)
+    parser.add_argument("--common_n_ind_points",
+                        help="common number of inducing points",
+                        type=int, default=15)
+    parser.add_argument("--epoched_spikes_times_filename_pattern",
+                        help="epoched spikes times filename pattern",
+                        type=str,
+                        default=("../../results/epochedSpikes_subject_{:s}_"
+                                 "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to the epoch event of the "
+                              "session store instead of read from an "
+                              "epoched store)"),
+                        type=str, default=None)
+    parser.add_argument("--est_init_config_filename_pattern",
+                        help="estimation initialization filename pattern",
+                        type=str,
+                        default="../../init/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--estim_res_metadata_filename_pattern",
+                        help="estimation result metadata filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--trials_ids_filename", help="trials ids filename",
+                        type=str, default="../../init/trialsIDs_0_49.csv")
+    parser.add_argument("--model_save_filename_pattern",
+                        help="model save filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.pickle")
+    parser.add_argument("--summary_filename",
+                        help="filename of the estimations summary table",
+                        type=str,
+                        default="../../results/multiInitEstimations.csv")
+    parsed, unknown = parser.parse_known_args()
+    for arg in unknown:
+        if arg.startswith(("-", "--")):
+            # you can pass any arguments to add_argument
+            parser.add_argument(arg.split('=')[0], type=str)
+    args = parser.parse_args()
+
+    est_init_numbers = [int(str) for str in
+                        args.est_init_numbers[1:-1].split(",")]
+    if len(args.random_seeds[1:-1]) > 0:
+        random_seeds = [int(str) for str in
+                        args.random_seeds[1:-1].split(",")]
+    else:
+        random_seeds = [None]
+    n_latents = args.n_latents
+    n_threads = args.n_threads
+    n_workers = args.n_workers
+    common_n_ind_points = args.common_n_ind_points
+    epoched_spikes_times_filename_pattern = \
+        args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
+    est_init_config_filename_pattern = args.est_init_config_filename_pattern
+    estim_res_metadata_filename_pattern = \
+        args.estim_res_metadata_filename_pattern
+    trials_ids_filename = args.trials_ids_filename
+    model_save_filename_pattern = args.model_save_filename_pattern
+    summary_filename = args.summary_filename
+
+    # all estimation inits should refer to the same epoched data
+    data_params = None
+    for est_init_number in est_init_numbers:
+        est_init_config = configparser.ConfigParser()
+        est_init_config.read(est_init_config_filename_pattern.format(
+            est_init_number))
+        init_data_params = (est_init_config["data_params"]["subject_name"],
+                            est_init_config["data_params"]["region"],
+                            est_init_config["data_params"]["epoch_event_name"])
+        if data_params is None:
+            data_params = init_data_params
+        elif init_data_params != data_params:
+            raise ValueError(f"Estimation init {est_init_number} uses data "
+                             f"{init_data_params}, but a previous init uses "
+                             f"{data_params}")
+    subject_name, region, epoch_event_name = data_params
+
+    # workers open the epoched data themselves
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        align_event_name = None
+    else:
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        align_event_name = epoch_event_name
+
+    jobs = []
+    used_estim_res_numbers = set()
+    for est_init_number in est_init_numbers:
+        for random_seed in random_seeds:
+            estResNumber = estimationUtils.get_estim_res_number(
+                estim_res_metadata_filename_pattern=
+                estim_res_metadata_filename_pattern)
+            while estResNumber in used_estim_res_numbers:
+                estResNumber = estimationUtils.get_estim_res_number(
+                    estim_res_metadata_filename_pattern=
+                    estim_res_metadata_filename_pattern)
+            used_estim_res_numbers.add(estResNumber)
+            jobs.append({
+                "est_init_number": est_init_number,
+                "random_seed": random_seed,
+                "estim_res_number": estResNumber,
+                "est_init_config_filename":
+                    est_init_config_filename_pattern.format(est_init_number),
+                "estim_res_metadata_filename":
+                    estim_res_metadata_filename_pattern.format(estResNumber),
+                "model_save_filename":
+                    model_save_filename_pattern.format(estResNumber),
+                "epoched_spikes_times_filename":
+                    epoched_spikes_times_filename,
+                "n_latents": n_latents,
+                "common_n_ind_points": common_n_ind_points,
+                "args": vars(args),
+            })
+
+    if n_workers is None:
+        n_workers = min(len(jobs), n_threads)
+    n_threads_per_worker = max(1, n_threads // n_workers)
+    print(f"Running {len(jobs)} estimations in {n_workers} workers with "
+          f"{n_threads_per_worker} threads each")
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(n_threads_per_worker, epoched_spikes_times_filename,
+                      trials_ids_filename, align_event_name)) as executor:
+        futures = {executor.submit(estimate, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            row = {"est_init_number": job["est_init_number"],
+                   "random_seed": job["random_seed"],
+                   "estim_res_number": job["estim_res_number"]}
+            try:
+                row.update(future.result())
+            except Exception as e:
+                print(traceback.format_exc())
+                row.update({"lower_bound": np.nan, "n_iterations": 0,
+                            "elapsed_time": np.nan,
+                            "termination": f"Error: {e}",
+                            "lowerBoundHist": []})
+            row["model_save_filename"] = job["model_save_filename"]
+            print(f"Finished estimation init {row['est_init_number']}, "
+                  f"random seed {row['random_seed']}: lower bound "
+                  f"{row['lower_bound']}, elapsed time {row['elapsed_time']}")
+            rows.append(row)
+
+    # iterations every estimation needed to get close to the best lower bound
+    # of all estimations, to compare initializations
+    target_lower_bound = np.nanmax([row["lower_bound"] for row in rows])
+    for row in rows:
+        row["n_iterations_to_convergence"] = \
+            initializationUtils.get_iterations_to_convergence(
+                lowerBoundHist=row.pop("lowerBoundHist"),
+                target_lower_bound=target_lower_bound)
+
+    summary = pd.DataFrame(rows).sort_values(
+        by=["lower_bound", "elapsed_time"], ascending=[False, True],
+        na_position="last")
+    summary.insert(0, "rank", np.arange(1, len(summary) + 1))
+    summary.to_csv(summary_filename, index=False)
+    print(summary.to_string(index=False))
+    print(f"Saved {summary_filename}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,125 @@
+import sys
+import time
+import argparse
+import configparser
+
+import estimationUtils
+import initializationUtils
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("est_init_number",
+                        help=("estimation init number of the base "
+                              "initialization, whose data and optimization "
+                              "parameters are copied to the data-driven "
+                              "initialization"),
+                        type=int)
+    parser.add_argument("--data_init_number",
+                        help=("estimation init number of the data-driven "
+                              "initialization (a random unused one if not "
+                              "given)"),
+                        type=int, default=None)
+    parser.add_argument("--n_latents", help="number of latent processes",
+                        type=int, default=10)
+    parser.add_argument("--common_n_ind_points",
+                        help="common number of inducing points",
+                        type=int, default=15)
+    parser.add_argument("--bin_size", help="bin size (sec)", type=float,
+                        default=0.02)
+    parser.add_argument("--smoothing_sigma",
+                        help=("standard deviation of the Gaussian kernel "
+                              "smoothing the binned spikes counts (sec)"),
+                        type=float, default=0.1)
+    parser.add_argument("--rate_offset",
+                        help="rate added to smoothed rates before their log",
+                        type=float, default=0.1)
+    parser.add_argument("--epoched_spikes_times_filename_pattern",
+                        help="epoched spikes times filename pattern",
+                        type=str,
+                        default=("../../results/epochedSpikes_subject_{:s}_"
+                                 "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to the epoch event of the "
+                              "session store instead of read from an "
+                              "epoched store)"),
+                        type=str, default=None)
+    parser.add_argument("--est_init_config_filename_pattern",
+                        help="estimation initialization filename pattern",
+                        type=str,
+                        default="../../init/{:08d}_estimation_metaData.ini")
+    parser.add_argument("--data_init_params_dirname_pattern",
+                        help=("directory name pattern of the data-driven "
+                              "initial parameters files"),
+                        type=str, default="../../init/{:08d}_dataInitParams")
+    parser.add_argument("--trials_ids_filename", help="trials ids filename",
+                        type=str, default="../../init/trialsIDs_0_49.csv")
+    args = parser.parse_args()
+
+    est_init_number = args.est_init_number
+    data_init_number = args.data_init_number
+    n_latents = args.n_latents
+    common_n_ind_points = args.common_n_ind_points
+    bin_size = args.bin_size
+    smoothing_sigma = args.smoothing_sigma
+    rate_offset = args.rate_offset
+    epoched_spikes_times_filename_pattern = \
+        args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
+    est_init_config_filename_pattern = args.est_init_config_filename_pattern
+    data_init_params_dirname_pattern = args.data_init_params_dirname_pattern
+    trials_ids_filename = args.trials_ids_filename
+
+    est_init_config = configparser.ConfigParser()
+    est_init_config.read(est_init_config_filename_pattern.format(
+        est_init_number))
+    subject_name = est_init_config["data_params"]["subject_name"]
+    region = est_init_config["data_params"]["region"]
+    epoch_event_name = est_init_config["data_params"]["epoch_event_name"]
+
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        align_event_name = None
+    else:
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        align_event_name = epoch_event_name
+    epoched_spikes, trials_indices, _, _, _ = \
+        estimationUtils.load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+
+    start_time = time.time()
+    init_params = initializationUtils.initialize_from_data(
+        epoched_spikes=epoched_spikes, trials_indices=trials_indices,
+        n_latents=n_latents, n_ind_points=common_n_ind_points,
+        bin_size=bin_size, smoothing_sigma=smoothing_sigma,
+        rate_offset=rate_offset)
+    elapsed_time = time.time() - start_time
+    print(f"Initialized {n_latents} latents from {len(trials_indices)} "
+          f"trials and {epoched_spikes['n_units']} units in "
+          f"{elapsed_time:.2f} secs")
+    print(f"Initial lengthscales: {init_params['lengthscales0']}")
+
+    if data_init_number is None:
+        data_init_number = estimationUtils.get_estim_res_number(
+            estim_res_metadata_filename_pattern=
+            est_init_config_filename_pattern)
+    saved_filenames = initializationUtils.save_init_config(
+        init_config_filename=est_init_config_filename_pattern.format(
+            data_init_number),
+        params_dirname=data_init_params_dirname_pattern.format(
+            data_init_number),
+        init_params=init_params, base_config=est_init_config,
+        n_ind_points=common_n_ind_points)
+    print(f"Saved data-driven estimation init {data_init_number} to "
+          f"{saved_filenames[0]}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
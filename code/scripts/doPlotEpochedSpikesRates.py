@@ -1,10 +1,9 @@
 
 import sys
 import argparse
-import pickle
 
-import gcnu_common.utils
 import svGPFA.plot.plotUtilsPlotly
+import epochedSpikesStore
 
 
 def main(argv):
@@ -20,6 +19,11 @@ def main(argv):
                         type=str,
                         default=("../../results/epochedSpikes_subject_{:s}_"
                                  "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to --epoch_event_name on "
+                              "load instead of read from an epoched store)"),
+                        type=str, default=None)
     parser.add_argument("--spikes_rates_fig_filename_pattern",
                         help=("spikes rates figure filename pattern"),
                         type=str,
@@ -32,28 +36,33 @@ def main(argv):
     epoch_event_name = args.epoch_event_name
     epoched_spikes_times_filename_pattern = \
         args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
     spikes_rates_fig_filename_pattern = \
         args.spikes_rates_fig_filename_pattern
 
-    epoched_spikes_times_filename = \
-        epoched_spikes_times_filename_pattern.format(
-            subject_name, region, epoch_event_name, "pickle")
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        store_align_event_name = None
+    else:
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        store_align_event_name = epoch_event_name
 
-    with open(epoched_spikes_times_filename, "rb") as f:
-        load_res = pickle.load(f)
-    spikes_times = load_res["spikes_times"]
-    units_ids = load_res["units_ids"]
-    trials_ids = load_res["trials_ids"]
-    trials_start_times = load_res["trials_start_times"]
-    trials_end_times = load_res["trials_end_times"]
-    n_trials = len(spikes_times)
+    epoched_spikes = epochedSpikesStore.load(
+        filename_pattern=epoched_spikes_times_filename,
+        align_event_name=store_align_event_name)
+    units_ids = epoched_spikes["units_ids"]
+    trials_ids = epoched_spikes["trials_ids"]
+    trials_start_times = epoched_spikes["trials_start_times"]
+    trials_end_times = epoched_spikes["trials_end_times"]
 
-    trials_durations = [trials_end_times[r] - trials_start_times[r]
-                        for r in range(n_trials)]
+    trials_durations = trials_end_times - trials_start_times
     spikes_rates_allTrials_allNeurons = \
-        gcnu_common.utils.neural_data_analysis.\
-        getSpikesRatesAllTrialsAllNeurons(
-            spikes_times=spikes_times, trials_durations=trials_durations)
+        epochedSpikesStore.get_spikes_counts(epoched_spikes=epoched_spikes) / \
+        trials_durations[:, None]
 
     fig = svGPFA.plot.plotUtilsPlotly.\
         getPlotSpikesRatesAllTrialsAllNeurons(
@@ -1,12 +1,149 @@
 
 import sys
 import argparse
-import pickle
 import math
+import traceback
+import multiprocessing
+import concurrent.futures
 import numpy as np
 
-import svGPFA.plot.plotUtilsPlotly
 import socialMiceUtils
+import epochedSpikesStore
+
+
+# data shared, read only, by all figures rendered in a worker process
+worker_data = {}
+
+
+def get_plot_data(epoched_spikes, epoch_event_name, sorting_event_name,
+                  colors_event_name, align_event_name, events_names,
+                  events_colors, events_markers, xmin, xmax):
+    """Computes the per-trial data shared by the raster plots of all units:
+    the kept trials, their sorting times, colors, marked events and
+    alignment times, and the x-axis range."""
+    trials_ids = epoched_spikes["trials_ids"]
+    trials_start_times = epoched_spikes["trials_start_times"]
+    trials_end_times = epoched_spikes["trials_end_times"]
+    trials_info = epoched_spikes["trials_info"]
+
+    epoch_times = trials_info[epoch_event_name]
+    n_trials = len(epoch_times)
+
+    # begin remove trials
+    if sorting_event_name is None:
+        remove_trial = np.isnan(epoch_times)
+    else:
+        sorting_times = trials_info[sorting_event_name]
+        remove_trial = np.logical_or(np.isnan(epoch_times),
+                                     np.isnan(sorting_times))
+    keep_trial = np.logical_not(remove_trial)
+
+#     for key in trials_info.keys():
+#         trials_info[key] = [trials_info[key][r] for r in range(n_trials)
+#                             if keep_trial[r]]
+    epoch_times = epoch_times[keep_trial]
+    n_trials = len(epoch_times)
+    trials_ids = trials_ids[keep_trial]
+    if sorting_event_name is not None:
+        sorting_times = sorting_times[keep_trial]
+        sorting_times -= epoch_times
+    else:
+        sorting_times = None
+    # end remove trials
+
+    colors_event = trials_info[colors_event_name]
+    trials_colors = [None] * n_trials
+    for i, an_event in enumerate(colors_event[keep_trial]):
+        if an_event == 2:  # hit
+            trials_colors[i] = "red"
+        elif an_event == 5:  # correct rejection
+            trials_colors[i] = "darkred"
+        elif an_event == 3:  # Miss
+            trials_colors[i] = "lightblue"
+        elif an_event == 4:  # False alarm
+            trials_colors[i] = "blue"
+        else:
+            raise ValueError(f"Invalid {colors_event_name}={an_event}")
+
+    events_times = []
+    for event_name in events_names:
+        events_times.append([trials_info[event_name][trial_id]
+                             for trial_id in trials_ids])
+
+    marked_events_times, marked_events_colors, marked_events_markers = \
+        socialMiceUtils.buildMarkedEventsInfo(
+            events_times=events_times,
+            events_colors=events_colors,
+            events_markers=events_markers,
+        )
+
+    align_event_times = [trials_info[align_event_name][trial_id]
+                         for trial_id in trials_ids]
+
+    if xmin is None:
+        xmin = np.min(trials_start_times)
+    if xmax is None:
+        xmax = np.max(trials_end_times)
+
+    plot_data = {"trials_indices": np.nonzero(keep_trial)[0],
+                 "trials_ids": trials_ids,
+                 "feedback_types": colors_event[keep_trial].to_numpy(),
+                 "sorting_times": sorting_times,
+                 "trials_colors": trials_colors,
+                 "marked_events_times": marked_events_times,
+                 "marked_events_colors": marked_events_colors,
+                 "marked_events_markers": marked_events_markers,
+                 "align_event_times": align_event_times,
+                 "xmin": xmin,
+                 "xmax": xmax}
+    return plot_data
+
+
+def plot_unit(epoched_spikes, plot_data, neuron_index, title,
+              fig_filename_pattern):
+    """Plots the spikes times of the unit at ``neuron_index`` of the
+    epoched spikes store ``epoched_spikes`` and saves the figure to the png
+    and html extensions of ``fig_filename_pattern``."""
+    # only read the spikes of the plotted unit in the kept trials
+    spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes,
+        trials_indices=plot_data["trials_indices"],
+        units_indices=[neuron_index])
+
+    fig = socialMiceUtils.getSpikesTimesPlotOneNeuron(
+        spikes_times=spikes_times,
+        sorting_times=plot_data["sorting_times"],
+        neuron_index=0,
+        title=title,
+        trials_ids=plot_data["trials_ids"],
+        feedback_types=plot_data["feedback_types"],
+        marked_events_times=plot_data["marked_events_times"],
+        marked_events_colors=plot_data["marked_events_colors"],
+        marked_events_markers=plot_data["marked_events_markers"],
+        align_event=plot_data["align_event_times"],
+        trials_colors=plot_data["trials_colors"],
+    )
+    fig.update_xaxes(range=[plot_data["xmin"], plot_data["xmax"]])
+
+    fig.write_image(fig_filename_pattern.format("png"))
+    fig.write_html(fig_filename_pattern.format("html"))
+    return fig
+
+
+def init_worker(epoched_spikes_times_filename, store_align_event_name,
+                plot_data):
+    # every worker memory maps the store, instead of receiving spikes times
+    worker_data["epoched_spikes"] = epochedSpikesStore.load(
+        filename_pattern=epoched_spikes_times_filename,
+        align_event_name=store_align_event_name)
+    worker_data["plot_data"] = plot_data
+
+
+def plot_unit_in_worker(job):
+    plot_unit(epoched_spikes=worker_data["epoched_spikes"],
+              plot_data=worker_data["plot_data"],
+              neuron_index=job["neuron_index"], title=job["title"],
+              fig_filename_pattern=job["fig_filename_pattern"])
 
 
 def main(argv):
@@ -17,6 +154,12 @@ def main(argv):
                         type=str, default="BLA")
     parser.add_argument("--unit_id", type=int, help="unit_id to analyze",
                         default=106)
+    parser.add_argument("--all_units",
+                        help="plot all units, ignoring --unit_id",
+                        action="store_true")
+    parser.add_argument("--n_workers",
+                        help="number of processes rendering figures",
+                        type=int, default=None)
     parser.add_argument("--epoch_event_name", help="epoch event name",
                         type=str, default="DoorOpen")
     parser.add_argument("--sorting_event_name", type=str,
@@ -48,6 +191,11 @@ def main(argv):
                         type=str,
                         default=("../../results/epochedSpikes_subject_{:s}_"
                                  "region_{:s}_epochedBy_{:s}.{:s}"))
+    parser.add_argument("--session_spikes_filename_pattern",
+                        help=("session store filename pattern (if given, "
+                              "spikes are aligned to --epoch_event_name on "
+                              "load instead of read from an epoched store)"),
+                        type=str, default=None)
     parser.add_argument("--fig_filename_pattern",
                         help="spikes times figure filename pattern",
                         type=str,
@@ -58,6 +206,8 @@ def main(argv):
     subject_name = args.subject_name
     region = args.region
     unit_id = args.unit_id
+    all_units = args.all_units
+    n_workers = args.n_workers
     epoch_event_name = args.epoch_event_name
     sorting_event_name = args.sorting_event_name
     colors_event_name = args.colors_event_name
@@ -69,107 +219,77 @@ def main(argv):
     xmax = args.xmax
     epoched_spikes_times_filename_pattern = \
         args.epoched_spikes_times_filename_pattern
+    session_spikes_filename_pattern = args.session_spikes_filename_pattern
     fig_filename_pattern = args.fig_filename_pattern
 
-    epoched_spikes_times_filename = \
-        epoched_spikes_times_filename_pattern.format(
-            subject_name, region, epoch_event_name, "pickle")
-
-    with open(epoched_spikes_times_filename, "rb") as f:
-        load_res = pickle.load(f)
-    spikes_times = load_res["spikes_times"]
-    units_ids = load_res["units_ids"]
-    trials_ids = load_res["trials_ids"]
-    trials_start_times = load_res["trials_start_times"]
-    trials_end_times = load_res["trials_end_times"]
-    trials_info = load_res["trials_info"]
-
-    epoch_times = trials_info[epoch_event_name]
-    n_trials = len(epoch_times)
-
-    # begin remove trials
-    if sorting_event_name is None:
-        remove_trial = np.isnan(epoch_times)
-    else:
-        sorting_times = trials_info[sorting_event_name]
-        remove_trial = np.logical_or(np.isnan(epoch_times),
-                                     np.isnan(sorting_times))
-    keep_trial = np.logical_not(remove_trial)
-
-    spikes_times = [spikes_times[r] for r in range(n_trials) if keep_trial[r]]
-#     for key in trials_info.keys():
-#         trials_info[key] = [trials_info[key][r] for r in range(n_trials)
-#                             if keep_trial[r]]
-    epoch_times = epoch_times[keep_trial]
-    n_trials = len(epoch_times)
-    trials_ids = trials_ids[keep_trial]
-    if sorting_event_name is not None:
-        sorting_times = sorting_times[keep_trial]
-        sorting_times -= epoch_times
+    if session_spikes_filename_pattern is None:
+        epoched_spikes_times_filename = \
+            epoched_spikes_times_filename_pattern.format(
+                subject_name, region, epoch_event_name, "{:s}")
+        store_align_event_name = None
     else:
-        sorting_times = None
-    # end remove trials
-
-    colors_event = trials_info[colors_event_name]
-
-    neuron_index = np.nonzero(np.array(units_ids) == unit_id)[0].item()
-
-    colors_event = trials_info[colors_event_name]
-    trials_colors = [None] * n_trials
-    for i, an_event in enumerate(colors_event):
-        if an_event == 2:  # hit
-            trials_colors[i] = "red"
-        elif an_event == 5:  # correct rejection
-            trials_colors[i] = "darkred"
-        elif an_event == 3:  # Miss
-            trials_colors[i] = "lightblue"
-        elif an_event == 4:  # False alarm
-            trials_colors[i] = "blue"
-        else:
-            raise ValueError(f"Invalid {colors_event_name}={an_event}")
-
-    events_times = []
-    for event_name in events_names:
-        events_times.append([trials_info[event_name][trial_id]
-                             for trial_id in trials_ids])
+        epoched_spikes_times_filename = \
+            session_spikes_filename_pattern.format(subject_name, region,
+                                                   "{:s}")
+        store_align_event_name = epoch_event_name
 
-    marked_events_times, marked_events_colors, marked_events_markers = \
-        socialMiceUtils.buildMarkedEventsInfo(
-            events_times=events_times,
-            events_colors=events_colors,
-            events_markers=events_markers,
-        )
+    epoched_spikes = epochedSpikesStore.load(
+        filename_pattern=epoched_spikes_times_filename,
+        align_event_name=store_align_event_name)
+    units_ids = epoched_spikes["units_ids"]
 
-    align_event_times = [trials_info[align_event_name][trial_id]
-                         for trial_id in trials_ids]
+    plot_data = get_plot_data(
+        epoched_spikes=epoched_spikes, epoch_event_name=epoch_event_name,
+        sorting_event_name=sorting_event_name,
+        colors_event_name=colors_event_name,
+        align_event_name=align_event_name, events_names=events_names,
+        events_colors=events_colors, events_markers=events_markers,
+        xmin=xmin, xmax=xmax)
 
     sorting_label = sorting_event_name if sorting_event_name is not None \
         else "None"
-    title = (f"Neuron: {unit_id}, Region: {region}, "
-             f"Epoched by: {epoch_event_name}, Sorted by: {sorting_label}, "
-             f"Spike colors by: {colors_event_name}")
-    fig = svGPFA.plot.plotUtilsPlotly.getSpikesTimesPlotOneNeuron(
-        spikes_times=spikes_times,
-        sorting_times=sorting_times,
-        neuron_index=neuron_index,
-        title=title,
-        trials_ids=trials_ids,
-        marked_events_times=marked_events_times,
-        marked_events_colors=marked_events_colors,
-        marked_events_markers=marked_events_markers,
-        align_event_times=align_event_times,
-        trials_colors=trials_colors,
-    )
-    if xmin is None:
-        xmin = np.min(trials_start_times)
-    if xmax is None:
-        xmax = np.max(trials_end_times)
-    fig.update_xaxes(range=[xmin, xmax])
+    jobs = []
+    if all_units:
+        plotted_units_ids = units_ids
+    else:
+        plotted_units_ids = [unit_id]
+    for plotted_unit_id in plotted_units_ids:
+        neuron_index = \
+            np.nonzero(np.array(units_ids) == plotted_unit_id)[0].item()
+        title = (f"Neuron: {plotted_unit_id}, Region: {region}, "
+                 f"Epoched by: {epoch_event_name}, "
+                 f"Sorted by: {sorting_label}, "
+                 f"Spike colors by: {colors_event_name}")
+        jobs.append({"unit_id": plotted_unit_id,
+                     "neuron_index": neuron_index,
+                     "title": title,
+                     "fig_filename_pattern": fig_filename_pattern.format(
+                         subject_name, region, epoch_event_name,
+                         plotted_unit_id, "{:s}")})
 
-    fig.write_image(fig_filename_pattern.format(subject_name, region,
-                                                epoch_event_name, unit_id, "png"))
-    fig.write_html(fig_filename_pattern.format(subject_name, region,
-                                               epoch_event_name, unit_id, "html"))
+    if not all_units:
+        job = jobs[0]
+        plot_unit(epoched_spikes=epoched_spikes, plot_data=plot_data,
+                  neuron_index=job["neuron_index"], title=job["title"],
+                  fig_filename_pattern=job["fig_filename_pattern"])
+    else:
+        print(f"Plotting {len(jobs)} units")
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(epoched_spikes_times_filename,
+                          store_align_event_name, plot_data)) as executor:
+            futures = {executor.submit(plot_unit_in_worker, job): job
+                       for job in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                    print(f"Plotted unit {job['unit_id']}")
+                except Exception:
+                    print(f"Error plotting unit {job['unit_id']}")
+                    print(traceback.format_exc())
     breakpoint()
 
 
@@ -0,0 +1,84 @@
+import sys
+import os
+import time
+import argparse
+import numpy as np
+import torch
+
+import predictionUtils
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("estResNumber", help="estimation result number",
+                        type=int)
+    parser.add_argument("--grid_start",
+                        help=("first time of the prediction grid (the "
+                              "earliest trial start time if not given)"),
+                        type=float, default=None)
+    parser.add_argument("--grid_end",
+                        help=("last time of the prediction grid (the latest "
+                              "trial end time if not given)"),
+                        type=float, default=None)
+    parser.add_argument("--grid_step", help="prediction grid step (sec)",
+                        type=float, default=0.01)
+    parser.add_argument("--max_chunk_mb",
+                        help=("approximate memory, in megabytes, used to "
+                              "predict every chunk of the grid"),
+                        type=float, default=256.0)
+    parser.add_argument("--n_threads", help="number of threads for PyTorch",
+                        type=int, default=6)
+    parser.add_argument("--model_export_filename_pattern",
+                        help=("filename pattern of the exported estimated "
+                              "parameters"),
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.npz")
+    parser.add_argument("--model_save_filename_pattern",
+                        help=("model save filename pattern, used if the "
+                              "exported parameters do not exist"),
+                        type=str,
+                        default="../../results/{:08d}_estimatedModel.pickle")
+    parser.add_argument("--prediction_filename_pattern",
+                        help="prediction filename pattern",
+                        type=str,
+                        default="../../results/{:08d}_prediction.{:s}")
+    args = parser.parse_args()
+
+    estResNumber = args.estResNumber
+    grid_start = args.grid_start
+    grid_end = args.grid_end
+    grid_step = args.grid_step
+    max_chunk_mb = args.max_chunk_mb
+    n_threads = args.n_threads
+    model_export_filename_pattern = args.model_export_filename_pattern
+    model_save_filename_pattern = args.model_save_filename_pattern
+    prediction_filename_pattern = args.prediction_filename_pattern
+
+    torch.set_num_threads(n_threads)
+
+    model_filename = model_export_filename_pattern.format(estResNumber)
+    if not os.path.exists(model_filename):
+        model_filename = model_save_filename_pattern.format(estResNumber)
+    loaded_model = predictionUtils.load_model(model_filename=model_filename)
+
+    if grid_start is None:
+        grid_start = loaded_model["trials_start_times"].min()
+    if grid_end is None:
+        grid_end = loaded_model["trials_end_times"].max()
+    times = np.arange(grid_start, grid_end + grid_step / 2, grid_step)
+
+    start_time = time.time()
+    saved_filenames = predictionUtils.predict(
+        model=loaded_model["model"], times=times,
+        filename_pattern=prediction_filename_pattern.format(estResNumber,
+                                                            "{:s}"),
+        trials_ids=loaded_model["trials_ids"],
+        units_ids=loaded_model["units_ids"],
+        max_chunk_mb=max_chunk_mb)
+    elapsed_time = time.time() - start_time
+    print(f"Predicted {len(times)} times in {elapsed_time:.2f} secs")
+    print(f"Saved {saved_filenames}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,77 @@
+import sys
+import argparse
+
+import resultsIndex
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_index_filename",
+                        help="SQLite index of estimation results",
+                        type=str,
+                        default="../../results/estimationResults.sqlite")
+    parser.add_argument("--subject_name", help="subject name", type=str,
+                        default=None)
+    parser.add_argument("--region", help="region", type=str, default=None)
+    parser.add_argument("--epoch_event_name", help="epoch event name",
+                        type=str, default=None)
+    parser.add_argument("--n_latents", help="number of latent processes",
+                        type=int, default=None)
+    parser.add_argument("--common_n_ind_points",
+                        help="common number of inducing points",
+                        type=int, default=None)
+    parser.add_argument("--min_n_ind_points",
+                        help="smallest number of inducing points of a trial",
+                        type=int, default=None)
+    parser.add_argument("--max_n_ind_points",
+                        help="largest number of inducing points of a trial",
+                        type=int, default=None)
+    parser.add_argument("--trials_ids_hash",
+                        help="hash of the set of estimation trials",
+                        type=str, default=None)
+    parser.add_argument("--termination_criterion",
+                        help=("termination criterion (em_max_iter, "
+                              "relative_improvement, max_elapsed_secs, "
+                              "max_step_secs or error)"),
+                        type=str, default=None)
+    parser.add_argument("--order_by", help="column to rank runs by",
+                        type=str, default="lower_bound")
+    parser.add_argument("--ascending", help="rank runs in ascending order",
+                        action="store_true")
+    parser.add_argument("--limit", help="maximum number of runs to list",
+                        type=int, default=20)
+    parser.add_argument("--columns",
+                        help="comma-separated columns to list",
+                        type=str,
+                        default=("estim_res_number,subject_name,region,"
+                                 "epoch_event_name,n_latents,"
+                                 "common_n_ind_points,n_trials,lower_bound,"
+                                 "n_iterations,elapsed_time"))
+    args = parser.parse_args()
+
+    results_index_filename = args.results_index_filename
+    filters = {column_name: getattr(args, column_name) for column_name in
+               ["subject_name", "region", "epoch_event_name", "n_latents",
+                "common_n_ind_points", "min_n_ind_points",
+                "max_n_ind_points", "trials_ids_hash",
+                "termination_criterion"]
+               if getattr(args, column_name) is not None}
+    order_by = args.order_by
+    ascending = args.ascending
+    limit = args.limit
+    columns = args.columns.split(",")
+
+    rows = resultsIndex.query_runs(index_filename=results_index_filename,
+                                   filters=filters, order_by=order_by,
+                                   ascending=ascending, limit=limit)
+    cells = [columns] + [["" if row[column] is None else str(row[column])
+                          for column in columns] for row in rows]
+    widths = [max(len(row_cells[j]) for row_cells in cells)
+              for j in range(len(columns))]
+    for row_cells in cells:
+        print("  ".join(cell.rjust(width)
+                        for cell, width in zip(row_cells, widths)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
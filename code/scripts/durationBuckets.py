@@ -0,0 +1,218 @@
+import numpy as np
+import torch
+
+import svGPFA.stats.kernelsMatricesStore
+import svGPFA.stats.svPosteriorOnIndPoints
+import svGPFA.stats.svPosteriorOnLatents
+import svGPFA.stats.svEmbedding
+import svGPFA.stats.expectedLogLikelihood
+import svGPFA.stats.klDivergence
+import svGPFA.stats.svLowerBound
+
+
+def get_duration_buckets(trials_start_times, trials_end_times, rel_tol):
+    """Groups trials into buckets of similar durations: sorted by duration,
+    a trial starts a new bucket when it is more than ``rel_tol`` (relative)
+    longer than the shortest trial of the current bucket. All trials of a
+    bucket share its padded duration, that of its longest trial.
+
+    Returns a dictionary with keys ``trials_buckets`` (bucket index of every
+    trial), ``representatives`` (index of the first trial of every bucket),
+    ``buckets_durations``, ``padded_trials_end_times`` (trials start times
+    plus the durations of their buckets) and ``shifts`` (start time of every
+    trial minus that of the representative of its bucket).
+    """
+    trials_start_times = np.asarray(trials_start_times, dtype=np.float64)
+    durations = np.asarray(trials_end_times, dtype=np.float64) - \
+        trials_start_times
+    order = np.argsort(durations, kind="stable")
+    trials_buckets = np.empty(len(durations), dtype=np.int64)
+    buckets_durations = []
+    bucket_min_duration = None
+    for trial_index in order:
+        duration = durations[trial_index]
+        if bucket_min_duration is None or \
+                duration > bucket_min_duration * (1 + rel_tol):
+            bucket_min_duration = duration
+            buckets_durations.append(duration)
+        trials_buckets[trial_index] = len(buckets_durations) - 1
+        buckets_durations[-1] = duration
+    buckets_durations = np.asarray(buckets_durations)
+    # first trial (in the original order) of every bucket
+    representatives = np.full(len(buckets_durations), len(durations),
+                              dtype=np.int64)
+    np.minimum.at(representatives, trials_buckets,
+                  np.arange(len(durations)))
+    duration_buckets = {
+        "trials_buckets": trials_buckets,
+        "representatives": representatives,
+        "buckets_durations": buckets_durations,
+        "padded_trials_end_times":
+            trials_start_times + buckets_durations[trials_buckets],
+        "shifts": trials_start_times -
+            trials_start_times[representatives[trials_buckets]],
+    }
+    return duration_buckets
+
+
+def mask_leg_quad_weights(leg_quad_points, leg_quad_weights,
+                          trials_end_times):
+    """Returns a copy of the quadrature weights (``n_trials`` x ``n_quad`` x
+    1) of padded trials windows with the weights of quadrature points after
+    the end of their trials set to zero."""
+    trials_end_times = torch.as_tensor(np.asarray(trials_end_times),
+                                       dtype=leg_quad_points.dtype)
+    masked_leg_quad_weights = leg_quad_weights.clone()
+    masked_leg_quad_weights[leg_quad_points > trials_end_times.reshape(
+        -1, 1, 1)] = 0.0
+    return masked_leg_quad_weights
+
+
+class BucketedKMSMixin:
+    """Ties the inducing points locations of the trials of each duration
+    bucket (see :func:`get_duration_buckets`): the locations of a trial are
+    those of the representative of its bucket shifted by the difference of
+    their start times, so that, for stationary kernels, the kernel matrices
+    of the representative are those of every trial of the bucket. Only the
+    locations of representatives are optimized."""
+
+    def setBuckets(self, duration_buckets):
+        self._trials_buckets = torch.as_tensor(
+            duration_buckets["trials_buckets"], dtype=torch.long)
+        self._representatives = torch.as_tensor(
+            duration_buckets["representatives"], dtype=torch.long)
+        self._shifts = torch.as_tensor(
+            duration_buckets["shifts"], dtype=torch.double).reshape(-1, 1, 1)
+
+    def _getTiedIndPointsLocs(self, latentIndex):
+        representatives_locs = \
+            self._ind_points_locs[latentIndex][self._representatives]
+        tied_locs = representatives_locs[self._trials_buckets] + self._shifts
+        return tied_locs
+
+
+class BucketedIndPointsLocsKMS_Chol(
+        BucketedKMSMixin, svGPFA.stats.kernelsMatricesStore.
+        IndPointsLocsKMS_Chol):
+    """Kernel matrices of inducing points locations, and their Cholesky
+    factors, computed once per duration bucket and shared by its trials."""
+
+    def buildKernelsMatrices(self):
+        n_latents = len(self._kernels)
+        self._Kzz = [None for k in range(n_latents)]
+        self._Kzz_inv = [None for k in range(n_latents)]
+        for k in range(n_latents):
+            # keep the locations of non-representative trials, used by
+            # predictions, in sync with their representatives
+            with torch.no_grad():
+                self._ind_points_locs[k][:] = self._getTiedIndPointsLocs(
+                    latentIndex=k)
+            representatives_locs = \
+                self._ind_points_locs[k][self._representatives]
+            buckets_Kzz = self._kernels[k].buildKernelMatrix(
+                X1=representatives_locs) + \
+                self._reg_param * torch.eye(
+                    n=representatives_locs.shape[1],
+                    dtype=representatives_locs.dtype,
+                    device=representatives_locs.device)
+            buckets_Kzz_inv = self._invertKzz3D(buckets_Kzz)
+            self._Kzz[k] = buckets_Kzz[self._trials_buckets]
+            self._Kzz_inv[k] = buckets_Kzz_inv[self._trials_buckets]
+
+
+class BucketedIndPointsLocsAndAllTimesKMS(
+        BucketedKMSMixin, svGPFA.stats.kernelsMatricesStore.
+        IndPointsLocsAndAllTimesKMS):
+    """Kernel matrices between quadrature times and inducing points
+    locations computed once per duration bucket and shared by its trials.
+    Quadrature times of the trials of a bucket should be equal up to their
+    shifts (e.g., Legendre points of their padded windows)."""
+
+    def buildKernelsMatrices(self):
+        n_latents = len(self._ind_points_locs)
+        representatives_t = self._t[self._representatives]
+        self._Ktz = [None for k in range(n_latents)]
+        self._KttDiag = torch.zeros(self._t.shape[0], self._t.shape[1],
+                                    n_latents, dtype=self._t.dtype,
+                                    device=self._t.device)
+        for k in range(n_latents):
+            representatives_locs = \
+                self._ind_points_locs[k][self._representatives]
+            buckets_Ktz = self._kernels[k].buildKernelMatrix(
+                X1=representatives_t, X2=representatives_locs)
+            buckets_KttDiag = self._kernels[k].buildKernelMatrixDiag(
+                X=representatives_t)
+            self._Ktz[k] = buckets_Ktz[self._trials_buckets]
+            self._KttDiag[:, :, k] = \
+                buckets_KttDiag[self._trials_buckets].reshape(
+                    self._t.shape[0], self._t.shape[1])
+
+
+class BucketedIndPointsLocsAndAssocTimesKMS(
+        BucketedKMSMixin, svGPFA.stats.kernelsMatricesStore.
+        IndPointsLocsAndAssocTimesKMS):
+    """Kernel matrices between spikes times and the tied inducing points
+    locations. The spikes of all trials are evaluated in one kernel call and
+    the result is split into per-trial views."""
+
+    def setTimes(self, times):
+        # times[r] \in nSpikes[r]
+        super().setTimes(times=times)
+        self._n_spikes = [len(trial_times) for trial_times in times]
+        self._all_t = torch.cat([trial_times.reshape(-1) for trial_times in
+                                 times]).to(torch.double)
+        self._spikes_trials = torch.repeat_interleave(
+            torch.arange(len(times)), torch.tensor(self._n_spikes,
+                                                   dtype=torch.long))
+
+    def buildKernelsMatrices(self):
+        n_latents = len(self._ind_points_locs)
+        self._Ktz = [None for k in range(n_latents)]
+        self._KttDiag = [None for k in range(n_latents)]
+        for k in range(n_latents):
+            tied_locs = self._getTiedIndPointsLocs(latentIndex=k)
+            # all_Ktz \in nAllSpikes x 1 x nIndPoints
+            all_Ktz = self._kernels[k].buildKernelMatrix(
+                X1=self._all_t.reshape(-1, 1, 1),
+                X2=tied_locs[self._spikes_trials])
+            all_KttDiag = self._kernels[k].buildKernelMatrixDiag(
+                X=self._all_t)
+            self._Ktz[k] = list(torch.split(
+                all_Ktz.reshape(len(self._all_t), -1), self._n_spikes))
+            self._KttDiag[k] = list(torch.split(all_KttDiag,
+                                                self._n_spikes))
+
+
+def create_model(kernels, duration_buckets):
+    """Creates a point-process svGPFA model with exponential link, linear
+    embedding and Cholesky-represented covariances, as
+    ``SVGPFAModelFactory.buildModelPyTorch`` of
+    :mod:`svGPFA.stats.svGPFAModelFactory`, whose kernel matrices are
+    computed once per duration bucket of ``duration_buckets`` (see
+    :func:`get_duration_buckets`). ``kernels`` should be stationary."""
+    qU = svGPFA.stats.svPosteriorOnIndPoints.SVPosteriorOnIndPointsChol()
+    indPointsLocsKMS = BucketedIndPointsLocsKMS_Chol()
+    indPointsLocsAndAllTimesKMS = BucketedIndPointsLocsAndAllTimesKMS()
+    indPointsLocsAndAssocTimesKMS = BucketedIndPointsLocsAndAssocTimesKMS()
+    for kms in (indPointsLocsKMS, indPointsLocsAndAllTimesKMS,
+                indPointsLocsAndAssocTimesKMS):
+        kms.setBuckets(duration_buckets=duration_buckets)
+    qKAllTimes = svGPFA.stats.svPosteriorOnLatents.\
+        SVPosteriorOnLatentsAllTimes(
+            svPosteriorOnIndPoints=qU, indPointsLocsKMS=indPointsLocsKMS,
+            indPointsLocsAndTimesKMS=indPointsLocsAndAllTimesKMS)
+    qKAssocTimes = svGPFA.stats.svPosteriorOnLatents.\
+        SVPosteriorOnLatentsAssocTimes(
+            svPosteriorOnIndPoints=qU, indPointsLocsKMS=indPointsLocsKMS,
+            indPointsLocsAndTimesKMS=indPointsLocsAndAssocTimesKMS)
+    qHAllTimes = svGPFA.stats.svEmbedding.LinearSVEmbeddingAllTimes(
+        svPosteriorOnLatents=qKAllTimes)
+    qHAssocTimes = svGPFA.stats.svEmbedding.LinearSVEmbeddingAssocTimes(
+        svPosteriorOnLatents=qKAssocTimes)
+    eLL = svGPFA.stats.expectedLogLikelihood.PointProcessELLExpLink(
+        svEmbeddingAllTimes=qHAllTimes, svEmbeddingAssocTimes=qHAssocTimes)
+    klDiv = svGPFA.stats.klDivergence.KLDivergence(
+        indPointsLocsKMS=indPointsLocsKMS, svPosteriorOnIndPoints=qU)
+    model = svGPFA.stats.svLowerBound.SVLowerBound(eLL=eLL, klDiv=klDiv)
+    model.setKernels(kernels=kernels)
+    return model
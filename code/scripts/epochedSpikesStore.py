@@ -0,0 +1,278 @@
+import numpy as np
+import pandas as pd
+
+# extensions of the files of an epoched spikes store, filled into the
+# ``{:s}`` extension placeholder of the epoched spikes filename pattern
+spikes_times_extension = "spikes.npy"
+offsets_extension = "offsets.npy"
+index_extension = "index.npz"
+trials_info_extension = "trials_info.npz"
+
+
+def lists_to_epoched_spikes_times(spikes_times):
+    """Converts nested ``spikes_times[trial][unit]`` lists to the flat
+    ``(epoched_spikes_times, epoched_offsets)`` representation returned by
+    :func:`socialMiceUtils.epoch_units_spikes_times`."""
+    n_trials = len(spikes_times)
+    n_units = len(spikes_times[0]) if n_trials > 0 else 0
+    trials_units_spikes_times = [np.atleast_1d(np.asarray(spikes_times[r][n],
+                                                          dtype=np.float64))
+                                 for r in range(n_trials)
+                                 for n in range(n_units)]
+    epoched_offsets = np.zeros(n_trials * n_units + 1, dtype=np.int64)
+    np.cumsum([len(times) for times in trials_units_spikes_times],
+              out=epoched_offsets[1:])
+    if len(trials_units_spikes_times) > 0:
+        epoched_spikes_times = np.concatenate(trials_units_spikes_times)
+    else:
+        epoched_spikes_times = np.empty(0, dtype=np.float64)
+    return epoched_spikes_times, epoched_offsets
+
+
+def save(filename_pattern, epoched_spikes_times, epoched_offsets, units_ids,
+         trials_ids, trials_start_times, trials_end_times, trials_info,
+         epoch_times=None):
+    """Saves epoched spikes in columnar format.
+
+    ``filename_pattern`` should contain one ``{:s}`` placeholder, which is
+    filled with the extension of each of the store files. ``epoch_times``
+    are the session times subtracted from the spikes times of every trial
+    (zero for a session store, which keeps spikes times in session time);
+    they are needed to re-align the store with :func:`align`. Returns the
+    list of saved filenames.
+    """
+    spikes_times_filename = filename_pattern.format(spikes_times_extension)
+    offsets_filename = filename_pattern.format(offsets_extension)
+    index_filename = filename_pattern.format(index_extension)
+    trials_info_filename = filename_pattern.format(trials_info_extension)
+
+    np.save(spikes_times_filename,
+            np.asarray(epoched_spikes_times, dtype=np.float64))
+    np.save(offsets_filename, np.asarray(epoched_offsets, dtype=np.int64))
+    index = {"units_ids": np.asarray(units_ids, dtype=np.int64),
+             "trials_ids": np.asarray(trials_ids, dtype=np.int64),
+             "trials_start_times": np.asarray(trials_start_times,
+                                              dtype=np.float64),
+             "trials_end_times": np.asarray(trials_end_times,
+                                            dtype=np.float64)}
+    if epoch_times is not None:
+        index["epoch_times"] = np.asarray(epoch_times, dtype=np.float64)
+    np.savez(index_filename, **index)
+    columns = {}
+    for column_name in trials_info.columns:
+        column = trials_info[column_name].to_numpy()
+        if column.dtype == object:
+            column = column.astype(str)
+        columns[column_name] = column
+    np.savez(trials_info_filename, **columns)
+    return [spikes_times_filename, offsets_filename, index_filename,
+            trials_info_filename]
+
+
+def get_filenames(filename_pattern):
+    """Returns the filenames of the files of the epoched spikes store
+    ``filename_pattern`` (see :func:`save`)."""
+    filenames = [filename_pattern.format(extension) for extension in
+                 (spikes_times_extension, offsets_extension, index_extension,
+                  trials_info_extension)]
+    return filenames
+
+
+def load(filename_pattern, mmap_mode="r", align_event_name=None):
+    """Loads epoched spikes saved with :func:`save`.
+
+    The spikes times and offsets are memory mapped (unless ``mmap_mode`` is
+    None), so loading is independent of the size of the store and memory
+    only grows with the slices that are accessed. Returns a dictionary with
+    keys ``epoched_spikes_times``, ``epoched_offsets``, ``n_trials``,
+    ``n_units``, ``units_ids``, ``trials_ids``, ``trials_start_times``,
+    ``trials_end_times``, ``trials_info``, ``epoch_times`` (None for stores
+    saved without them) and ``spikes_shifts`` (see :func:`align`).
+
+    If ``align_event_name`` is given the epoched spikes (e.g., of a session
+    store) are aligned to the times of this column of the trials
+    information.
+    """
+    epoched_spikes_times = np.load(
+        filename_pattern.format(spikes_times_extension), mmap_mode=mmap_mode)
+    epoched_offsets = np.load(filename_pattern.format(offsets_extension),
+                              mmap_mode=mmap_mode)
+    with np.load(filename_pattern.format(index_extension)) as index:
+        units_ids = index["units_ids"]
+        trials_ids = index["trials_ids"]
+        trials_start_times = index["trials_start_times"]
+        trials_end_times = index["trials_end_times"]
+        if "epoch_times" in index.files:
+            epoch_times = index["epoch_times"]
+        else:
+            epoch_times = None
+    with np.load(filename_pattern.format(trials_info_extension)) as columns:
+        trials_info = pd.DataFrame({column_name: columns[column_name]
+                                    for column_name in columns.files})
+    epoched_spikes = {"epoched_spikes_times": epoched_spikes_times,
+                      "epoched_offsets": epoched_offsets,
+                      "n_trials": len(trials_ids),
+                      "n_units": len(units_ids),
+                      "units_ids": units_ids,
+                      "trials_ids": trials_ids,
+                      "trials_start_times": trials_start_times,
+                      "trials_end_times": trials_end_times,
+                      "trials_info": trials_info,
+                      "epoch_times": epoch_times,
+                      "spikes_shifts": np.zeros(len(trials_ids))}
+    if align_event_name is not None:
+        epoched_spikes = align(epoched_spikes=epoched_spikes,
+                               align_times=trials_info[align_event_name])
+    return epoched_spikes
+
+
+def align(epoched_spikes, align_times):
+    """Returns a view of ``epoched_spikes`` with the spikes times of trial
+    ``r`` relative to ``align_times[r]`` (in session time).
+
+    The view shares the spikes times and offsets of ``epoched_spikes``,
+    without copying or rewriting them; the per-trial difference between the
+    new and the stored alignment is kept in ``spikes_shifts`` and is
+    subtracted when spikes times are read with :func:`get_spikes_times`.
+    """
+    if epoched_spikes["epoch_times"] is None:
+        raise ValueError("The epoched spikes were saved without their epoch "
+                         "times and cannot be re-aligned")
+    align_times = np.asarray(align_times, dtype=np.float64)
+    shifts = align_times - epoched_spikes["epoch_times"]
+    aligned_spikes = dict(epoched_spikes)
+    aligned_spikes["epoch_times"] = align_times
+    aligned_spikes["spikes_shifts"] = epoched_spikes["spikes_shifts"] + shifts
+    aligned_spikes["trials_start_times"] = \
+        epoched_spikes["trials_start_times"] - shifts
+    aligned_spikes["trials_end_times"] = \
+        epoched_spikes["trials_end_times"] - shifts
+    return aligned_spikes
+
+
+def get_selection_indices(selection, n):
+    """Returns the indices selected by ``selection`` among ``n`` elements:
+    all of them if ``selection`` is None, the True elements of a boolean
+    mask, or ``selection`` itself as an array of indices."""
+    if selection is None:
+        return np.arange(n)
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        return np.nonzero(selection)[0]
+    return selection.astype(np.int64, copy=False).reshape(-1)
+
+
+def subset(epoched_spikes, trials_indices=None, units_indices=None):
+    """Returns epoched spikes, with the same keys as those returned by
+    :func:`load`, keeping only the trials at ``trials_indices`` and the
+    units at ``units_indices`` (all if None; boolean masks are also
+    accepted).
+
+    When all units of consecutive trials are kept, the spikes times and
+    offsets of the subset are views of those of ``epoched_spikes`` (so a
+    memory-mapped store is not read); otherwise the spikes times of the
+    selected trials and units are copied with a single gather. The trials
+    information, indexed by trials ids, is shared with ``epoched_spikes``.
+    """
+    n_trials = epoched_spikes["n_trials"]
+    n_units = epoched_spikes["n_units"]
+    trials_indices = get_selection_indices(trials_indices, n_trials)
+    units_indices = get_selection_indices(units_indices, n_units)
+    epoched_spikes_times = epoched_spikes["epoched_spikes_times"]
+    epoched_offsets = epoched_spikes["epoched_offsets"]
+    all_units = len(units_indices) == n_units and \
+        np.array_equal(units_indices, np.arange(n_units))
+    consecutive_trials = len(trials_indices) > 0 and \
+        np.all(np.diff(trials_indices) == 1)
+    if all_units and consecutive_trials:
+        first_block = trials_indices[0] * n_units
+        last_block = (trials_indices[-1] + 1) * n_units
+        subset_offsets = epoched_offsets[first_block:last_block+1]
+        subset_spikes_times = epoched_spikes_times[subset_offsets[0]:
+                                                   subset_offsets[-1]]
+        subset_offsets = subset_offsets - subset_offsets[0]
+    else:
+        # (trial, unit) blocks of the subset, in trial-major order
+        blocks = (trials_indices[:, None] * n_units +
+                  units_indices[None, :]).reshape(-1)
+        blocks_starts = np.asarray(epoched_offsets[blocks])
+        blocks_counts = np.asarray(epoched_offsets[blocks+1]) - blocks_starts
+        subset_offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+        np.cumsum(blocks_counts, out=subset_offsets[1:])
+        gather_indices = np.arange(subset_offsets[-1]) + np.repeat(
+            blocks_starts - subset_offsets[:-1], blocks_counts)
+        subset_spikes_times = np.asarray(epoched_spikes_times)[gather_indices]
+    epoch_times = epoched_spikes["epoch_times"]
+    if epoch_times is not None:
+        epoch_times = epoch_times[trials_indices]
+    subset_spikes = {
+        "epoched_spikes_times": subset_spikes_times,
+        "epoched_offsets": subset_offsets,
+        "n_trials": len(trials_indices),
+        "n_units": len(units_indices),
+        "units_ids": epoched_spikes["units_ids"][units_indices],
+        "trials_ids": epoched_spikes["trials_ids"][trials_indices],
+        "trials_start_times":
+            epoched_spikes["trials_start_times"][trials_indices],
+        "trials_end_times": epoched_spikes["trials_end_times"][trials_indices],
+        "trials_info": epoched_spikes["trials_info"],
+        "epoch_times": epoch_times,
+        "spikes_shifts": epoched_spikes["spikes_shifts"][trials_indices]}
+    return subset_spikes
+
+
+def subset_ids(epoched_spikes, trials_ids=None, units_ids=None):
+    """Returns the epoched spikes (see :func:`subset`) of the trials with ids
+    in ``trials_ids`` and the units with ids in ``units_ids`` (all if None),
+    in the order in which they are stored."""
+    trials_indices = units_indices = None
+    if trials_ids is not None:
+        trials_indices = np.nonzero(np.isin(epoched_spikes["trials_ids"],
+                                            trials_ids))[0]
+    if units_ids is not None:
+        units_indices = np.nonzero(np.isin(epoched_spikes["units_ids"],
+                                           units_ids))[0]
+    subset_spikes = subset(epoched_spikes=epoched_spikes,
+                           trials_indices=trials_indices,
+                           units_indices=units_indices)
+    return subset_spikes
+
+
+def to_lists(epoched_spikes):
+    """Converts epoched spikes to the nested ``spikes_times[trial][unit]``
+    lists used by svGPFA, applying their alignment (see :func:`align`)."""
+    n_trials = epoched_spikes["n_trials"]
+    n_units = epoched_spikes["n_units"]
+    if n_units == 0:
+        return [[] for r in range(n_trials)]
+    epoched_offsets = np.asarray(epoched_spikes["epoched_offsets"])
+    trials_counts = np.diff(epoched_offsets[::n_units])
+    epoched_spikes_times = epoched_spikes["epoched_spikes_times"] - \
+        np.repeat(epoched_spikes["spikes_shifts"], trials_counts)
+    all_spikes_times = epoched_spikes_times.tolist()
+    offsets = epoched_offsets.tolist()
+    spikes_times = [[all_spikes_times[offsets[r*n_units+n]:
+                                      offsets[r*n_units+n+1]]
+                     for n in range(n_units)]
+                    for r in range(n_trials)]
+    return spikes_times
+
+
+def get_spikes_times(epoched_spikes, trials_indices=None, units_indices=None):
+    """Returns nested ``spikes_times[trial][unit]`` lists for the trials and
+    units at ``trials_indices`` and ``units_indices`` (all if None), reading
+    only their spikes from the store and applying the alignment of
+    ``epoched_spikes``."""
+    subset_spikes = subset(epoched_spikes=epoched_spikes,
+                           trials_indices=trials_indices,
+                           units_indices=units_indices)
+    spikes_times = to_lists(epoched_spikes=subset_spikes)
+    return spikes_times
+
+
+def get_spikes_counts(epoched_spikes):
+    """Returns the number of spikes of every trial and unit, as an
+    ``n_trials`` x ``n_units`` array, from the offsets alone."""
+    spikes_counts = np.diff(epoched_spikes["epoched_offsets"]).reshape(
+        epoched_spikes["n_trials"], epoched_spikes["n_units"])
+    return spikes_counts
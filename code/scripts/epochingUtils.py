@@ -0,0 +1,187 @@
+import os
+import hashlib
+import configparser
+import numpy as np
+import pandas as pd
+
+import socialMiceUtils
+import spikesTimesLoader
+import epochedSpikesStore
+
+
+def get_store_filename_pattern(subject_name, region, epoch_event_name,
+                               results_filename_pattern, session_store=False,
+                               session_store_filename_pattern=None):
+    """Returns the filename pattern, with one ``{:s}`` placeholder for the
+    extension, of the epoched spikes store (or session store, if
+    ``session_store`` is True) of ``subject_name`` and ``region``."""
+    if session_store:
+        store_filename_pattern = session_store_filename_pattern.format(
+            subject_name, region, "{:s}")
+    else:
+        store_filename_pattern = results_filename_pattern.format(
+            subject_name, region, epoch_event_name, "{:s}")
+    return store_filename_pattern
+
+
+def get_epoch_params(subject_name, region, epoch_event_name,
+                     epoch_start_event_name, epoch_end_event_name,
+                     data_dirname, trials_info_filename, session_store=False):
+    """Returns the parameters, saved in the metadata of an epoched spikes
+    store, that must match for the store to be up to date."""
+    if session_store:
+        epoch_event_name = "None"
+    epoch_params = {"subject_name": subject_name,
+                    "region": region,
+                    "epoch_event_name": epoch_event_name,
+                    "epoch_start_event_name": epoch_start_event_name,
+                    "epoch_end_event_name": epoch_end_event_name,
+                    "data_dirname": data_dirname,
+                    "trials_info_filename": trials_info_filename}
+    return epoch_params
+
+
+def get_inputs_signature(data_dirname, subject_name, region,
+                         trials_info_filename):
+    """Returns the number of units files of ``subject_name`` and ``region``,
+    a hash of the name, modification time and size of every units file, and
+    the modification time and size of the trials information file, as
+    strings to be saved in the metadata of an epoched spikes store."""
+    trials_info_stat = os.stat(os.path.join(data_dirname, subject_name,
+                                            trials_info_filename))
+    spikes_dirname = os.path.join(data_dirname, subject_name, region)
+    spikes_filenames = spikesTimesLoader.get_spikes_filenames(
+        spikes_dirname=spikes_dirname)
+    mtimes, sizes = spikesTimesLoader.get_files_stats(
+        spikes_dirname=spikes_dirname, spikes_filenames=spikes_filenames)
+    # as spikesTimesLoader's cache index, every file is compared, so that
+    # replacing a file by an older one of the same total size is detected
+    units_files_hash = hashlib.sha1("\n".join(
+        f"{filename}\t{mtime}\t{size}" for filename, mtime, size in
+        zip(spikes_filenames, mtimes, sizes)).encode()).hexdigest()
+    inputs_signature = {
+        "n_units_files": str(len(spikes_filenames)),
+        "units_files_hash": units_files_hash,
+        "trials_info_mtime_ns": str(trials_info_stat.st_mtime_ns),
+        "trials_info_size": str(trials_info_stat.st_size),
+    }
+    return inputs_signature
+
+
+def is_up_to_date(store_filename_pattern, epoch_params, inputs_signature):
+    """Returns True if the epoched spikes store ``store_filename_pattern``
+    exists and its metadata records the parameters ``epoch_params`` (see
+    :func:`get_epoch_params`) and the inputs signature ``inputs_signature``
+    (see :func:`get_inputs_signature`)."""
+    store_filenames = [store_filename_pattern.format(extension)
+                       for extension in [
+                           "metadata",
+                           epochedSpikesStore.spikes_times_extension,
+                           epochedSpikesStore.offsets_extension,
+                           epochedSpikesStore.index_extension,
+                           epochedSpikesStore.trials_info_extension]]
+    if not all(os.path.exists(filename) for filename in store_filenames):
+        return False
+    metadata = configparser.ConfigParser()
+    metadata.read(store_filename_pattern.format("metadata"))
+    if "inputs" not in metadata:
+        return False
+    for param_name, param_value in epoch_params.items():
+        if metadata["params"].get(param_name) != str(param_value):
+            return False
+    return dict(metadata["inputs"]) == inputs_signature
+
+
+def epoch_spikes_times(subject_name, region, epoch_event_name,
+                       epoch_start_event_name, epoch_end_event_name,
+                       data_dirname, trials_info_filename,
+                       results_filename_pattern, session_store=False,
+                       session_store_filename_pattern=None,
+                       cache_filename_pattern=None, n_workers=None,
+                       use_processes=False):
+    """Epochs the spikes times of all units of ``subject_name`` and
+    ``region`` and saves them, with their metadata, in an epoched spikes
+    store (or a session store, if ``session_store`` is True).
+
+    Returns the list of saved filenames.
+    """
+    inputs_signature = get_inputs_signature(
+        data_dirname=data_dirname, subject_name=subject_name, region=region,
+        trials_info_filename=trials_info_filename)
+    trials_info = pd.read_csv((f"{data_dirname}/{subject_name}/"
+                               f"{trials_info_filename}"))
+    n_trials = trials_info.shape[0]
+    spikes_dirname = f"{data_dirname}/{subject_name}/{region}"
+    units_ids, units_spikes_times, units_offsets = \
+        spikesTimesLoader.load_units_spikes_times(
+            spikes_dirname=spikes_dirname,
+            cache_filename_pattern=cache_filename_pattern,
+            n_workers=n_workers, use_processes=use_processes)
+    store_filename_pattern = get_store_filename_pattern(
+        subject_name=subject_name, region=region,
+        epoch_event_name=epoch_event_name,
+        results_filename_pattern=results_filename_pattern,
+        session_store=session_store,
+        session_store_filename_pattern=session_store_filename_pattern)
+    # the metadata is removed now and saved last, so an interrupted run never
+    # leaves a store that looks up to date
+    metadata_filename = store_filename_pattern.format("metadata")
+    if os.path.exists(metadata_filename):
+        os.remove(metadata_filename)
+    if session_store:
+        # spikes times stay in session time; the store is aligned to an
+        # event when it is loaded
+        epoch_times = np.zeros(n_trials)
+    else:
+        epoch_times = trials_info[epoch_event_name].to_numpy()
+    epoch_start_times = trials_info[epoch_start_event_name]
+    epoch_end_times = trials_info[epoch_end_event_name]
+    n_trials = len(epoch_times)
+    trials_ids = np.arange(n_trials)
+
+    epoched_spikes_times, epoched_offsets = \
+        socialMiceUtils.epoch_units_spikes_times(
+            units_spikes_times=units_spikes_times,
+            units_offsets=units_offsets,
+            epoch_times=epoch_times,
+            epoch_start_times=epoch_start_times,
+            epoch_end_times=epoch_end_times)
+
+    trials_start_times = [epoch_start_times[r]-epoch_times[r]
+                          for r in range(n_trials)]
+    trials_end_times = [epoch_end_times[r]-epoch_times[r]
+                        for r in range(n_trials)]
+
+    results_filenames = epochedSpikesStore.save(
+        filename_pattern=store_filename_pattern,
+        epoched_spikes_times=epoched_spikes_times,
+        epoched_offsets=epoched_offsets,
+        units_ids=units_ids,
+        trials_ids=trials_ids,
+        trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times,
+        trials_info=trials_info,
+        epoch_times=epoch_times)
+    print(f"Saved {results_filenames}")
+
+    epoch_config = configparser.ConfigParser()
+    epoch_config["params"] = get_epoch_params(
+        subject_name=subject_name, region=region,
+        epoch_event_name=epoch_event_name,
+        epoch_start_event_name=epoch_start_event_name,
+        epoch_end_event_name=epoch_end_event_name, data_dirname=data_dirname,
+        trials_info_filename=trials_info_filename,
+        session_store=session_store)
+    if session_store:
+        epoch_config["params"]["results_filename_pattern"] = \
+            session_store_filename_pattern
+    else:
+        epoch_config["params"]["results_filename_pattern"] = \
+            results_filename_pattern
+    epoch_config["params"]["units_ids"] = str(units_ids)
+    epoch_config["params"]["trials_ids"] = str(trials_ids)
+    epoch_config["inputs"] = inputs_signature
+    with open(metadata_filename, "w") as f:
+        epoch_config.write(f)
+    print(f"Saved {metadata_filename}")
+    return results_filenames + [metadata_filename]
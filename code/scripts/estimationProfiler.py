@@ -0,0 +1,160 @@
+import sys
+import os
+import json
+import time
+import resource
+import cProfile
+import contextlib
+import pandas as pd
+import torch
+
+profile_modes = ["none", "cprofile", "torch"]
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of this process, in megabytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS, kilobytes on Linux
+        peak_rss = peak_rss / 1024
+    return peak_rss / 1024
+
+
+class EstimationProfiler:
+    """Records the wall time, lower bound, peak resident set size and number
+    of PyTorch threads of every EM step and iteration of an estimation.
+
+    :meth:`step_callback` should be passed as a step callback and the
+    instance itself as an iteration callback to
+    :meth:`socialMiceSVEM.SVEM_PyTorch.maximize`. The trace is written, after
+    every iteration, to ``profile_filename_pattern`` (with one ``{:s}``
+    placeholder for the extension) as a CSV file with one row per EM step
+    and a JSON file with the steps, the iterations and the total time per
+    step type.
+
+    If ``resume`` is True the records of a previous trace, up to the last
+    completed iteration, are kept.
+    """
+
+    def __init__(self, profile_filename_pattern, resume=False,
+                 resume_iteration=None):
+        self._csv_filename = profile_filename_pattern.format("csv")
+        self._json_filename = profile_filename_pattern.format("json")
+        self._steps = []
+        self._iterations = []
+        if resume and os.path.exists(self._json_filename):
+            with open(self._json_filename, "r") as f:
+                trace = json.load(f)
+            self._steps = trace["steps"]
+            self._iterations = trace["iterations"]
+            if resume_iteration is not None:
+                self._steps = [step for step in self._steps
+                               if step["iteration"] <= resume_iteration]
+                self._iterations = [iteration for iteration in
+                                    self._iterations
+                                    if iteration["iteration"] <=
+                                    resume_iteration]
+        self._iteration_steps_time = 0.0
+
+    def step_callback(self, iteration, step, elapsed_time, maxRes,
+                      minibatch=None):
+        self._steps.append({"iteration": iteration,
+                            "minibatch": minibatch,
+                            "step": step,
+                            "elapsed_time": elapsed_time,
+                            "lower_bound": maxRes["lowerBound"].item(),
+                            "niter": int(maxRes["niter"]),
+                            "nfeval": int(maxRes["nfeval"]),
+                            "peak_rss_mb": get_peak_rss_mb(),
+                            "n_threads": torch.get_num_threads(),
+                            "timestamp": time.time()})
+        self._iteration_steps_time += elapsed_time
+
+    def __call__(self, iteration, model, lowerBoundHist, elapsedTimeHist,
+                 iterationsModelParams):
+        elapsed_time = elapsedTimeHist[-1] - elapsedTimeHist[-2]
+        self._iterations.append({
+            "iteration": iteration,
+            "elapsed_time": elapsed_time,
+            # time of the iteration not spent in the EM steps (e.g., in
+            # setting minibatches or in other callbacks)
+            "overhead_time": elapsed_time - self._iteration_steps_time,
+            "lower_bound": lowerBoundHist[-1],
+            "peak_rss_mb": get_peak_rss_mb(),
+            "n_threads": torch.get_num_threads()})
+        self._iteration_steps_time = 0.0
+        self.save()
+        return None
+
+    def get_steps_summary(self):
+        """Returns the number of calls and the total and mean wall time of
+        every step type."""
+        summary = {}
+        for step in self._steps:
+            step_summary = summary.setdefault(step["step"],
+                                              {"n_calls": 0,
+                                               "total_time": 0.0})
+            step_summary["n_calls"] += 1
+            step_summary["total_time"] += step["elapsed_time"]
+        for step_summary in summary.values():
+            step_summary["mean_time"] = \
+                step_summary["total_time"] / step_summary["n_calls"]
+        return summary
+
+    def save(self):
+        pd.DataFrame(self._steps).to_csv(self._csv_filename, index=False)
+        trace = {"torch_version": torch.__version__,
+                 "n_threads": torch.get_num_threads(),
+                 "peak_rss_mb": get_peak_rss_mb(),
+                 "steps_summary": self.get_steps_summary(),
+                 "iterations": self._iterations,
+                 "steps": self._steps}
+        with open(f"{self._json_filename}.tmp", "w") as f:
+            json.dump(trace, f, indent=1)
+        os.replace(f"{self._json_filename}.tmp", self._json_filename)
+
+    def print_summary(self, out=sys.stdout):
+        for step, step_summary in self.get_steps_summary().items():
+            out.write("{:s}: {:d} calls, total time {:f}, mean time {:f}\n"
+                      .format(step, step_summary["n_calls"],
+                              step_summary["total_time"],
+                              step_summary["mean_time"]))
+        out.write(f"Peak RSS {get_peak_rss_mb():.1f} MB\n")
+
+
+@contextlib.contextmanager
+def profiling(profile_mode, profile_filename_pattern):
+    """Context manager that profiles the code it encloses with cProfile
+    (``profile_mode="cprofile"``, statistics saved to the ``prof``
+    extension of ``profile_filename_pattern``) or with torch.profiler
+    (``profile_mode="torch"``, Chrome trace saved to the
+    ``torch_trace.json`` extension). Does nothing if ``profile_mode`` is
+    ``"none"``.
+
+    The PyTorch profiler keeps every recorded event in memory, so it is
+    only suited for short estimations.
+    """
+    if profile_mode == "none":
+        yield
+    elif profile_mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profile_filename = profile_filename_pattern.format("prof")
+            profiler.dump_stats(profile_filename)
+            print(f"Saved cProfile statistics to {profile_filename}")
+    elif profile_mode == "torch":
+        with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU]) as profiler:
+            yield
+        profile_filename = profile_filename_pattern.format("torch_trace.json")
+        profiler.export_chrome_trace(profile_filename)
+        print(profiler.key_averages().table(sort_by="self_cpu_time_total",
+                                            row_limit=20))
+        print(f"Saved PyTorch profiler trace to {profile_filename}")
+    else:
+        raise ValueError("Invalid profile_mode={:s}. Supported values are "
+                         "{:s}".format(profile_mode, ", ".join(profile_modes)))
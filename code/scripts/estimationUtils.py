@@ -0,0 +1,339 @@
+import os.path
+import random
+import pickle
+import configparser
+import numpy as np
+
+import gcnu_common.utils.config_dict
+import svGPFA.stats.svGPFAModelFactory
+import svGPFA.utils.miscUtils
+import svGPFA.utils.initUtils
+
+import durationBuckets
+import epochedSpikesStore
+import reducedPrecision
+import socialMiceSVEM
+
+
+def load_selected_trials(epoched_spikes_times_filename, trials_ids_filename,
+                         align_event_name=None):
+    """Opens the epoched spikes store ``epoched_spikes_times_filename`` and
+    finds the trials listed in ``trials_ids_filename``, without reading their
+    spikes times. If ``align_event_name`` is given the store (e.g., a session
+    store) is aligned to this event of the trials information.
+
+    Returns ``(epoched_spikes, trials_indices, trials_start_times,
+    trials_end_times, trials_info)``, where ``trials_indices`` are the
+    indices of the selected trials in the store.
+    """
+    epoched_spikes = epochedSpikesStore.load(
+        filename_pattern=epoched_spikes_times_filename,
+        align_event_name=align_event_name)
+    selected_trials_ids = np.genfromtxt(trials_ids_filename, dtype=np.uint64)
+    trials_indices = np.nonzero(np.isin(epoched_spikes["trials_ids"],
+                                        selected_trials_ids))[0]
+    trials_start_times = \
+        epoched_spikes["trials_start_times"][trials_indices].tolist()
+    trials_end_times = \
+        epoched_spikes["trials_end_times"][trials_indices].tolist()
+    trials_info = epoched_spikes["trials_info"]
+    return epoched_spikes, trials_indices, trials_start_times, \
+        trials_end_times, trials_info
+
+
+def load_selected_spikes_times(epoched_spikes_times_filename,
+                               trials_ids_filename, align_event_name=None):
+    """Loads the spikes times of the trials listed in ``trials_ids_filename``
+    from the epoched spikes store ``epoched_spikes_times_filename``, aligned
+    to ``align_event_name`` if given.
+
+    Returns ``(spikes_times, trials_start_times, trials_end_times,
+    trials_info)``.
+    """
+    epoched_spikes, trials_indices, trials_start_times, trials_end_times, \
+        trials_info = load_selected_trials(
+            epoched_spikes_times_filename=epoched_spikes_times_filename,
+            trials_ids_filename=trials_ids_filename,
+            align_event_name=align_event_name)
+    spikes_times = epochedSpikesStore.get_spikes_times(
+        epoched_spikes=epoched_spikes, trials_indices=trials_indices)
+    return spikes_times, trials_start_times, trials_end_times, trials_info
+
+
+def get_params_and_kernels_types(est_init_config, args, n_latents, n_neurons,
+                                 n_trials, trials_start_times,
+                                 trials_end_times):
+    """Builds initial, quadrature and optimization parameters from the
+    command line arguments ``args`` (a dictionary) and the estimation
+    initialization configuration ``est_init_config``."""
+    #    build dynamic parameter specifications
+    args_info = svGPFA.utils.initUtils.getArgsInfo()
+    dynamic_params_spec = svGPFA.utils.initUtils.getParamsDictFromArgs(
+        n_latents=n_latents, n_trials=n_trials, args=args,
+        args_info=args_info)
+    #   build config file parameters specification
+    strings_dict = gcnu_common.utils.config_dict.GetDict(
+        config=est_init_config).get_dict()
+    config_file_params_spec = \
+        svGPFA.utils.initUtils.getParamsDictFromStringsDict(
+            n_latents=n_latents, n_trials=n_trials,
+            strings_dict=strings_dict, args_info=args_info)
+    #    finally, get the parameters from the dynamic and configuration file
+    #    parameter specifications
+    params, kernels_types, = \
+        svGPFA.utils.initUtils.getParamsAndKernelsTypes(
+            n_trials=n_trials, n_neurons=n_neurons, n_latents=n_latents,
+            trials_start_times=trials_start_times,
+            trials_end_times=trials_end_times,
+            dynamic_params_spec=dynamic_params_spec,
+            config_file_params_spec=config_file_params_spec)
+    return params, kernels_types
+
+
+def create_model(kernels_types, params, duration_buckets=None,
+                 reduced_precision=False):
+    """Creates a point-process svGPFA model with exponential link, without
+    setting its parameters and data. If ``duration_buckets`` is given (see
+    :func:`durationBuckets.get_duration_buckets`) kernel matrices are
+    computed once per duration bucket. If ``reduced_precision`` is true the
+    expected log-likelihood is evaluated in single precision (see
+    :func:`reducedPrecision.create_model`)."""
+    kernels_params0 = params["initial_params"]["posterior_on_latents"][
+        "kernels_matrices_store"]["kernels_params0"]
+    kernels = svGPFA.utils.miscUtils.buildKernels(
+        kernels_types=kernels_types, kernels_params=kernels_params0)
+    if duration_buckets is not None:
+        if reduced_precision:
+            raise ValueError("Duration buckets cannot be used in reduced "
+                             "precision")
+        model = durationBuckets.create_model(
+            kernels=kernels, duration_buckets=duration_buckets)
+        return model
+    if reduced_precision:
+        model = reducedPrecision.create_model(kernels=kernels)
+        return model
+
+    kernelMatrixInvMethod = svGPFA.stats.svGPFAModelFactory.kernelMatrixInvChol
+    indPointsCovRep = svGPFA.stats.svGPFAModelFactory.indPointsCovChol
+    model = svGPFA.stats.svGPFAModelFactory.SVGPFAModelFactory.buildModelPyTorch(
+        conditionalDist=svGPFA.stats.svGPFAModelFactory.PointProcess,
+        linkFunction=svGPFA.stats.svGPFAModelFactory.ExponentialLink,
+        embeddingType=svGPFA.stats.svGPFAModelFactory.LinearEmbedding,
+        kernels=kernels, kernelMatrixInvMethod=kernelMatrixInvMethod,
+        indPointsCovRep=indPointsCovRep)
+    return model
+
+
+def build_model(kernels_types, params, spikes_times, duration_buckets=None,
+                reduced_precision=False):
+    """Builds a point-process svGPFA model with exponential link and sets
+    its initial parameters and data (see :func:`create_model` for
+    ``duration_buckets`` and ``reduced_precision``)."""
+    model = create_model(kernels_types=kernels_types, params=params,
+                         duration_buckets=duration_buckets,
+                         reduced_precision=reduced_precision)
+    model.setParamsAndData(
+        measurements=spikes_times,
+        initial_params=params["initial_params"],
+        eLLCalculationParams=params["ell_calculation_params"],
+        priorCovRegParam=params["optim_params"]["prior_cov_reg_param"])
+    return model
+
+
+def get_estim_res_number(estim_res_metadata_filename_pattern):
+    """Returns a random estimation result number not used by any existing
+    estimation result metadata file."""
+    estPrefixUsed = True
+    while estPrefixUsed:
+        estResNumber = random.randint(0, 10**8)
+        estim_res_metadata_filename = \
+            estim_res_metadata_filename_pattern.format(estResNumber)
+        if not os.path.exists(estim_res_metadata_filename):
+            estPrefixUsed = False
+    return estResNumber
+
+
+def save_estim_res_metadata(estim_res_metadata_filename, params,
+                            est_init_number, n_threads, neurons_indices,
+                            n_latents, common_n_ind_points,
+                            epoched_spikes_times_filename,
+                            minibatch_params=None, warm_start_from=None,
+                            duration_buckets_params=None,
+                            ind_points_allocation_params=None,
+                            performance_params=None, cache_key=None,
+                            trials_ids_filename=None):
+    estim_res_config = configparser.ConfigParser()
+    estim_res_config["data_params"] = {
+        "n_threads": n_threads,
+        "neurons_indices": neurons_indices,
+        "nLatents": n_latents,
+        "common_n_ind_points": common_n_ind_points,
+        # "max_trial_duration": max_trial_duration,
+        "epoched_spikes_times_filename": epoched_spikes_times_filename,
+    }
+    if trials_ids_filename is not None:
+        estim_res_config["data_params"]["trials_ids_filename"] = \
+            trials_ids_filename
+    estim_res_config["optim_params"] = params["optim_params"]
+    estim_res_config["estimation_params"] = {"est_init_number":
+                                             est_init_number}
+    if warm_start_from is not None:
+        estim_res_config["estimation_params"]["warm_start_from"] = \
+            warm_start_from
+    if cache_key is not None:
+        estim_res_config["estimation_params"]["cache_key"] = cache_key
+    if minibatch_params is not None:
+        estim_res_config["minibatch_params"] = {
+            key: str(value) for key, value in minibatch_params.items()}
+    if duration_buckets_params is not None:
+        estim_res_config["duration_buckets_params"] = {
+            key: str(value) for key, value in duration_buckets_params.items()}
+    if ind_points_allocation_params is not None:
+        estim_res_config["ind_points_allocation_params"] = {
+            key: str(value) for key, value in
+            ind_points_allocation_params.items()}
+    if performance_params is not None:
+        estim_res_config["performance_params"] = {
+            key: str(value) for key, value in performance_params.items()}
+    with open(estim_res_metadata_filename, "w") as f:
+        estim_res_config.write(f)
+    print(f"Saved {estim_res_metadata_filename}")
+
+
+def save_termination_metadata(estim_res_metadata_filename, terminationInfo,
+                              lowerBoundHist, elapsedTimeHist,
+                              convergence_params=None):
+    """Adds to the estimation result metadata file
+    ``estim_res_metadata_filename`` how the maximization terminated (the
+    stopping criterion of a
+    :class:`socialMiceSVEM.ConvergenceTerminationInfo`, ``em_max_iter`` if
+    the maximum number of iterations was reached, or ``error``) and the
+    settings of its :class:`socialMiceSVEM.ConvergenceMonitor`
+    (``convergence_params``)."""
+    estim_res_config = configparser.ConfigParser()
+    estim_res_config.read(estim_res_metadata_filename)
+    if hasattr(terminationInfo, "criterion"):
+        criterion = terminationInfo.criterion
+    elif hasattr(terminationInfo, "error"):
+        criterion = "error"
+    else:
+        criterion = "em_max_iter"
+    estim_res_config["termination_params"] = {
+        "criterion": criterion,
+        # configparser interpolates % signs
+        "message": terminationInfo.message.replace("%", "%%"),
+        "n_iterations": len(lowerBoundHist) - 1,
+        "lower_bound": lowerBoundHist[-1],
+        "elapsed_time": elapsedTimeHist[-1],
+    }
+    if convergence_params is not None:
+        estim_res_config["convergence_params"] = {
+            key: str(value) for key, value in convergence_params.items()}
+    with open(estim_res_metadata_filename, "w") as f:
+        estim_res_config.write(f)
+    print(f"Saved termination to {estim_res_metadata_filename}")
+
+
+def get_kernels_params(model):
+    params = model.getKernelsParams()
+    return params
+
+
+def maximize(model, params, printIterationModelParams=True,
+             iteration_callbacks=None, step_callbacks=None,
+             resume_state=None):
+    """Maximizes the lower bound of ``model``.
+
+    ``iteration_callbacks``, ``step_callbacks`` and ``resume_state`` are
+    passed to
+    :meth:`socialMiceSVEM.SVEM_PyTorch.maximize`.
+
+    Returns ``(lowerBoundHist, elapsedTimeHist, terminationInfo,
+    iterationsModelParams)``.
+    """
+    svEM = socialMiceSVEM.SVEM_PyTorch()
+    lowerBoundHist, elapsedTimeHist, terminationInfo, iterationsModelParams = \
+        svEM.maximize(model=model, optim_params=params["optim_params"],
+                      method=params["optim_params"]["optim_method"],
+                      getIterationModelParamsFn=get_kernels_params,
+                      printIterationModelParams=printIterationModelParams,
+                      iteration_callbacks=iteration_callbacks,
+                      step_callbacks=step_callbacks,
+                      resume_state=resume_state)
+    return lowerBoundHist, elapsedTimeHist, terminationInfo, \
+        iterationsModelParams
+
+
+def maximize_in_minibatches(model, params, epoched_spikes, trials_indices,
+                            batch_size, schedule="shuffled",
+                            n_iter_per_batch=1, random_seed=None,
+                            printIterationModelParams=True,
+                            iteration_callbacks=None, step_callbacks=None,
+                            resume_state=None, trials_n_ind_points=None):
+    """Maximizes the lower bound over minibatches of the trials at
+    ``trials_indices`` of the epoched spikes store ``epoched_spikes``,
+    reading the spikes times of each minibatch from the store when the
+    minibatch is processed. ``params`` holds the estimated parameters on
+    return.
+
+    See :class:`socialMiceSVEM.MinibatchSVEM_PyTorch` for the remaining
+    arguments.
+
+    Returns ``(lowerBoundHist, elapsedTimeHist, terminationInfo,
+    iterationsModelParams)``.
+    """
+    store_trials_indices = np.asarray(trials_indices)
+
+    def get_measurements(trials_indices):
+        measurements = epochedSpikesStore.get_spikes_times(
+            epoched_spikes=epoched_spikes,
+            trials_indices=store_trials_indices[trials_indices])
+        return measurements
+
+    svEM = socialMiceSVEM.MinibatchSVEM_PyTorch()
+    lowerBoundHist, elapsedTimeHist, terminationInfo, iterationsModelParams = \
+        svEM.maximize(model=model, params=params,
+                      get_measurements_fn=get_measurements,
+                      batch_size=batch_size, schedule=schedule,
+                      n_iter_per_batch=n_iter_per_batch,
+                      random_seed=random_seed,
+                      method=params["optim_params"]["optim_method"],
+                      getIterationModelParamsFn=get_kernels_params,
+                      printIterationModelParams=printIterationModelParams,
+                      iteration_callbacks=iteration_callbacks,
+                      step_callbacks=step_callbacks,
+                      resume_state=resume_state,
+                      trials_n_ind_points=trials_n_ind_points)
+    return lowerBoundHist, elapsedTimeHist, terminationInfo, \
+        iterationsModelParams
+
+
+def save_estimation_results(model_save_filename, model, lowerBoundHist,
+                            elapsedTimeHist, terminationInfo,
+                            iterationsModelParams, spikes_times,
+                            trials_start_times, trials_end_times,
+                            trials_info, estimated_params=None,
+                            kernels_types=None, trials_ids=None,
+                            units_ids=None):
+    resultsToSave = {
+                     "trials_start_times": trials_start_times,
+                     "trials_end_times": trials_end_times,
+                     "lowerBoundHist": lowerBoundHist,
+                     "elapsedTimeHist": elapsedTimeHist,
+                     "terminationInfo": terminationInfo,
+                     "iterationModelParams": iterationsModelParams,
+                     "spikes_times": spikes_times,
+                     "trials_info": trials_info,
+                     "model": model,
+                     "trials_ids": trials_ids,
+                     "units_ids": units_ids,
+                    }
+    if estimated_params is not None:
+        # minibatch estimations do not keep a model of all trials; it can be
+        # rebuilt with build_model(kernels_types, estimated_params,
+        # spikes_times)
+        resultsToSave["estimated_params"] = estimated_params
+        resultsToSave["kernels_types"] = kernels_types
+    with open(model_save_filename, "wb") as f:
+        pickle.dump(resultsToSave, f)
+        print("Saved results to {:s}".format(model_save_filename))
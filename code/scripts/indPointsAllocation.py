@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+
+import svGPFA.utils.miscUtils
+
+# distance, in seconds, between the end of a trial and its first padding
+# inducing point, and between consecutive padding inducing points
+pad_spacing = 1e4
+
+
+def get_trials_n_ind_points(trials_start_times, trials_end_times,
+                            ind_points_per_sec, min_n_ind_points,
+                            max_n_ind_points, trials_n_spikes=None,
+                            ind_points_per_spike=0.0, n_ind_points_step=1):
+    """Returns the number of inducing points of every trial,
+    ``ind_points_per_sec`` times its duration plus ``ind_points_per_spike``
+    times its number of spikes (``trials_n_spikes``), rounded up to a
+    multiple of ``n_ind_points_step`` (to limit the number of distinct
+    allocations) and clipped to ``[min_n_ind_points, max_n_ind_points]``.
+    """
+    durations = np.asarray(trials_end_times, dtype=np.float64) - \
+        np.asarray(trials_start_times, dtype=np.float64)
+    n_ind_points = ind_points_per_sec * durations
+    if trials_n_spikes is not None:
+        n_ind_points = n_ind_points + \
+            ind_points_per_spike * np.asarray(trials_n_spikes)
+    n_ind_points = np.ceil(n_ind_points / n_ind_points_step) * \
+        n_ind_points_step
+    trials_n_ind_points = np.clip(n_ind_points, min_n_ind_points,
+                                  max_n_ind_points).astype(np.int64)
+    return trials_n_ind_points
+
+
+def get_trials_n_spikes(epoched_spikes, trials_indices):
+    """Returns the number of spikes of all units in every trial at
+    ``trials_indices`` of the epoched spikes store ``epoched_spikes``,
+    without reading their spikes times."""
+    n_units = epoched_spikes["n_units"]
+    epoched_offsets = np.asarray(epoched_spikes["epoched_offsets"])
+    trials_indices = np.asarray(trials_indices)
+    trials_n_spikes = epoched_offsets[(trials_indices + 1) * n_units] - \
+        epoched_offsets[trials_indices * n_units]
+    return trials_n_spikes
+
+
+def allocate_params(params, kernels_types, trials_n_ind_points,
+                    trials_start_times, trials_end_times):
+    """Sets, in place, the inducing points of the initial parameters in
+    ``params`` (see :func:`estimationUtils.get_params_and_kernels_types`),
+    built with ``max(trials_n_ind_points)`` inducing points, to
+    ``trials_n_ind_points[r]`` equidistant inducing points for trial ``r``.
+
+    svGPFA stores the inducing points of all trials of a latent in one
+    tensor, so the remaining slots of a trial are filled with inert padding
+    inducing points: far after the end of the trial, uncorrelated with its
+    times and with each other, and with a variational posterior equal to
+    their prior. They leave the model of the trial unchanged, and are never
+    estimated when every minibatch only holds the leading inducing points
+    of its trials (see
+    :func:`socialMiceSVEM.subset_trials_params`). Only
+    exponentialQuadratic kernels decorrelate far apart points.
+    """
+    if any(kernel_type != "exponentialQuadratic"
+           for kernel_type in kernels_types):
+        raise ValueError("Inducing points can only be allocated per trial "
+                         "with exponentialQuadratic kernels")
+    initial_params = params["initial_params"]
+    kms_params = initial_params["posterior_on_latents"][
+        "kernels_matrices_store"]
+    variational_params = initial_params["posterior_on_latents"][
+        "posterior_on_ind_points"]
+    prior_cov_reg_param = params["optim_params"]["prior_cov_reg_param"]
+    max_n_ind_points = int(max(trials_n_ind_points))
+    n_latents = len(kms_params["inducing_points_locs0"])
+
+    covs = svGPFA.utils.miscUtils.buildCovsFromCholVecs(
+        cholVecs=variational_params["cholVecs"])
+    for k in range(n_latents):
+        locs = kms_params["inducing_points_locs0"][k]
+        means = variational_params["mean"][k]
+        if locs.shape[1] != max_n_ind_points:
+            raise ValueError(f"Latent {k} has {locs.shape[1]} inducing "
+                             f"points, but up to {max_n_ind_points} are "
+                             f"allocated")
+        for r, n_ind_points in enumerate(trials_n_ind_points):
+            locs[r, :n_ind_points, 0] = torch.linspace(
+                trials_start_times[r], trials_end_times[r], n_ind_points,
+                dtype=locs.dtype)
+            if n_ind_points == max_n_ind_points:
+                continue
+            n_pad = max_n_ind_points - n_ind_points
+            locs[r, n_ind_points:, 0] = trials_end_times[r] + pad_spacing * \
+                torch.arange(1, n_pad + 1, dtype=locs.dtype)
+            means[r, n_ind_points:] = 0.0
+            # the prior covariance of uncorrelated padding inducing points
+            # is diagonal, with the kernel scale (one) plus the
+            # regularization of the kernel matrix
+            covs[k][r, n_ind_points:, :] = 0.0
+            covs[k][r, :, n_ind_points:] = 0.0
+            covs[k][r, n_ind_points:, n_ind_points:] = \
+                (1.0 + prior_cov_reg_param) * torch.eye(n_pad,
+                                                        dtype=covs[k].dtype)
+    variational_params["cholVecs"] = \
+        svGPFA.utils.miscUtils.getVectorRepOfLowerTrianMatrices(
+            lt_matrices=[svGPFA.utils.miscUtils.chol3D(covs[k])
+                         for k in range(n_latents)])
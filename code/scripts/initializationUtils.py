@@ -0,0 +1,245 @@
+import os
+import configparser
+import numpy as np
+import scipy.ndimage
+
+import binningUtils
+
+
+def smooth_rates(spikes_counts, bins_mask, bin_size, smoothing_sigma):
+    """Smooths the ``n_trials`` x ``n_units`` x ``n_bins`` ``spikes_counts``
+    returned by :func:`binningUtils.bin_spikes_counts` with a Gaussian kernel
+    of standard deviation ``smoothing_sigma`` seconds, ignoring the bins
+    masked out by ``bins_mask``, and returns them as spikes rates."""
+    sigma_bins = smoothing_sigma / bin_size
+    bins_mask = bins_mask.astype(np.float64)
+    smoothed_counts = scipy.ndimage.gaussian_filter1d(
+        spikes_counts * bins_mask[:, None, :], sigma=sigma_bins, axis=-1,
+        mode="constant")
+    smoothed_mask = scipy.ndimage.gaussian_filter1d(
+        bins_mask, sigma=sigma_bins, axis=-1, mode="constant")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        smoothed_rates = smoothed_counts / smoothed_mask[:, None, :] / \
+            bin_size
+    smoothed_rates = np.where(bins_mask[:, None, :] > 0, smoothed_rates, 0.0)
+    return smoothed_rates
+
+
+def fit_log_rates_pca(smoothed_rates, bins_mask, n_latents, rate_offset=0.1):
+    """Fits a PCA model to the log of the ``smoothed_rates`` (plus
+    ``rate_offset``) of the bins in ``bins_mask``, matching the exponential
+    link of the svGPFA model.
+
+    Returns ``(C, d, latents)``, where ``C`` is the ``n_units`` x
+    ``n_latents`` embedding, ``d`` the ``n_units`` x 1 offset and
+    ``latents`` the ``n_trials`` x ``n_bins`` x ``n_latents`` unit-variance
+    latents (zero in masked bins), such that ``log(rates) ~ latents @ C.T +
+    d.T``.
+    """
+    n_trials, n_units, n_bins = smoothed_rates.shape
+    # samples are the unmasked (trial, bin) pairs
+    log_rates = np.log(smoothed_rates + rate_offset).transpose(0, 2, 1)
+    samples = log_rates[bins_mask]
+    d = samples.mean(axis=0)
+    centered_samples = samples - d
+    n_samples = centered_samples.shape[0]
+    U, s, Vt = np.linalg.svd(centered_samples, full_matrices=False)
+    n_latents_fitted = min(n_latents, len(s))
+    C = np.zeros((n_units, n_latents))
+    C[:, :n_latents_fitted] = \
+        Vt[:n_latents_fitted].T * s[:n_latents_fitted] / np.sqrt(n_samples)
+    latents = np.zeros((n_trials, n_bins, n_latents))
+    latents[bins_mask, :n_latents_fitted] = \
+        U[:, :n_latents_fitted] * np.sqrt(n_samples)
+    return C, d[:, None], latents
+
+
+def estimate_lengthscales(latents, bins_mask, bin_size, smoothing_sigma,
+                          min_lengthscale=None):
+    """Estimates the lengthscale of an exponentiated quadratic kernel for
+    every latent returned by :func:`fit_log_rates_pca`, as the lag at which
+    its autocorrelation, over the unmasked bins of all trials, falls to
+    ``exp(-1/2)``.
+
+    Smoothing with a Gaussian of standard deviation ``smoothing_sigma``
+    adds ``2 * smoothing_sigma**2`` to the squared lengthscale of the
+    autocorrelation, which is removed from the estimates. Lengthscales are
+    at least ``min_lengthscale`` (``bin_size`` if None).
+    """
+    if min_lengthscale is None:
+        min_lengthscale = bin_size
+    n_bins, n_latents = latents.shape[1:]
+    bins_mask = bins_mask.astype(np.float64)
+    threshold = np.exp(-0.5)
+    lags = np.full(n_latents, np.nan)
+    previous_autocorr = np.ones(n_latents)
+    variance = (latents**2).sum(axis=(0, 1)) / bins_mask.sum()
+    for lag in range(1, n_bins):
+        pairs_mask = bins_mask[:, lag:] * bins_mask[:, :-lag]
+        n_pairs = pairs_mask.sum()
+        if n_pairs == 0:
+            break
+        autocorr = (latents[:, lag:] * latents[:, :-lag] *
+                    pairs_mask[:, :, None]).sum(axis=(0, 1)) / n_pairs / \
+            variance
+        # linear interpolation of the lag of the threshold crossing
+        crossed = np.isnan(lags) & (autocorr < threshold)
+        lags[crossed] = lag - 1 + (previous_autocorr[crossed] - threshold) / \
+            (previous_autocorr[crossed] - autocorr[crossed])
+        if not np.isnan(lags).any():
+            break
+        previous_autocorr = autocorr
+    # latents that never decorrelate get the longest measurable lengthscale
+    lags[np.isnan(lags)] = n_bins - 1
+    observed_lengthscales = lags * bin_size
+    lengthscales = np.sqrt(np.maximum(
+        observed_lengthscales**2 - 2 * smoothing_sigma**2,
+        min_lengthscale**2))
+    return lengthscales
+
+
+def get_latents_at_ind_points(latents, bins_mask, bins_edges, bin_size,
+                              trials_start_times, trials_end_times,
+                              n_ind_points):
+    """Linearly interpolates the binned ``latents`` at ``n_ind_points``
+    equidistant inducing points between the start and end of every trial
+    (the svGPFA ``equidistant`` layout).
+
+    Returns an ``n_trials`` x ``n_ind_points`` x ``n_latents`` array.
+    """
+    trials_start_times = np.asarray(trials_start_times)
+    trials_end_times = np.asarray(trials_end_times)
+    n_trials = latents.shape[0]
+    ind_points_locs = np.linspace(trials_start_times, trials_end_times,
+                                  n_ind_points, axis=1)
+    # fractional index, relative to the bins centers, of every inducing point
+    positions = (ind_points_locs - bins_edges[:, :1]) / bin_size - 0.5
+    last_bins = np.maximum(bins_mask.sum(axis=1) - 1, 0)[:, None]
+    positions = np.clip(positions, 0, last_bins)
+    left_bins = np.minimum(np.floor(positions).astype(np.int64), last_bins)
+    right_bins = np.minimum(left_bins + 1, last_bins)
+    weights = (positions - left_bins)[:, :, None]
+    trials = np.arange(n_trials)[:, None]
+    latents_at_ind_points = (1 - weights) * latents[trials, left_bins] + \
+        weights * latents[trials, right_bins]
+    return latents_at_ind_points
+
+
+def initialize_from_data(epoched_spikes, trials_indices, n_latents,
+                         n_ind_points, bin_size, smoothing_sigma,
+                         rate_offset=0.1):
+    """Derives initial svGPFA parameters from the spikes of the trials at
+    ``trials_indices`` of ``epoched_spikes`` (see
+    :func:`epochedSpikesStore.load`): bins and smooths their spikes counts,
+    fits a PCA model to the log rates (:func:`fit_log_rates_pca`) and
+    estimates the kernels lengthscales from the autocorrelation of its
+    latents.
+
+    Returns a dictionary with keys ``C0``, ``d0``, ``lengthscales0`` and
+    ``variational_means0`` (the latents at the equidistant inducing points,
+    an ``n_trials`` x ``n_ind_points`` x ``n_latents`` array).
+    """
+    spikes_counts, bins_edges, bins_mask = binningUtils.bin_spikes_counts(
+        epoched_spikes=epoched_spikes, bin_size=bin_size,
+        trials_indices=trials_indices)
+    smoothed_rates = smooth_rates(spikes_counts=spikes_counts,
+                                  bins_mask=bins_mask, bin_size=bin_size,
+                                  smoothing_sigma=smoothing_sigma)
+    C0, d0, latents = fit_log_rates_pca(smoothed_rates=smoothed_rates,
+                                        bins_mask=bins_mask,
+                                        n_latents=n_latents,
+                                        rate_offset=rate_offset)
+    lengthscales0 = estimate_lengthscales(latents=latents,
+                                          bins_mask=bins_mask,
+                                          bin_size=bin_size,
+                                          smoothing_sigma=smoothing_sigma)
+    trials_start_times = epoched_spikes["trials_start_times"][trials_indices]
+    trials_end_times = epoched_spikes["trials_end_times"][trials_indices]
+    variational_means0 = get_latents_at_ind_points(
+        latents=latents, bins_mask=bins_mask, bins_edges=bins_edges,
+        bin_size=bin_size, trials_start_times=trials_start_times,
+        trials_end_times=trials_end_times, n_ind_points=n_ind_points)
+    init_params = {"C0": C0, "d0": d0, "lengthscales0": lengthscales0,
+                   "variational_means0": variational_means0}
+    return init_params
+
+
+def save_init_config(init_config_filename, params_dirname, init_params,
+                     base_config, n_ind_points):
+    """Saves an estimation initialization configuration, readable by
+    ``doEstimateSVGPFA.py``, with the data-driven ``init_params`` returned by
+    :func:`initialize_from_data`.
+
+    The remaining sections (data and optimization parameters, variational
+    covariances) are copied from ``base_config``. The embedding and
+    variational means are saved to CSV files in ``params_dirname``. Returns
+    the list of saved filenames.
+    """
+    os.makedirs(params_dirname, exist_ok=True)
+    C0 = init_params["C0"]
+    d0 = init_params["d0"]
+    lengthscales0 = init_params["lengthscales0"]
+    variational_means0 = init_params["variational_means0"]
+    n_trials, _, n_latents = variational_means0.shape
+
+    init_config = configparser.ConfigParser()
+    init_config.read_dict(base_config)
+    c0_filename = os.path.join(params_dirname, "c0.csv")
+    d0_filename = os.path.join(params_dirname, "d0.csv")
+    np.savetxt(c0_filename, C0, delimiter=",")
+    np.savetxt(d0_filename, d0, delimiter=",")
+    saved_filenames = [c0_filename, d0_filename]
+    init_config["embedding_params0"] = {"c0_filename": c0_filename,
+                                       "d0_filename": d0_filename}
+
+    init_config["kernels_params0"] = {}
+    for k in range(n_latents):
+        init_config["kernels_params0"][f"k_type_latent{k}"] = \
+            "exponentialQuadratic"
+        init_config["kernels_params0"][f"k_lengthscale0_latent{k}"] = \
+            str(lengthscales0[k])
+
+    init_config["ind_points_locs_params0"] = {
+        "common_n_ind_points": str(n_ind_points),
+        "ind_points_locs0_layout": "equidistant"}
+
+    # svGPFA reads constant or common variational means before per latent and
+    # trial ones, so only the variational covariances are kept
+    variational_params0 = {
+        key: value
+        for key, value in init_config["variational_params0"].items()
+        if key.startswith("variational_cov")} \
+        if "variational_params0" in init_config else {}
+    for k in range(n_latents):
+        for r in range(n_trials):
+            mean0_filename = os.path.join(
+                params_dirname,
+                f"variational_mean0_latent{k:03d}_trial{r:03d}.csv")
+            np.savetxt(mean0_filename, variational_means0[r, :, k],
+                       delimiter=",")
+            variational_params0[
+                f"variational_mean0_filename_latent{k}_trial{r}"] = \
+                mean0_filename
+            saved_filenames.append(mean0_filename)
+    init_config["variational_params0"] = variational_params0
+
+    with open(init_config_filename, "w") as f:
+        init_config.write(f)
+    return [init_config_filename] + saved_filenames
+
+
+def get_iterations_to_convergence(lowerBoundHist, target_lower_bound,
+                                  rel_tol=1e-3):
+    """Returns the number of EM iterations after which ``lowerBoundHist``
+    first comes within ``rel_tol`` (relative to its magnitude) of
+    ``target_lower_bound``, or NaN if it never does. Estimations from
+    different initializations are compared with a common target, e.g., the
+    largest of their final lower bounds."""
+    lowerBoundHist = np.asarray(lowerBoundHist, dtype=np.float64)
+    # lowerBoundHist[i] is the lower bound after i iterations
+    tolerance = rel_tol * abs(target_lower_bound)
+    converged = np.nonzero(lowerBoundHist >=
+                           target_lower_bound - tolerance)[0]
+    if len(converged) == 0:
+        return np.nan
+    return int(converged[0])
@@ -0,0 +1,213 @@
+import numpy as np
+import torch
+
+import svGPFA.utils.miscUtils
+
+import epochedSpikesStore
+import estimationUtils
+
+# names of the per-latent arrays of an exported model, filled with the latent
+# index
+latent_arrays_names = {
+    "kernels_params": "kernels_params_latent{:d}",
+    "ind_points_locs": "ind_points_locs_latent{:d}",
+    "variational_means": "variational_means_latent{:d}",
+    "variational_chol_vecs": "variational_chol_vecs_latent{:d}",
+}
+
+
+def get_estimated_params(model=None, initial_params=None):
+    """Returns the estimated parameters of ``model`` or, for minibatch
+    estimations, which do not keep a model of all trials, of the
+    ``initial_params`` of their estimated parameters (see
+    :func:`estimationUtils.get_params_and_kernels_types`).
+
+    Returns a dictionary with keys ``C``, ``d`` and, as lists over latents,
+    ``kernels_params``, ``ind_points_locs``, ``variational_means`` and
+    ``variational_chol_vecs``, all detached svGPFA tensors.
+    """
+    if model is not None:
+        C, d = model.getSVEmbeddingParams()
+        variational_params = model.getSVPosteriorOnIndPointsParams()
+        n_latents = len(variational_params) // 2
+        variational_means = variational_params[:n_latents]
+        variational_chol_vecs = variational_params[n_latents:]
+        kernels_params = model.getKernelsParams()
+        ind_points_locs = model.getIndPointsLocs()
+    else:
+        C = initial_params["embedding"]["C0"]
+        d = initial_params["embedding"]["d0"]
+        posterior_params = initial_params["posterior_on_latents"]
+        variational_means = \
+            posterior_params["posterior_on_ind_points"]["mean"]
+        variational_chol_vecs = \
+            posterior_params["posterior_on_ind_points"]["cholVecs"]
+        kernels_params = \
+            posterior_params["kernels_matrices_store"]["kernels_params0"]
+        ind_points_locs = posterior_params["kernels_matrices_store"][
+            "inducing_points_locs0"]
+
+    def detach(tensors):
+        return [tensor.detach().clone() for tensor in tensors]
+
+    estimated_params = {"C": C.detach().clone(),
+                        "d": d.detach().clone(),
+                        "kernels_params": detach(kernels_params),
+                        "ind_points_locs": detach(ind_points_locs),
+                        "variational_means": detach(variational_means),
+                        "variational_chol_vecs":
+                            detach(variational_chol_vecs)}
+    return estimated_params
+
+
+def export_model(export_filename, estimated_params, kernels_types,
+                 trials_ids, units_ids, trials_start_times, trials_end_times,
+                 prior_cov_reg_param, n_quad):
+    """Saves the ``estimated_params`` returned by
+    :func:`get_estimated_params`, with the kernels types, trials and units
+    of the estimation, as named arrays in the ``.npz`` file
+    ``export_filename``. Exported models are loaded with :func:`load`."""
+    arrays = {"C": estimated_params["C"].numpy(),
+              "d": estimated_params["d"].numpy(),
+              "kernels_types": np.asarray(kernels_types, dtype=str),
+              "trials_ids": np.asarray(trials_ids, dtype=np.int64),
+              "units_ids": np.asarray(units_ids, dtype=np.int64),
+              "trials_start_times": np.asarray(trials_start_times,
+                                               dtype=np.float64),
+              "trials_end_times": np.asarray(trials_end_times,
+                                             dtype=np.float64),
+              "prior_cov_reg_param": np.float64(prior_cov_reg_param),
+              "n_quad": np.int64(n_quad)}
+    for params_name, array_name_pattern in latent_arrays_names.items():
+        for k, tensor in enumerate(estimated_params[params_name]):
+            arrays[array_name_pattern.format(k)] = tensor.numpy()
+    np.savez(export_filename, **arrays)
+
+
+class ExportedModel:
+    """Model exported with :func:`export_model`.
+
+    ``params`` holds the exported arrays; the svGPFA model is only built,
+    without training data, the first time ``model`` is accessed. It
+    predicts latents and embeddings, but its lower bound is undefined until
+    measurements are set with ``model.setMeasurements``.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self._model = None
+
+    @property
+    def n_latents(self):
+        return len(self.params["kernels_types"])
+
+    def get_estimated_params(self):
+        """Returns the exported parameters as svGPFA tensors, as returned by
+        :func:`get_estimated_params`."""
+        estimated_params = {
+            "C": torch.from_numpy(self.params["C"]),
+            "d": torch.from_numpy(self.params["d"])}
+        for params_name, array_name_pattern in latent_arrays_names.items():
+            estimated_params[params_name] = [
+                torch.from_numpy(self.params[array_name_pattern.format(k)])
+                for k in range(self.n_latents)]
+        return estimated_params
+
+    @property
+    def model(self):
+        if self._model is None:
+            estimated_params = self.get_estimated_params()
+            initial_params = {
+                "posterior_on_latents": {
+                    "posterior_on_ind_points": {
+                        "mean": estimated_params["variational_means"],
+                        "cholVecs":
+                            estimated_params["variational_chol_vecs"]},
+                    "kernels_matrices_store": {
+                        "kernels_params0": estimated_params["kernels_params"],
+                        "inducing_points_locs0":
+                            estimated_params["ind_points_locs"]}},
+                "embedding": {"C0": estimated_params["C"],
+                              "d0": estimated_params["d"]}}
+            leg_quad_points, leg_quad_weights = \
+                svGPFA.utils.miscUtils.getLegQuadPointsAndWeights(
+                    n_quad=int(self.params["n_quad"]),
+                    trials_start_times=self.params["trials_start_times"],
+                    trials_end_times=self.params["trials_end_times"])
+            params = {"initial_params": initial_params,
+                      "ell_calculation_params": {
+                          "leg_quad_points": leg_quad_points,
+                          "leg_quad_weights": leg_quad_weights},
+                      "optim_params": {"prior_cov_reg_param":
+                                       float(self.params[
+                                           "prior_cov_reg_param"])}}
+            n_trials = len(self.params["trials_ids"])
+            n_units = len(self.params["units_ids"])
+            spikes_times = [[[] for n in range(n_units)]
+                            for r in range(n_trials)]
+            self._model = estimationUtils.build_model(
+                kernels_types=self.params["kernels_types"].tolist(),
+                params=params, spikes_times=spikes_times)
+        return self._model
+
+
+def load(export_filename):
+    """Loads a model exported with :func:`export_model`, without building
+    it (see :class:`ExportedModel`)."""
+    with np.load(export_filename) as arrays:
+        params = {name: arrays[name] for name in arrays.files}
+    exported_model = ExportedModel(params=params)
+    return exported_model
+
+
+def save_history(history_filename, lowerBoundHist, elapsedTimeHist,
+                 terminationInfo, iterationsModelParams=None):
+    """Saves the lower bound and elapsed time of every EM iteration, the
+    termination message and, if given, the kernels parameters of every
+    iteration (``iterationsModelParams``), as named arrays in the ``.npz``
+    file ``history_filename``."""
+    arrays = {"lower_bound_hist": np.asarray(lowerBoundHist,
+                                             dtype=np.float64),
+              "elapsed_time_hist": np.asarray(elapsedTimeHist,
+                                              dtype=np.float64),
+              "termination": np.asarray(terminationInfo.message, dtype=str)}
+    if iterationsModelParams is not None:
+        iterations = [i for i, iteration_params in
+                      enumerate(iterationsModelParams)
+                      if iteration_params is not None]
+        arrays["iterations"] = np.asarray(iterations, dtype=np.int64)
+        if len(iterations) > 0:
+            n_latents = len(iterationsModelParams[iterations[0]])
+            for k in range(n_latents):
+                arrays[f"iterations_kernels_params_latent{k}"] = np.stack(
+                    [iterationsModelParams[i][k].detach().numpy()
+                     for i in iterations])
+    np.savez(history_filename, **arrays)
+
+
+def save_training_data(filename_pattern, epoched_spikes, trials_indices):
+    """Saves, as an epoched spikes store (see :func:`epochedSpikesStore.save`)
+    with the alignment of ``epoched_spikes``, the spikes of the trials at
+    ``trials_indices`` used in an estimation. Returns the list of saved
+    filenames."""
+    training_spikes = epochedSpikesStore.subset(epoched_spikes=epoched_spikes,
+                                                trials_indices=trials_indices)
+    n_units = training_spikes["n_units"]
+    epoched_offsets = np.asarray(training_spikes["epoched_offsets"])
+    if n_units > 0:
+        trials_counts = np.diff(epoched_offsets[::n_units])
+    else:
+        trials_counts = np.zeros(training_spikes["n_trials"], dtype=np.int64)
+    epoched_spikes_times = training_spikes["epoched_spikes_times"] - \
+        np.repeat(training_spikes["spikes_shifts"], trials_counts)
+    saved_filenames = epochedSpikesStore.save(
+        filename_pattern=filename_pattern,
+        epoched_spikes_times=epoched_spikes_times,
+        epoched_offsets=epoched_offsets,
+        units_ids=training_spikes["units_ids"],
+        trials_ids=training_spikes["trials_ids"],
+        trials_start_times=training_spikes["trials_start_times"],
+        trials_end_times=training_spikes["trials_end_times"],
+        trials_info=training_spikes["trials_info"],
+        epoch_times=training_spikes["epoch_times"])
+    return saved_filenames
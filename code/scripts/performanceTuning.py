@@ -0,0 +1,82 @@
+import os
+import sys
+import io
+import copy
+import time
+import torch
+
+import socialMiceSVEM
+
+
+def get_n_threads_candidates(max_n_threads=None):
+    """Returns the powers of two smaller than ``max_n_threads`` (by default
+    the number of CPUs) and ``max_n_threads``."""
+    if max_n_threads is None:
+        max_n_threads = os.cpu_count()
+    n_threads_candidates = []
+    n_threads = 1
+    while n_threads < max_n_threads:
+        n_threads_candidates.append(n_threads)
+        n_threads *= 2
+    n_threads_candidates.append(max_n_threads)
+    return n_threads_candidates
+
+
+def get_calibration_optim_params(optim_params, n_iter):
+    """Returns a copy of ``optim_params`` for one EM iteration that runs
+    exactly ``n_iter`` iterations of every step, so that every calibration
+    run does the same work."""
+    calibration_optim_params = copy.deepcopy(optim_params)
+    calibration_optim_params["em_max_iter"] = 1
+    for key, value in calibration_optim_params.items():
+        if key.endswith("_optim_params"):
+            value["max_iter"] = n_iter
+            value["tolerance_grad"] = 0.0
+            value["tolerance_change"] = 0.0
+    return calibration_optim_params
+
+
+def time_maximization(model, optim_params):
+    """Returns the elapsed time of maximizing the lower bound of ``model``
+    with ``optim_params``."""
+    svEM = socialMiceSVEM.SVEM_PyTorch()
+    start_time = time.time()
+    svEM.maximize(model=model, optim_params=optim_params,
+                  method=optim_params["optim_method"], verbose=False,
+                  out=io.StringIO())
+    elapsed_time = time.time() - start_time
+    return elapsed_time
+
+
+def calibrate_n_threads(build_model_fn, optim_params, n_threads_candidates,
+                        n_iter=2, n_repeats=1, out=sys.stdout):
+    """Times a short maximization (one EM iteration with ``n_iter``
+    iterations of every step) of models returned by ``build_model_fn()``
+    with every number of intra-op threads in ``n_threads_candidates``,
+    keeping the shortest of ``n_repeats`` runs, and sets the fastest number
+    of threads.
+
+    The number of inter-op threads is not calibrated: PyTorch only allows
+    setting it once per process, before any parallel work.
+
+    Returns ``(n_threads, elapsed_times)``, where ``elapsed_times`` maps
+    every candidate to its elapsed time.
+    """
+    calibration_optim_params = get_calibration_optim_params(
+        optim_params=optim_params, n_iter=n_iter)
+    # the first run pays for allocations and thread pools creation
+    torch.set_num_threads(n_threads_candidates[0])
+    time_maximization(model=build_model_fn(),
+                      optim_params=calibration_optim_params)
+    elapsed_times = {}
+    for n_threads in n_threads_candidates:
+        torch.set_num_threads(n_threads)
+        elapsed_times[n_threads] = min(
+            time_maximization(model=build_model_fn(),
+                              optim_params=calibration_optim_params)
+            for i in range(n_repeats))
+        out.write(f"Calibration with {n_threads} threads: "
+                  f"{elapsed_times[n_threads]:f} secs\n")
+    n_threads = min(elapsed_times, key=elapsed_times.get)
+    torch.set_num_threads(n_threads)
+    return n_threads, elapsed_times
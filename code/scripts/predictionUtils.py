@@ -0,0 +1,165 @@
+import pickle
+import numpy as np
+import torch
+
+import estimationUtils
+import modelExport
+
+# extensions of the files of a prediction, filled into the ``{:s}`` extension
+# placeholder of the prediction filename pattern
+latents_means_extension = "latents_means.npy"
+latents_vars_extension = "latents_vars.npy"
+rates_extension = "rates.npy"
+index_extension = "index.npz"
+
+
+def load_model(model_filename):
+    """Loads the svGPFA model of a model exported with
+    :func:`modelExport.export_model` (a ``.npz`` file) or of the results
+    saved by :func:`estimationUtils.save_estimation_results`.
+
+    Returns a dictionary with keys ``model``, ``trials_ids``, ``units_ids``
+    (None for results saved without them), ``trials_start_times`` and
+    ``trials_end_times``.
+    """
+    if model_filename.endswith(".npz"):
+        exported_model = modelExport.load(export_filename=model_filename)
+        loaded_model = {
+            "model": exported_model.model,
+            "trials_ids": exported_model.params["trials_ids"],
+            "units_ids": exported_model.params["units_ids"],
+            "trials_start_times": exported_model.params["trials_start_times"],
+            "trials_end_times": exported_model.params["trials_end_times"]}
+        return loaded_model
+    with open(model_filename, "rb") as f:
+        results = pickle.load(f)
+    model = results["model"]
+    if model is None:
+        # minibatch estimations only keep their estimated parameters
+        estimated_params = results["estimated_params"]
+        n_trials = len(results["trials_start_times"])
+        n_units = \
+            estimated_params["initial_params"]["embedding"]["C0"].shape[0]
+        spikes_times = [[[] for n in range(n_units)] for r in range(n_trials)]
+        model = estimationUtils.build_model(
+            kernels_types=results["kernels_types"], params=estimated_params,
+            spikes_times=spikes_times)
+    loaded_model = {
+        "model": model,
+        "trials_ids": results.get("trials_ids", None),
+        "units_ids": results.get("units_ids", None),
+        "trials_start_times": np.asarray(results["trials_start_times"]),
+        "trials_end_times": np.asarray(results["trials_end_times"])}
+    return loaded_model
+
+
+def get_chunk_size(n_trials, n_units, n_latents, n_ind_points,
+                   max_chunk_mb):
+    """Returns the number of grid times predicted at once so that the
+    tensors of a chunk (kernel matrices between times and inducing points,
+    latents and embedding means and variances) take about ``max_chunk_mb``
+    megabytes."""
+    bytes_per_time = 8 * n_trials * (2 * n_latents * (n_ind_points + 2) +
+                                     3 * n_units)
+    chunk_size = int(max_chunk_mb * 2**20 // bytes_per_time)
+    return max(chunk_size, 1)
+
+
+def predict(model, times, filename_pattern, trials_ids=None, units_ids=None,
+            max_chunk_mb=256.0):
+    """Predicts the means and variances of the latents and the expected
+    ``ExponentialLink`` rates, ``E[exp(C x(t) + d)]``, of all trials and
+    units of ``model`` at ``times`` (the same grid for every trial).
+
+    Each chunk of at most ``max_chunk_mb`` megabytes of ``times`` is
+    predicted for all trials at once, and written to the memory-mappable
+    ``.npy`` arrays ``latents_means`` and ``latents_vars`` (``n_trials`` x
+    ``n_times`` x ``n_latents``) and ``rates`` (``n_trials`` x ``n_times`` x
+    ``n_units``), in ``filename_pattern`` (with one ``{:s}`` placeholder for
+    the extension). ``times``, ``trials_ids`` and ``units_ids`` (their
+    indices if None) are saved in an index file.
+
+    Returns the list of saved filenames.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    C, d = model.getSVEmbeddingParams()
+    n_units, n_latents = C.shape
+    ind_points_locs = model.getIndPointsLocs()
+    n_trials = ind_points_locs[0].shape[0]
+    n_ind_points = max(locs.shape[1] for locs in ind_points_locs)
+    n_times = len(times)
+
+    latents_means_filename = filename_pattern.format(latents_means_extension)
+    latents_vars_filename = filename_pattern.format(latents_vars_extension)
+    rates_filename = filename_pattern.format(rates_extension)
+    latents_means = np.lib.format.open_memmap(
+        latents_means_filename, mode="w+", dtype=np.float64,
+        shape=(n_trials, n_times, n_latents))
+    latents_vars = np.lib.format.open_memmap(
+        latents_vars_filename, mode="w+", dtype=np.float64,
+        shape=(n_trials, n_times, n_latents))
+    rates = np.lib.format.open_memmap(
+        rates_filename, mode="w+", dtype=np.float64,
+        shape=(n_trials, n_times, n_units))
+
+    chunk_size = get_chunk_size(n_trials=n_trials, n_units=n_units,
+                                n_latents=n_latents,
+                                n_ind_points=n_ind_points,
+                                max_chunk_mb=max_chunk_mb)
+    C_t = C.detach().T
+    d_t = d.detach().reshape(1, 1, n_units)
+    with torch.no_grad():
+        for start in range(0, n_times, chunk_size):
+            end = min(start + chunk_size, n_times)
+            chunk_times = times[start:end]
+            if end - start == 1:
+                # svGPFA squeezes the times dimension of kernel matrices
+                # diagonals with a single time, so the time is repeated
+                chunk_times = np.repeat(chunk_times, 2)
+            chunk_times = torch.from_numpy(chunk_times).reshape(
+                1, -1, 1).expand(n_trials, -1, -1).contiguous()
+            # n_trials x chunk_size x n_latents
+            chunk_means, chunk_vars = model.predictLatents(times=chunk_times)
+            chunk_means = chunk_means[:, :end - start, :]
+            chunk_vars = chunk_vars[:, :end - start, :]
+            embedding_means = chunk_means @ C_t + d_t
+            embedding_vars = chunk_vars @ C_t**2
+            latents_means[:, start:end, :] = chunk_means.numpy()
+            latents_vars[:, start:end, :] = chunk_vars.numpy()
+            rates[:, start:end, :] = torch.exp(
+                embedding_means + 0.5 * embedding_vars).numpy()
+    for array in (latents_means, latents_vars, rates):
+        array.flush()
+
+    if trials_ids is None:
+        trials_ids = np.arange(n_trials)
+    if units_ids is None:
+        units_ids = np.arange(n_units)
+    index_filename = filename_pattern.format(index_extension)
+    np.savez(index_filename, times=times,
+             trials_ids=np.asarray(trials_ids, dtype=np.int64),
+             units_ids=np.asarray(units_ids, dtype=np.int64))
+    return [latents_means_filename, latents_vars_filename, rates_filename,
+            index_filename]
+
+
+def load_prediction(filename_pattern, mmap_mode="r"):
+    """Loads a prediction saved by :func:`predict`, memory mapping its
+    arrays (unless ``mmap_mode`` is None).
+
+    Returns a dictionary with keys ``latents_means``, ``latents_vars``,
+    ``rates``, ``times``, ``trials_ids`` and ``units_ids``.
+    """
+    prediction = {
+        "latents_means": np.load(
+            filename_pattern.format(latents_means_extension),
+            mmap_mode=mmap_mode),
+        "latents_vars": np.load(
+            filename_pattern.format(latents_vars_extension),
+            mmap_mode=mmap_mode),
+        "rates": np.load(filename_pattern.format(rates_extension),
+                         mmap_mode=mmap_mode)}
+    with np.load(filename_pattern.format(index_extension)) as index:
+        for name in index.files:
+            prediction[name] = index[name]
+    return prediction
@@ -0,0 +1,210 @@
+import torch
+
+import svGPFA.stats.kernelsMatricesStore
+import svGPFA.stats.svPosteriorOnIndPoints
+import svGPFA.stats.svPosteriorOnLatents
+import svGPFA.stats.svEmbedding
+import svGPFA.stats.expectedLogLikelihood
+import svGPFA.stats.klDivergence
+import svGPFA.stats.svLowerBound
+
+reduced_dtype = torch.float32
+
+
+def _to_reduced_times(times, ind_points_locs):
+    # kernels are stationary, so times and inducing points locations can be
+    # shifted by the first inducing point location of every trial before
+    # rounding them, which keeps absolute session times accurate
+    shift = ind_points_locs[:, :1, :].detach()
+    return (times - shift).to(reduced_dtype), \
+        (ind_points_locs - shift).to(reduced_dtype)
+
+
+class ReducedPrecisionIndPointsLocsAndAllTimesKMS(
+        svGPFA.stats.kernelsMatricesStore.IndPointsLocsAndAllTimesKMS):
+    """Kernel matrices between quadrature times and inducing points
+    locations in reduced precision."""
+
+    def buildKernelsMatrices(self):
+        n_latents = len(self._ind_points_locs)
+        self._Ktz = [None for k in range(n_latents)]
+        self._KttDiag = torch.zeros(self._t.shape[0], self._t.shape[1],
+                                    n_latents, dtype=reduced_dtype,
+                                    device=self._t.device)
+        for k in range(n_latents):
+            t, locs = _to_reduced_times(
+                times=self._t, ind_points_locs=self._ind_points_locs[k])
+            self._Ktz[k] = self._kernels[k].buildKernelMatrix(X1=t, X2=locs)
+            self._KttDiag[:, :, k] = self._kernels[k].buildKernelMatrixDiag(
+                X=t).squeeze(-1)
+
+
+class ReducedPrecisionIndPointsLocsAndAssocTimesKMS(
+        svGPFA.stats.kernelsMatricesStore.IndPointsLocsAndAssocTimesKMS):
+    """Kernel matrices between spikes times and inducing points locations in
+    reduced precision."""
+
+    def buildKernelsMatrices(self):
+        n_latents = len(self._ind_points_locs)
+        n_trials = self._ind_points_locs[0].shape[0]
+        self._Ktz = [[None for tr in range(n_trials)]
+                     for k in range(n_latents)]
+        self._KttDiag = [[None for tr in range(n_trials)]
+                         for k in range(n_latents)]
+        for k in range(n_latents):
+            for tr in range(n_trials):
+                t, locs = _to_reduced_times(
+                    times=self._t[tr].reshape(1, -1, 1),
+                    ind_points_locs=self._ind_points_locs[k][tr:tr+1])
+                self._Ktz[k][tr] = self._kernels[k].buildKernelMatrix(
+                    X1=t, X2=locs)[0]
+                self._KttDiag[k][tr] = \
+                    self._kernels[k].buildKernelMatrixDiag(X=t).reshape(-1)
+
+
+class ReducedPrecisionPosteriorOnLatentsMixin:
+    """Means and variances of the posterior on latents at many times in
+    reduced precision. The Cholesky solves with the kernel matrices of the
+    inducing points stay in double precision; only their products with the
+    (reduced precision) kernel matrices between times and inducing points
+    are rounded.
+
+    Uses that the variance at time t is ``Ktt + Ktz W Kzt``, with
+    ``W = Kzz^-1 (S - Kzz) Kzz^-1`` (number of inducing points squared),
+    instead of solving for every time."""
+
+    def _getReducedPrecisionFactors(self):
+        Kzz = self._indPointsLocsKMS.getKzz()
+        qMu = self._svPosteriorOnIndPoints.getMean()
+        qSigma = self._svPosteriorOnIndPoints.buildCov()
+        Ak = []
+        Wk = []
+        for k in range(len(qMu)):
+            # Ak[k] \in nTrials x nInd[k] x 1
+            Ak.append(self._indPointsLocsKMS.solveForLatent(
+                input=qMu[k], latentIndex=k).to(reduced_dtype))
+            # Wk[k] \in nTrials x nInd[k] x nInd[k]
+            aux = self._indPointsLocsKMS.solveForLatent(
+                input=qSigma[k]-Kzz[k], latentIndex=k)
+            Wk.append(self._indPointsLocsKMS.solveForLatent(
+                input=aux.transpose(1, 2), latentIndex=k).to(reduced_dtype))
+        return Ak, Wk
+
+
+class ReducedPrecisionPosteriorOnLatentsAllTimes(
+        ReducedPrecisionPosteriorOnLatentsMixin,
+        svGPFA.stats.svPosteriorOnLatents.SVPosteriorOnLatentsAllTimes):
+
+    def computeMeansAndVars(self):
+        Ktz = self._indPointsLocsAndTimesKMS.getKtz()
+        KttDiag = self._indPointsLocsAndTimesKMS.getKttDiag()
+        Ak, Wk = self._getReducedPrecisionFactors()
+        # qKMu, qKVar \in nTrials x nQuad x nLatents
+        qKMu = torch.cat([torch.matmul(Ktz[k], Ak[k])
+                          for k in range(len(Ak))], dim=2)
+        qKVar = KttDiag + torch.stack(
+            [torch.sum(torch.matmul(Ktz[k], Wk[k])*Ktz[k], dim=2)
+             for k in range(len(Wk))], dim=2)
+        return qKMu, qKVar
+
+
+class ReducedPrecisionPosteriorOnLatentsAssocTimes(
+        ReducedPrecisionPosteriorOnLatentsMixin,
+        svGPFA.stats.svPosteriorOnLatents.SVPosteriorOnLatentsAssocTimes):
+
+    def computeMeansAndVars(self):
+        Ktz = self._indPointsLocsAndTimesKMS.getKtz()
+        KttDiag = self._indPointsLocsAndTimesKMS.getKttDiag()
+        Ak, Wk = self._getReducedPrecisionFactors()
+        n_latents = len(Ak)
+        n_trials = len(KttDiag[0])
+        qKMu = [None for tr in range(n_trials)]
+        qKVar = [None for tr in range(n_trials)]
+        for tr in range(n_trials):
+            # qKMu[tr], qKVar[tr] \in nSpikes[tr] x nLatents
+            qKMu[tr] = torch.cat([torch.matmul(Ktz[k][tr], Ak[k][tr])
+                                  for k in range(n_latents)], dim=1)
+            qKVar[tr] = torch.stack(
+                [KttDiag[k][tr] +
+                 torch.sum(torch.matmul(Ktz[k][tr], Wk[k][tr])*Ktz[k][tr],
+                           dim=1)
+                 for k in range(n_latents)], dim=1)
+        return qKMu, qKVar
+
+
+class ReducedPrecisionLinearSVEmbeddingAllTimes(
+        svGPFA.stats.svEmbedding.LinearSVEmbeddingAllTimes):
+    """Linear embedding in the precision of the posterior on latents."""
+
+    def _computeMeansAndVarsGivenSVPosteriorOnLatentsStats(self, means, vars):
+        C = self._C.to(means.dtype)
+        d = self._d.to(means.dtype)
+        emb_post_mean = torch.matmul(means, C.T) + d.reshape(1, 1, -1)
+        emb_post_var = torch.matmul(vars, C.T**2)
+        return emb_post_mean, emb_post_var
+
+
+class ReducedPrecisionLinearSVEmbeddingAssocTimes(
+        svGPFA.stats.svEmbedding.LinearSVEmbeddingAssocTimes):
+    """Linear embedding in the precision of the posterior on latents."""
+
+    def _computeMeansAndVarsGivenSVPosteriorOnLatentsStats(self, means, vars):
+        n_trials = len(self._neuronForSpikeIndex)
+        emb_post_mean = [None for tr in range(n_trials)]
+        emb_post_var = [None for tr in range(n_trials)]
+        for tr in range(n_trials):
+            neurons = self._neuronForSpikeIndex[tr]
+            C = self._C[neurons, :].to(means[tr].dtype)
+            d = self._d[neurons].reshape(-1).to(means[tr].dtype)
+            emb_post_mean[tr] = torch.sum(means[tr]*C, dim=1) + d
+            emb_post_var[tr] = torch.sum(vars[tr]*C**2, dim=1)
+        return emb_post_mean, emb_post_var
+
+
+class ReducedPrecisionPointProcessELLExpLink(
+        svGPFA.stats.expectedLogLikelihood.PointProcessELLExpLink):
+    """Expected log-likelihood whose link values are computed in reduced
+    precision and accumulated in double precision."""
+
+    def _getELinkValues(self, eMean, eVar):
+        eLinkValues = super()._getELinkValues(eMean=eMean, eVar=eVar)
+        return eLinkValues.to(torch.double)
+
+    def _getELogLinkValues(self, eMean, eVar):
+        eLogLink = super()._getELogLinkValues(eMean=eMean, eVar=eVar)
+        return eLogLink.to(torch.double)
+
+
+def create_model(kernels):
+    """Creates a point-process svGPFA model with exponential link, linear
+    embedding and Cholesky-represented covariances, as
+    ``SVGPFAModelFactory.buildModelPyTorch`` of
+    :mod:`svGPFA.stats.svGPFAModelFactory`, that evaluates its expected
+    log-likelihood in single precision. Kernel matrices of inducing points,
+    their Cholesky factors and the KL divergence stay in double precision.
+    ``kernels`` should be stationary. Predictions of the model are computed
+    in double precision."""
+    qU = svGPFA.stats.svPosteriorOnIndPoints.SVPosteriorOnIndPointsChol()
+    indPointsLocsKMS = svGPFA.stats.kernelsMatricesStore.\
+        IndPointsLocsKMS_Chol()
+    indPointsLocsAndAllTimesKMS = \
+        ReducedPrecisionIndPointsLocsAndAllTimesKMS()
+    indPointsLocsAndAssocTimesKMS = \
+        ReducedPrecisionIndPointsLocsAndAssocTimesKMS()
+    qKAllTimes = ReducedPrecisionPosteriorOnLatentsAllTimes(
+        svPosteriorOnIndPoints=qU, indPointsLocsKMS=indPointsLocsKMS,
+        indPointsLocsAndTimesKMS=indPointsLocsAndAllTimesKMS)
+    qKAssocTimes = ReducedPrecisionPosteriorOnLatentsAssocTimes(
+        svPosteriorOnIndPoints=qU, indPointsLocsKMS=indPointsLocsKMS,
+        indPointsLocsAndTimesKMS=indPointsLocsAndAssocTimesKMS)
+    qHAllTimes = ReducedPrecisionLinearSVEmbeddingAllTimes(
+        svPosteriorOnLatents=qKAllTimes)
+    qHAssocTimes = ReducedPrecisionLinearSVEmbeddingAssocTimes(
+        svPosteriorOnLatents=qKAssocTimes)
+    eLL = ReducedPrecisionPointProcessELLExpLink(
+        svEmbeddingAllTimes=qHAllTimes, svEmbeddingAssocTimes=qHAssocTimes)
+    klDiv = svGPFA.stats.klDivergence.KLDivergence(
+        indPointsLocsKMS=indPointsLocsKMS, svPosteriorOnIndPoints=qU)
+    model = svGPFA.stats.svLowerBound.SVLowerBound(eLL=eLL, klDiv=klDiv)
+    model.setKernels(kernels=kernels)
+    return model
@@ -0,0 +1,143 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import configparser
+
+# number of estimation result numbers, as filled into the {:08d} field of
+# results filename patterns
+n_estim_res_numbers = 10**8
+
+
+def get_estimation_key(filenames, params):
+    """Returns the hexadecimal SHA-256 digest of the contents of the files
+    ``filenames`` (e.g., epoched spikes store, selected trials and
+    initialization files) and the parameters ``params`` (a dictionary of
+    values with a string representation, e.g., command line arguments that
+    affect the estimation)."""
+    hasher = hashlib.sha256()
+    for filename in filenames:
+        hasher.update(os.path.basename(filename).encode())
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                hasher.update(chunk)
+    hasher.update(json.dumps(params, sort_keys=True, default=str).encode())
+    key = hasher.hexdigest()
+    return key
+
+
+def read_estimation_key(estim_res_metadata_filename):
+    """Returns the estimation key saved in the estimation result metadata
+    file ``estim_res_metadata_filename``, and whether the estimation
+    terminated without an error, as ``(key, completed)``. ``key`` is None
+    for results saved without a key."""
+    estim_res_config = configparser.ConfigParser()
+    estim_res_config.read(estim_res_metadata_filename)
+    key = estim_res_config.get("estimation_params", "cache_key",
+                               fallback=None)
+    # estimations terminated by an error are estimated again
+    completed = estim_res_config.get("termination_params", "criterion",
+                                     fallback="error") != "error"
+    return key, completed
+
+
+def find_estim_res_number(estim_res_metadata_filename_pattern, key):
+    """Returns the estimation result number of ``key``: the first number,
+    starting from one derived from ``key``, without an estimation result
+    metadata file or whose metadata file was saved with ``key`` (see
+    :func:`estimationUtils.save_estim_res_metadata`).
+
+    Returns ``(estResNumber, completed)``, where ``completed`` indicates
+    that an estimation with ``key`` already terminated without an error.
+    """
+    estResNumber = int(key, 16) % n_estim_res_numbers
+    while True:
+        estim_res_metadata_filename = \
+            estim_res_metadata_filename_pattern.format(estResNumber)
+        if not os.path.exists(estim_res_metadata_filename):
+            return estResNumber, False
+        estim_res_key, completed = read_estimation_key(
+            estim_res_metadata_filename=estim_res_metadata_filename)
+        if estim_res_key == key:
+            return estResNumber, completed
+        estResNumber = (estResNumber + 1) % n_estim_res_numbers
+
+
+def get_estim_res_filenames(filename_patterns, estResNumber):
+    """Returns the existing files of the estimation result ``estResNumber``,
+    named after ``filename_patterns`` (with an estimation result number
+    field, and optionally an extension field)."""
+    filenames = []
+    for filename_pattern in filename_patterns:
+        filenames.extend(glob.glob(filename_pattern.format(estResNumber,
+                                                           "*")))
+    return sorted(set(filenames))
+
+
+class ResultsCache:
+    """Least-recently-used index of the estimation results in a results
+    directory, saved as JSON in ``index_filename``.
+
+    Every entry maps an estimation key (see :func:`get_estimation_key`) to
+    its estimation result number, the total size of its files and the time
+    it was last estimated or reused. If ``max_bytes`` is given,
+    :meth:`touch` deletes the files of the least recently used results
+    until the results in the index take at most ``max_bytes``. Files are
+    found from ``filename_patterns`` (see :func:`get_estim_res_filenames`).
+    """
+
+    def __init__(self, index_filename, filename_patterns, max_bytes=None):
+        self._index_filename = index_filename
+        self._filename_patterns = filename_patterns
+        self._max_bytes = max_bytes
+
+    def _load_index(self):
+        if not os.path.exists(self._index_filename):
+            return {}
+        with open(self._index_filename, "r") as f:
+            index = json.load(f)
+        return index
+
+    def _save_index(self, index):
+        # replacing the index atomically avoids leaving a truncated index
+        tmp_filename = f"{self._index_filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self._index_filename)
+
+    def touch(self, key, estResNumber):
+        """Records that the estimation result ``estResNumber`` of ``key`` was
+        just estimated or reused, and evicts least recently used results if
+        needed. Returns the numbers of the evicted results."""
+        index = self._load_index()
+        filenames = get_estim_res_filenames(
+            filename_patterns=self._filename_patterns,
+            estResNumber=estResNumber)
+        index[key] = {"estResNumber": estResNumber,
+                      "n_bytes": sum(os.path.getsize(filename)
+                                     for filename in filenames),
+                      "last_access": time.time()}
+        evicted = self._evict(index=index, keep_key=key)
+        self._save_index(index=index)
+        return evicted
+
+    def _evict(self, index, keep_key):
+        evicted = []
+        if self._max_bytes is None:
+            return evicted
+        total_bytes = sum(entry["n_bytes"] for entry in index.values())
+        lru_keys = sorted(index, key=lambda key: index[key]["last_access"])
+        for key in lru_keys:
+            if total_bytes <= self._max_bytes:
+                break
+            if key == keep_key:
+                continue
+            entry = index.pop(key)
+            for filename in get_estim_res_filenames(
+                    filename_patterns=self._filename_patterns,
+                    estResNumber=entry["estResNumber"]):
+                os.remove(filename)
+            total_bytes -= entry["n_bytes"]
+            evicted.append(entry["estResNumber"])
+        return evicted
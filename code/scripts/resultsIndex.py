@@ -0,0 +1,239 @@
+import os
+import re
+import glob
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import configparser
+import numpy as np
+
+# columns of the runs table of the results index
+columns = [
+    ("estim_res_number", "INTEGER PRIMARY KEY"),
+    ("subject_name", "TEXT"),
+    ("region", "TEXT"),
+    ("epoch_event_name", "TEXT"),
+    ("est_init_number", "INTEGER"),
+    ("n_latents", "INTEGER"),
+    ("common_n_ind_points", "INTEGER"),
+    ("min_n_ind_points", "INTEGER"),
+    ("max_n_ind_points", "INTEGER"),
+    ("n_trials", "INTEGER"),
+    ("trials_ids_filename", "TEXT"),
+    ("trials_ids_hash", "TEXT"),
+    ("lower_bound", "REAL"),
+    ("n_iterations", "INTEGER"),
+    ("elapsed_time", "REAL"),
+    ("termination_criterion", "TEXT"),
+    ("estim_res_metadata_filename", "TEXT"),
+    ("model_save_filename", "TEXT"),
+    ("model_export_filename", "TEXT"),
+    ("history_filename", "TEXT"),
+    ("indexed_time", "REAL"),
+]
+columns_names = [column_name for column_name, _ in columns]
+
+
+def connect(index_filename):
+    """Opens the SQLite results index ``index_filename``, creating its runs
+    table if needed."""
+    connection = sqlite3.connect(index_filename)
+    connection.row_factory = sqlite3.Row
+    columns_sql = ", ".join(f"{column_name} {column_type}"
+                            for column_name, column_type in columns)
+    connection.execute(f"CREATE TABLE IF NOT EXISTS runs ({columns_sql})")
+    # indices created before columns were added lack them
+    existing_columns_names = {
+        row["name"] for row in connection.execute("PRAGMA table_info(runs)")}
+    for column_name, column_type in columns:
+        if column_name not in existing_columns_names:
+            connection.execute(f"ALTER TABLE runs ADD COLUMN {column_name} "
+                               f"{column_type}")
+    connection.execute("CREATE INDEX IF NOT EXISTS runs_data ON runs "
+                       "(subject_name, region, epoch_event_name)")
+    return connection
+
+
+def get_trials_ids_hash(trials_ids):
+    """Returns a short hash identifying the set of trials ``trials_ids``."""
+    trials_ids = np.sort(np.asarray(trials_ids, dtype=np.int64))
+    trials_ids_hash = hashlib.sha1(trials_ids.tobytes()).hexdigest()[:16]
+    return trials_ids_hash
+
+
+def get_run_summary(estResNumber, estim_res_metadata_filename,
+                    est_init_config_filename_pattern,
+                    model_save_filename=None, model_export_filename=None,
+                    history_filename=None):
+    """Returns the row of the runs table of the estimation result
+    ``estResNumber``, as a dictionary.
+
+    The row is read from the estimation result metadata file, the
+    estimation initialization file (for the subject, region and epoch
+    event), the exported model (for the trials ids) and the estimation
+    history. The results pickle ``model_save_filename`` is only opened for
+    results saved without termination metadata, exported model or
+    history.
+
+    ``common_n_ind_points`` is None for estimations that allocated a number
+    of inducing points to every trial; ``min_n_ind_points`` and
+    ``max_n_ind_points`` are the smallest and largest numbers of inducing
+    points of any trial.
+    """
+    estim_res_config = configparser.ConfigParser()
+    estim_res_config.read(estim_res_metadata_filename)
+    data_params = estim_res_config["data_params"]
+    est_init_number = estim_res_config.getint("estimation_params",
+                                              "est_init_number")
+    if estim_res_config.has_section("ind_points_allocation_params"):
+        trials_n_ind_points = json.loads(estim_res_config[
+            "ind_points_allocation_params"]["trials_n_ind_points"])
+        common_n_ind_points = None
+        min_n_ind_points = min(trials_n_ind_points)
+        max_n_ind_points = max(trials_n_ind_points)
+    else:
+        common_n_ind_points = int(data_params["common_n_ind_points"])
+        min_n_ind_points = max_n_ind_points = common_n_ind_points
+    summary = {column_name: None for column_name in columns_names}
+    summary.update({
+        "estim_res_number": estResNumber,
+        "est_init_number": est_init_number,
+        "n_latents": int(data_params["nlatents"]),
+        "common_n_ind_points": common_n_ind_points,
+        "min_n_ind_points": min_n_ind_points,
+        "max_n_ind_points": max_n_ind_points,
+        "trials_ids_filename": data_params.get("trials_ids_filename", None),
+        "estim_res_metadata_filename": estim_res_metadata_filename,
+        "indexed_time": time.time(),
+    })
+    for key, filename in (("model_save_filename", model_save_filename),
+                          ("model_export_filename", model_export_filename),
+                          ("history_filename", history_filename)):
+        if filename is not None and os.path.exists(filename):
+            summary[key] = filename
+
+    est_init_config = configparser.ConfigParser()
+    est_init_config.read(est_init_config_filename_pattern.format(
+        est_init_number))
+    if est_init_config.has_section("data_params"):
+        for key in ("subject_name", "region", "epoch_event_name"):
+            summary[key] = est_init_config["data_params"].get(key, None)
+
+    trials_ids = None
+    lowerBoundHist = None
+    elapsedTimeHist = None
+    if estim_res_config.has_section("termination_params"):
+        termination_params = estim_res_config["termination_params"]
+        summary["lower_bound"] = float(termination_params["lower_bound"])
+        summary["n_iterations"] = int(termination_params["n_iterations"])
+        summary["elapsed_time"] = float(termination_params["elapsed_time"])
+        summary["termination_criterion"] = termination_params["criterion"]
+    elif summary["history_filename"] is not None:
+        with np.load(summary["history_filename"]) as history:
+            lowerBoundHist = history["lower_bound_hist"]
+            elapsedTimeHist = history["elapsed_time_hist"]
+    if summary["model_export_filename"] is not None:
+        with np.load(summary["model_export_filename"]) as arrays:
+            trials_ids = arrays["trials_ids"]
+    if (trials_ids is None or
+            (summary["lower_bound"] is None and lowerBoundHist is None)) and \
+            summary["model_save_filename"] is not None:
+        with open(summary["model_save_filename"], "rb") as f:
+            estResults = pickle.load(f)
+        if trials_ids is None:
+            trials_ids = estResults.get("trials_ids", None)
+            if trials_ids is None:
+                summary["n_trials"] = len(estResults["trials_start_times"])
+        if summary["lower_bound"] is None:
+            lowerBoundHist = estResults["lowerBoundHist"]
+            elapsedTimeHist = estResults["elapsedTimeHist"]
+    if summary["lower_bound"] is None and lowerBoundHist is not None:
+        summary["lower_bound"] = float(lowerBoundHist[-1])
+        summary["n_iterations"] = len(lowerBoundHist) - 1
+        summary["elapsed_time"] = float(elapsedTimeHist[-1])
+    if trials_ids is not None:
+        summary["n_trials"] = len(trials_ids)
+        summary["trials_ids_hash"] = get_trials_ids_hash(
+            trials_ids=trials_ids)
+    return summary
+
+
+def record_runs(index_filename, summaries):
+    """Adds, or replaces, the rows ``summaries`` (see
+    :func:`get_run_summary`) to the runs table of the results index
+    ``index_filename``."""
+    connection = connect(index_filename=index_filename)
+    placeholders = ", ".join(f":{column_name}"
+                             for column_name in columns_names)
+    with connection:
+        connection.executemany(
+            f"INSERT OR REPLACE INTO runs ({', '.join(columns_names)}) "
+            f"VALUES ({placeholders})", summaries)
+    connection.close()
+
+
+def delete_runs(index_filename, estim_res_numbers):
+    """Removes the estimation results ``estim_res_numbers`` from the results
+    index ``index_filename``."""
+    connection = connect(index_filename=index_filename)
+    with connection:
+        connection.executemany(
+            "DELETE FROM runs WHERE estim_res_number = ?",
+            [(int(estim_res_number),)
+             for estim_res_number in estim_res_numbers])
+    connection.close()
+
+
+def get_indexed_numbers(index_filename):
+    """Returns the set of estimation result numbers in the results index
+    ``index_filename``."""
+    connection = connect(index_filename=index_filename)
+    indexed_numbers = {row["estim_res_number"] for row in
+                       connection.execute("SELECT estim_res_number FROM runs")}
+    connection.close()
+    return indexed_numbers
+
+
+def query_runs(index_filename, filters=None, order_by="lower_bound",
+               ascending=False, limit=None):
+    """Returns the rows of the runs table of the results index
+    ``index_filename`` whose columns equal the values in the dictionary
+    ``filters``, sorted by column ``order_by`` and at most ``limit`` of
+    them."""
+    if filters is None:
+        filters = {}
+    for column_name in list(filters) + [order_by]:
+        if column_name not in columns_names:
+            raise ValueError(f"Invalid column {column_name}. Valid columns "
+                             f"are {', '.join(columns_names)}")
+    sql = "SELECT * FROM runs"
+    if len(filters) > 0:
+        sql += " WHERE " + " AND ".join(f"{column_name} = :{column_name}"
+                                        for column_name in filters)
+    sql += f" ORDER BY {order_by} {'ASC' if ascending else 'DESC'}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    connection = connect(index_filename=index_filename)
+    rows = [dict(row) for row in connection.execute(sql, filters)]
+    connection.close()
+    return rows
+
+
+def find_estim_res_numbers(estim_res_metadata_filename_pattern):
+    """Returns the sorted numbers of the estimation results with a metadata
+    file named after ``estim_res_metadata_filename_pattern``, whose first
+    field is the zero-padded estimation result number."""
+    number_field = "{:08d}"
+    prefix, suffix = estim_res_metadata_filename_pattern.split(
+        number_field, 1)
+    filename_regex = re.compile(re.escape(prefix) + r"(\d{8})" +
+                                re.escape(suffix))
+    estim_res_numbers = []
+    for filename in glob.glob(glob.escape(prefix) + "[0-9]" * 8 +
+                              glob.escape(suffix)):
+        match = filename_regex.fullmatch(filename)
+        if match is not None:
+            estim_res_numbers.append(int(match.group(1)))
+    return sorted(estim_res_numbers)
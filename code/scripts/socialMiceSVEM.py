@@ -0,0 +1,624 @@
+import sys
+import os
+import time
+import math
+import pickle
+import traceback
+import numpy as np
+import torch
+
+import svGPFA.stats.svEM
+
+
+class SVEM_PyTorch(svGPFA.stats.svEM.SVEM_PyTorch):
+    """svGPFA's PyTorch EM with hooks called at the end of every EM
+    iteration and the possibility to resume a previous maximization.
+
+    Every callable in ``iteration_callbacks`` is called as
+    ``callback(iteration=..., model=..., lowerBoundHist=...,
+    elapsedTimeHist=..., iterationsModelParams=...)`` after each EM
+    iteration. A callback stops the maximization by returning a
+    :class:`svGPFA.stats.svEM.TerminationInfo`.
+
+    Every callable in ``step_callbacks`` is called as
+    ``callback(iteration=..., step=..., elapsed_time=..., maxRes=...)``
+    after each EM step, with ``elapsed_time`` the wall time, in seconds,
+    taken by the step.
+
+    ``resume_state`` is a dictionary with keys ``iteration``,
+    ``lowerBoundHist``, ``elapsedTimeHist`` and ``iterationsModelParams``
+    (e.g., read from a checkpoint), describing the last completed iteration
+    of a previous maximization of ``model``.
+    """
+
+    def maximize(self, model, optim_params, method="ECM",
+                 getIterationModelParamsFn=None,
+                 printIterationModelParams=True, verbose=True,
+                 out=sys.stdout, iteration_callbacks=None,
+                 step_callbacks=None, resume_state=None):
+        if iteration_callbacks is None:
+            iteration_callbacks = []
+        if step_callbacks is None:
+            step_callbacks = []
+        steps = self._getSteps(method=method)
+        functions_for_steps = self._getFunctionsForSteps()
+
+        if resume_state is None:
+            iter = 0
+            lowerBoundHist = [model.eval().item()]
+            elapsedTimeHist = [0.0]
+            if getIterationModelParamsFn is not None:
+                iterationsModelParams = [None for i in
+                                         range(optim_params["em_max_iter"]+1)]
+                iterationsModelParams[iter] = \
+                    getIterationModelParamsFn(model=model)
+                if printIterationModelParams:
+                    print(iterationsModelParams[iter])
+            else:
+                iterationsModelParams = None
+        else:
+            iter = resume_state["iteration"]
+            lowerBoundHist = list(resume_state["lowerBoundHist"])
+            elapsedTimeHist = list(resume_state["elapsedTimeHist"])
+            iterationsModelParams = resume_state["iterationsModelParams"]
+            if iterationsModelParams is not None and \
+                    len(iterationsModelParams) < optim_params["em_max_iter"]+1:
+                iterationsModelParams.extend(
+                    [None for i in range(optim_params["em_max_iter"] + 1 -
+                                         len(iterationsModelParams))])
+            if verbose:
+                out.write(f"Resuming maximization after iteration {iter:02d}, "
+                          f"lower bound {lowerBoundHist[-1]:f}\n")
+        # elapsed times continue from those of the resumed maximization
+        startTime = time.time() - elapsedTimeHist[-1]
+
+        maxRes = {"lowerBound": -math.inf}
+        iter += 1
+        while iter <= optim_params["em_max_iter"]:
+            for step in steps:
+                if optim_params["{:s}_estimate".format(step)]:
+                    if verbose:
+                        out.write("Iteration {:02d}, {:s} start: {:f}\n".format(
+                            iter, step, maxRes["lowerBound"]))
+                    try:
+                        stepStartTime = time.time()
+                        with torch.profiler.record_function(step):
+                            maxRes = functions_for_steps[step](
+                                model=model,
+                                optim_params=optim_params[
+                                    "{:s}_optim_params".format(step)])
+                        stepElapsedTime = time.time() - stepStartTime
+                    except Exception as e:
+                        stack_trace = traceback.format_exc()
+                        print(e)
+                        print(stack_trace)
+                        terminationInfo = \
+                            svGPFA.stats.svEM.ErrorTerminationInfo(
+                                message=("Error occured while processing "
+                                         f"{step} in iteration {iter}"),
+                                error=e, stack_trace=stack_trace)
+                        return lowerBoundHist, elapsedTimeHist, \
+                            terminationInfo, iterationsModelParams
+                    if verbose:
+                        out.write("Iteration {:02d}, {:s} end: {:f}, niter: "
+                                  "{:d}, nfeval: {:d}\n".format(
+                                      iter, step, maxRes["lowerBound"],
+                                      maxRes["niter"], maxRes["nfeval"]))
+                    for callback in step_callbacks:
+                        callback(iteration=iter, step=step,
+                                 elapsed_time=stepElapsedTime, maxRes=maxRes)
+                    if getIterationModelParamsFn is not None:
+                        iterationsModelParams[iter] = \
+                            getIterationModelParamsFn(model=model)
+                        if printIterationModelParams:
+                            print(iterationsModelParams[iter])
+            elapsedTimeHist.append(time.time()-startTime)
+            lowerBoundHist.append(maxRes["lowerBound"].item())
+            for callback in iteration_callbacks:
+                terminationInfo = callback(
+                    iteration=iter, model=model,
+                    lowerBoundHist=lowerBoundHist,
+                    elapsedTimeHist=elapsedTimeHist,
+                    iterationsModelParams=iterationsModelParams)
+                if terminationInfo is not None:
+                    return lowerBoundHist, elapsedTimeHist, \
+                        terminationInfo, iterationsModelParams
+            iter += 1
+        terminationInfo = svGPFA.stats.svEM.TerminationInfo(
+            "Maximum number of iterations ({:d}) reached".format(
+                optim_params["em_max_iter"]))
+        return lowerBoundHist, elapsedTimeHist, terminationInfo, \
+            iterationsModelParams
+
+    def _getSteps(self, method):
+        if method.lower() == "ecm":
+            steps = ["estep", "mstep_embedding", "mstep_kernels",
+                     "mstep_indpointslocs"]
+        elif method.lower() == "mecm":
+            steps = ["estep", "mstep_embedding", "estep", "mstep_kernels",
+                     "estep", "mstep_indpointslocs"]
+        else:
+            raise ValueError("Invalid method={:s}. Supported values are ECM "
+                             "and mECM".format(method))
+        return steps
+
+    def _getFunctionsForSteps(self):
+        functions_for_steps = {"estep": self._eStep,
+                               "mstep_embedding": self._mStepEmbedding,
+                               "mstep_kernels": self._mStepKernels,
+                               "mstep_indpointslocs": self._mStepIndPointsLocs}
+        return functions_for_steps
+
+
+class MinibatchSVEM_PyTorch(SVEM_PyTorch):
+    """EM over minibatches of trials.
+
+    The per-trial parameters of all trials (variational means and
+    covariances, inducing points locations and quadrature points and
+    weights) are kept in ``params``, as returned by
+    :func:`svGPFA.utils.initUtils.getParamsAndKernelsTypes`, and only the
+    parameters and measurements of the trials in the current minibatch are
+    set in ``model``. Hence, the memory used by ``model`` is bounded by the
+    minibatch size. Embedding and kernels parameters are shared by all
+    minibatches. On return ``params`` holds the estimated parameters.
+
+    ``get_measurements_fn(trials_indices=...)`` should return the
+    measurements of the trials at ``trials_indices`` (indices into the trials
+    of ``params``).
+
+    Each EM iteration (epoch) runs ``n_iter_per_batch`` iterations of the EM
+    steps on every minibatch of ``batch_size`` trials. With
+    ``schedule="sequential"`` minibatches contain consecutive trials and with
+    ``schedule="shuffled"`` trials are randomly reassigned to minibatches in
+    every epoch. The lower bound of an epoch is the sum of the lower bounds
+    of its minibatches, each evaluated right after updating the minibatch.
+
+    ``iteration_callbacks``, ``step_callbacks`` and ``resume_state`` are as
+    in :meth:`SVEM_PyTorch.maximize`, with iteration callbacks called at the
+    end of every epoch and step callbacks also receiving the index of the
+    minibatch in ``minibatch``.
+
+    If ``trials_n_ind_points`` is given, trial ``r`` only uses the leading
+    ``trials_n_ind_points[r]`` inducing points in ``params`` (see
+    :func:`indPointsAllocation.allocate_params`). Minibatches then only
+    contain trials with the same number of inducing points.
+    """
+
+    def maximize(self, model, params, get_measurements_fn, batch_size,
+                 schedule="shuffled", n_iter_per_batch=1, random_seed=None,
+                 method="ECM", getIterationModelParamsFn=None,
+                 printIterationModelParams=True, verbose=True,
+                 out=sys.stdout, iteration_callbacks=None,
+                 step_callbacks=None, resume_state=None,
+                 trials_n_ind_points=None):
+        if iteration_callbacks is None:
+            iteration_callbacks = []
+        if step_callbacks is None:
+            step_callbacks = []
+        optim_params = params["optim_params"]
+        steps = self._getSteps(method=method)
+        functions_for_steps = self._getFunctionsForSteps()
+        n_trials = params["ell_calculation_params"]["leg_quad_points"].shape[0]
+
+        if resume_state is None:
+            iter = 0
+            lowerBound0 = 0.0
+            for trials_indices in get_trials_batches(
+                    n_trials=n_trials, batch_size=batch_size,
+                    schedule="sequential",
+                    trials_groups=trials_n_ind_points):
+                self._setTrialsBatch(
+                    model=model, params=params,
+                    get_measurements_fn=get_measurements_fn,
+                    trials_indices=trials_indices,
+                    trials_n_ind_points=trials_n_ind_points)
+                lowerBound0 += model.eval().item()
+            lowerBoundHist = [lowerBound0]
+            elapsedTimeHist = [0.0]
+            if getIterationModelParamsFn is not None:
+                iterationsModelParams = [None for i in
+                                         range(optim_params["em_max_iter"]+1)]
+                iterationsModelParams[iter] = \
+                    getIterationModelParamsFn(model=model)
+                if printIterationModelParams:
+                    print(iterationsModelParams[iter])
+            else:
+                iterationsModelParams = None
+        else:
+            iter = resume_state["iteration"]
+            lowerBoundHist = list(resume_state["lowerBoundHist"])
+            elapsedTimeHist = list(resume_state["elapsedTimeHist"])
+            iterationsModelParams = resume_state["iterationsModelParams"]
+            if iterationsModelParams is not None and \
+                    len(iterationsModelParams) < optim_params["em_max_iter"]+1:
+                iterationsModelParams.extend(
+                    [None for i in range(optim_params["em_max_iter"] + 1 -
+                                         len(iterationsModelParams))])
+            if verbose:
+                out.write(f"Resuming maximization after iteration {iter:02d}, "
+                          f"lower bound {lowerBoundHist[-1]:f}\n")
+        startTime = time.time() - elapsedTimeHist[-1]
+
+        iter += 1
+        while iter <= optim_params["em_max_iter"]:
+            # seeding with the epoch number makes the minibatches of an epoch
+            # independent of whether the maximization was resumed
+            if random_seed is None:
+                rng = np.random.default_rng()
+            else:
+                rng = np.random.default_rng([random_seed, iter])
+            trials_batches = get_trials_batches(
+                n_trials=n_trials, batch_size=batch_size, schedule=schedule,
+                rng=rng, trials_groups=trials_n_ind_points)
+            lowerBound = 0.0
+            for batch_index, trials_indices in enumerate(trials_batches):
+                trials_params = self._setTrialsBatch(
+                    model=model, params=params,
+                    get_measurements_fn=get_measurements_fn,
+                    trials_indices=trials_indices,
+                    trials_n_ind_points=trials_n_ind_points)
+                maxRes = None
+                for batch_iter in range(n_iter_per_batch):
+                    for step in steps:
+                        if not optim_params["{:s}_estimate".format(step)]:
+                            continue
+                        try:
+                            stepStartTime = time.time()
+                            with torch.profiler.record_function(step):
+                                maxRes = functions_for_steps[step](
+                                    model=model,
+                                    optim_params=optim_params[
+                                        "{:s}_optim_params".format(step)])
+                            stepElapsedTime = time.time() - stepStartTime
+                        except Exception as e:
+                            stack_trace = traceback.format_exc()
+                            print(e)
+                            print(stack_trace)
+                            terminationInfo = \
+                                svGPFA.stats.svEM.ErrorTerminationInfo(
+                                    message=("Error occured while processing "
+                                             f"{step} in minibatch "
+                                             f"{batch_index+1} of iteration "
+                                             f"{iter}"),
+                                    error=e, stack_trace=stack_trace)
+                            return lowerBoundHist, elapsedTimeHist, \
+                                terminationInfo, iterationsModelParams
+                        if verbose:
+                            out.write("Iteration {:02d}, minibatch {:d}/{:d}, "
+                                      "{:s} end: {:f}, niter: {:d}, nfeval: "
+                                      "{:d}\n".format(
+                                          iter, batch_index+1,
+                                          len(trials_batches), step,
+                                          maxRes["lowerBound"],
+                                          maxRes["niter"], maxRes["nfeval"]))
+                        for callback in step_callbacks:
+                            callback(iteration=iter, step=step,
+                                     elapsed_time=stepElapsedTime,
+                                     maxRes=maxRes, minibatch=batch_index)
+                if maxRes is None:
+                    # all steps are disabled
+                    maxRes = {"lowerBound": model.eval()}
+                update_trials_params(params=params,
+                                     trials_params=trials_params,
+                                     trials_indices=trials_indices)
+                lowerBound += maxRes["lowerBound"].item()
+            if getIterationModelParamsFn is not None:
+                iterationsModelParams[iter] = \
+                    getIterationModelParamsFn(model=model)
+                if printIterationModelParams:
+                    print(iterationsModelParams[iter])
+            elapsedTimeHist.append(time.time()-startTime)
+            lowerBoundHist.append(lowerBound)
+            if verbose:
+                out.write("Iteration {:02d} end: {:f}\n".format(iter,
+                                                                lowerBound))
+            for callback in iteration_callbacks:
+                terminationInfo = callback(
+                    iteration=iter, model=model,
+                    lowerBoundHist=lowerBoundHist,
+                    elapsedTimeHist=elapsedTimeHist,
+                    iterationsModelParams=iterationsModelParams)
+                if terminationInfo is not None:
+                    return lowerBoundHist, elapsedTimeHist, \
+                        terminationInfo, iterationsModelParams
+            iter += 1
+        terminationInfo = svGPFA.stats.svEM.TerminationInfo(
+            "Maximum number of iterations ({:d}) reached".format(
+                optim_params["em_max_iter"]))
+        return lowerBoundHist, elapsedTimeHist, terminationInfo, \
+            iterationsModelParams
+
+    def _setTrialsBatch(self, model, params, get_measurements_fn,
+                        trials_indices, trials_n_ind_points=None):
+        if trials_n_ind_points is None:
+            n_ind_points = None
+        else:
+            n_ind_points = int(trials_n_ind_points[trials_indices[0]])
+        trials_params = subset_trials_params(params=params,
+                                             trials_indices=trials_indices,
+                                             n_ind_points=n_ind_points)
+        model.setParamsAndData(
+            measurements=get_measurements_fn(trials_indices=trials_indices),
+            initial_params=trials_params["initial_params"],
+            eLLCalculationParams=trials_params["ell_calculation_params"],
+            priorCovRegParam=params["optim_params"]["prior_cov_reg_param"])
+        return trials_params
+
+
+def get_trials_batches(n_trials, batch_size, schedule="sequential",
+                       rng=None, trials_groups=None):
+    """Splits the indices of ``n_trials`` trials into minibatches of at most
+    ``batch_size`` trials, following ``schedule`` (sequential or
+    shuffled). Indices within a minibatch are sorted.
+
+    If ``trials_groups`` (the group label of every trial) is given, every
+    minibatch only contains trials of one group. With the shuffled schedule
+    the order of the minibatches of all groups is also shuffled."""
+    if schedule not in ("sequential", "shuffled"):
+        raise ValueError("Invalid schedule={:s}. Supported values are "
+                         "sequential and shuffled".format(schedule))
+    if schedule == "shuffled" and rng is None:
+        rng = np.random.default_rng()
+    if trials_groups is None:
+        groups_trials = [np.arange(n_trials)]
+    else:
+        trials_groups = np.asarray(trials_groups)
+        groups_trials = [np.flatnonzero(trials_groups == group)
+                         for group in np.unique(trials_groups)]
+    trials_batches = []
+    for group_trials in groups_trials:
+        if schedule == "shuffled":
+            group_trials = rng.permutation(group_trials)
+        trials_batches.extend(
+            [np.sort(group_trials[i:i+batch_size])
+             for i in range(0, len(group_trials), batch_size)])
+    if schedule == "shuffled" and len(groups_trials) > 1:
+        trials_batches = [trials_batches[i] for i in
+                          rng.permutation(len(trials_batches))]
+    return trials_batches
+
+
+def subset_trials_params(params, trials_indices, n_ind_points=None):
+    """Returns the parameters in ``params`` of the trials at
+    ``trials_indices``. Per-trial parameters are copied, while embedding,
+    kernels and optimization parameters are shared with ``params``.
+
+    If ``n_ind_points`` is given, only the leading ``n_ind_points``
+    inducing points of the trials are returned. Since Cholesky vectors list
+    the lower-triangular entries row by row, their leading
+    ``n_ind_points * (n_ind_points + 1) / 2`` entries represent the leading
+    block of the covariance."""
+    trials_indices = torch.as_tensor(trials_indices, dtype=torch.long)
+    if n_ind_points is None:
+        n_ind_points = n_chol_vecs = None
+    else:
+        n_chol_vecs = n_ind_points * (n_ind_points + 1) // 2
+    posterior_on_latents = params["initial_params"]["posterior_on_latents"]
+    posterior_on_ind_points = posterior_on_latents["posterior_on_ind_points"]
+    kms_params = posterior_on_latents["kernels_matrices_store"]
+    quad_params = params["ell_calculation_params"]
+    trials_params = {
+        "initial_params": {
+            "posterior_on_latents": {
+                "posterior_on_ind_points": {
+                    "mean": [mean[trials_indices, :n_ind_points] for mean
+                             in posterior_on_ind_points["mean"]],
+                    "cholVecs": [chol_vecs[trials_indices, :n_chol_vecs]
+                                 for chol_vecs in
+                                 posterior_on_ind_points["cholVecs"]],
+                },
+                "kernels_matrices_store": {
+                    "kernels_params0": kms_params["kernels_params0"],
+                    "inducing_points_locs0":
+                        [locs[trials_indices, :n_ind_points] for locs in
+                         kms_params["inducing_points_locs0"]],
+                },
+            },
+            "embedding": params["initial_params"]["embedding"],
+        },
+        "ell_calculation_params": {
+            "leg_quad_points":
+                quad_params["leg_quad_points"][trials_indices],
+            "leg_quad_weights":
+                quad_params["leg_quad_weights"][trials_indices],
+        },
+        "optim_params": params["optim_params"],
+    }
+    return trials_params
+
+
+def update_trials_params(params, trials_params, trials_indices):
+    """Copies the per-trial parameters in ``trials_params``, as returned by
+    :func:`subset_trials_params`, back into ``params`` (into the leading
+    inducing points of the trials, if ``trials_params`` holds fewer
+    inducing points than ``params``)."""
+    trials_indices = torch.as_tensor(trials_indices, dtype=torch.long)
+    posterior_on_latents = params["initial_params"]["posterior_on_latents"]
+    trials_posterior_on_latents = \
+        trials_params["initial_params"]["posterior_on_latents"]
+    with torch.no_grad():
+        for key in ["mean", "cholVecs"]:
+            for param, trials_param in zip(
+                    posterior_on_latents["posterior_on_ind_points"][key],
+                    trials_posterior_on_latents["posterior_on_ind_points"][
+                        key]):
+                param[trials_indices, :trials_param.shape[1]] = \
+                    trials_param
+        for param, trials_param in zip(
+                posterior_on_latents["kernels_matrices_store"][
+                    "inducing_points_locs0"],
+                trials_posterior_on_latents["kernels_matrices_store"][
+                    "inducing_points_locs0"]):
+            param[trials_indices, :trials_param.shape[1]] = trials_param
+
+
+class Checkpointer:
+    """Iteration callback that saves the model and the maximization history
+    to ``checkpoint_filename`` every ``every_n_iter`` EM iterations and/or
+    every ``every_n_secs`` seconds.
+
+    ``extra_state`` is a dictionary stored along with each checkpoint (e.g.,
+    the optimization parameters and the estimation result number).
+
+    LBFGS optimizers are rebuilt at every EM step, so no optimizer state
+    survives across iterations and a checkpoint fully describes the
+    maximization.
+    """
+
+    def __init__(self, checkpoint_filename, every_n_iter=None,
+                 every_n_secs=None, extra_state=None):
+        self._checkpoint_filename = checkpoint_filename
+        self._every_n_iter = every_n_iter
+        self._every_n_secs = every_n_secs
+        if extra_state is None:
+            extra_state = {}
+        self._extra_state = extra_state
+        self._last_save_time = time.time()
+
+    def __call__(self, iteration, model, lowerBoundHist, elapsedTimeHist,
+                 iterationsModelParams):
+        save_now = False
+        if self._every_n_iter is not None and \
+                iteration % self._every_n_iter == 0:
+            save_now = True
+        if self._every_n_secs is not None and \
+                time.time() - self._last_save_time >= self._every_n_secs:
+            save_now = True
+        if save_now:
+            self.save(iteration=iteration, model=model,
+                      lowerBoundHist=lowerBoundHist,
+                      elapsedTimeHist=elapsedTimeHist,
+                      iterationsModelParams=iterationsModelParams)
+        return None
+
+    def save(self, iteration, model, lowerBoundHist, elapsedTimeHist,
+             iterationsModelParams):
+        checkpoint = {"iteration": iteration,
+                      "model": model,
+                      "lowerBoundHist": lowerBoundHist,
+                      "elapsedTimeHist": elapsedTimeHist,
+                      "iterationsModelParams": iterationsModelParams}
+        checkpoint.update(self._extra_state)
+        # write to a temporary file and rename it so that a preemption while
+        # saving never corrupts the previous checkpoint
+        with open(f"{self._checkpoint_filename}.tmp", "wb") as f:
+            pickle.dump(checkpoint, f)
+        os.replace(f"{self._checkpoint_filename}.tmp",
+                   self._checkpoint_filename)
+        self._last_save_time = time.time()
+        print(f"Saved checkpoint of iteration {iteration} to "
+              f"{self._checkpoint_filename}")
+
+    def remove(self):
+        """Deletes the checkpoint, if any, once the estimation results are
+        saved."""
+        if os.path.exists(self._checkpoint_filename):
+            os.remove(self._checkpoint_filename)
+            print(f"Removed checkpoint {self._checkpoint_filename}")
+
+
+class ConvergenceTerminationInfo(svGPFA.stats.svEM.TerminationInfo):
+    """Termination of a maximization stopped by a
+    :class:`ConvergenceMonitor`, with the name of the stopping ``criterion``
+    (``relative_improvement``, ``max_elapsed_secs`` or ``max_step_secs``)
+    and the ``iteration`` after which it stopped."""
+
+    def __init__(self, message, criterion, iteration):
+        super().__init__(message=message)
+        self._criterion = criterion
+        self._iteration = iteration
+
+    @property
+    def criterion(self):
+        return self._criterion
+
+    @property
+    def iteration(self):
+        return self._iteration
+
+
+class ConvergenceMonitor:
+    """Iteration callback that stops a maximization, after a completed EM
+    iteration, as soon as any of its enabled criteria (those not None) is
+    met:
+
+    * ``rel_tol``: the relative improvement of the lower bound over the last
+      ``window`` iterations,
+      ``(lowerBoundHist[-1] - lowerBoundHist[-1-window]) /
+      abs(lowerBoundHist[-1-window])``, fell below ``rel_tol``, after at
+      least ``min_iter`` iterations.
+    * ``max_elapsed_secs``: the elapsed time reached ``max_elapsed_secs`` or
+      would exceed it after one more iteration as long as the last one.
+    * ``max_step_secs``: an EM step of the last iteration took longer than
+      ``max_step_secs`` seconds.
+
+    :meth:`step_callback` should be passed as a step callback for
+    ``max_step_secs`` to be enforced. Elapsed times and the lower bound
+    history continue those of resumed maximizations.
+
+    Returns a :class:`ConvergenceTerminationInfo`, so that the model is saved
+    as after any other termination.
+    """
+
+    def __init__(self, rel_tol=None, window=5, min_iter=1,
+                 max_elapsed_secs=None, max_step_secs=None):
+        self._rel_tol = rel_tol
+        self._window = window
+        self._min_iter = min_iter
+        self._max_elapsed_secs = max_elapsed_secs
+        self._max_step_secs = max_step_secs
+        self._slow_step = None
+
+    def get_params(self):
+        """Returns the monitor settings, e.g., to save them with the
+        estimation metadata."""
+        params = {"rel_tol": self._rel_tol, "window": self._window,
+                  "min_iter": self._min_iter,
+                  "max_elapsed_secs": self._max_elapsed_secs,
+                  "max_step_secs": self._max_step_secs}
+        return params
+
+    def step_callback(self, iteration, step, elapsed_time, maxRes,
+                      minibatch=None):
+        if self._max_step_secs is not None and self._slow_step is None and \
+                elapsed_time > self._max_step_secs:
+            self._slow_step = (step, elapsed_time)
+
+    def __call__(self, iteration, model, lowerBoundHist, elapsedTimeHist,
+                 iterationsModelParams):
+        if self._slow_step is not None:
+            step, elapsed_time = self._slow_step
+            return ConvergenceTerminationInfo(
+                message=(f"Step {step} of iteration {iteration} took "
+                         f"{elapsed_time:.2f} secs, more than the "
+                         f"{self._max_step_secs} secs step budget"),
+                criterion="max_step_secs", iteration=iteration)
+        if self._max_elapsed_secs is not None:
+            iteration_time = elapsedTimeHist[-1] - elapsedTimeHist[-2]
+            if elapsedTimeHist[-1] + iteration_time > self._max_elapsed_secs:
+                return ConvergenceTerminationInfo(
+                    message=(f"Elapsed time ({elapsedTimeHist[-1]:.2f} "
+                             f"secs) after iteration {iteration} leaves no "
+                             f"time for another iteration within the "
+                             f"{self._max_elapsed_secs} secs budget"),
+                    criterion="max_elapsed_secs", iteration=iteration)
+        if self._rel_tol is not None and iteration >= self._min_iter and \
+                len(lowerBoundHist) > self._window:
+            previous_lower_bound = lowerBoundHist[-1-self._window]
+            rel_improvement = (lowerBoundHist[-1] - previous_lower_bound) / \
+                abs(previous_lower_bound)
+            if rel_improvement < self._rel_tol:
+                return ConvergenceTerminationInfo(
+                    message=(f"Relative lower bound improvement "
+                             f"({rel_improvement:.3g}) over the last "
+                             f"{self._window} iterations below "
+                             f"{self._rel_tol} after iteration "
+                             f"{iteration}"),
+                    criterion="relative_improvement", iteration=iteration)
+        return None
+
+
+def load_checkpoint(checkpoint_filename):
+    with open(checkpoint_filename, "rb") as f:
+        checkpoint = pickle.load(f)
+    return checkpoint
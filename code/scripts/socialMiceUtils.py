@@ -1,4 +1,5 @@
 
+import operator
 import numpy as np
 import plotly.graph_objs as go
 
@@ -8,8 +9,6 @@ def epoch_neuron_spikes_times(neuron_spikes_times, epoch_times,
     epoch_start_indices = np.searchsorted(neuron_spikes_times,
                                           epoch_start_times)
     epoch_end_indices = np.searchsorted(neuron_spikes_times, epoch_end_times)
-    epoch_end_indices[epoch_end_indices == len(neuron_spikes_times)] = \
-        len(neuron_spikes_times) - 1
     n_trials = len(epoch_start_indices)
     epoched_spikes_times = \
         [(neuron_spikes_times[epoch_start_indices[r]:epoch_end_indices[r]] -
@@ -17,6 +16,70 @@ def epoch_neuron_spikes_times(neuron_spikes_times, epoch_times,
     return epoched_spikes_times
 
 
+def epoch_units_spikes_times(units_spikes_times, units_offsets, epoch_times,
+                             epoch_start_times, epoch_end_times):
+    """Epochs the spikes times of all units in a single pass.
+
+    ``units_spikes_times`` holds the sorted spikes times of all units
+    concatenated, with the spikes of unit ``n`` in
+    ``units_spikes_times[units_offsets[n]:units_offsets[n+1]]``.
+
+    Returns ``(epoched_spikes_times, epoched_offsets)``, a ragged structure
+    where the spikes of trial ``r`` and unit ``n`` are
+    ``epoched_spikes_times[epoched_offsets[i]:epoched_offsets[i+1]]``, with
+    ``i = r*n_units+n``.
+    """
+    units_spikes_times = np.asarray(units_spikes_times, dtype=np.float64)
+    units_offsets = np.asarray(units_offsets, dtype=np.int64)
+    epoch_times = np.asarray(epoch_times, dtype=np.float64)
+    epoch_start_times = np.asarray(epoch_start_times, dtype=np.float64)
+    epoch_end_times = np.asarray(epoch_end_times, dtype=np.float64)
+    n_units = len(units_offsets) - 1
+    n_trials = len(epoch_times)
+
+    # complex numbers are sorted lexicographically (real part first), so
+    # keying every spike by (unit index, spike time) gives one sorted array
+    # that a single searchsorted can query for all (trial, unit) windows
+    units_indices = np.repeat(np.arange(n_units), np.diff(units_offsets))
+    keys = np.empty(len(units_spikes_times), dtype=np.complex128)
+    keys.real = units_indices
+    keys.imag = units_spikes_times
+
+    # NaNs sort after every unit; a missing start time yields an empty
+    # epoch and a missing end time keeps all spikes after the start, as in
+    # epoch_neuron_spikes_times
+    queries = np.empty(n_trials * n_units, dtype=np.complex128)
+    queries.real = np.tile(np.arange(n_units), n_trials)
+    queries.imag = np.repeat(np.nan_to_num(epoch_start_times, nan=np.inf),
+                             n_units)
+    start_indices = np.searchsorted(keys, queries)
+    queries.imag = np.repeat(np.nan_to_num(epoch_end_times, nan=np.inf),
+                             n_units)
+    end_indices = np.searchsorted(keys, queries)
+    counts = np.maximum(end_indices - start_indices, 0)
+
+    epoched_offsets = np.zeros(n_trials * n_units + 1, dtype=np.int64)
+    np.cumsum(counts, out=epoched_offsets[1:])
+    gather_indices = np.arange(epoched_offsets[-1]) + \
+        np.repeat(start_indices - epoched_offsets[:-1], counts)
+    epoched_spikes_times = units_spikes_times[gather_indices] - \
+        np.repeat(np.repeat(epoch_times, n_units), counts)
+    return epoched_spikes_times, epoched_offsets
+
+
+def epoched_spikes_times_to_lists(epoched_spikes_times, epoched_offsets,
+                                  n_trials, n_units):
+    """Converts the ragged output of epoch_units_spikes_times to the nested
+    ``spikes_times[trial][unit]`` lists used by svGPFA."""
+    all_spikes_times = np.asarray(epoched_spikes_times).tolist()
+    offsets = np.asarray(epoched_offsets).tolist()
+    spikes_times = [[all_spikes_times[offsets[r*n_units+n]:
+                                      offsets[r*n_units+n+1]]
+                     for n in range(n_units)]
+                    for r in range(n_trials)]
+    return spikes_times
+
+
 def getSpikesTimesPlotOneNeuron(spikes_times,
                                 sorting_times,
                                 neuron_index, title,
@@ -33,6 +96,13 @@ def getSpikesTimesPlotOneNeuron(spikes_times,
                                 xlabel="Time (sec)", ylabel="Trial",
                                 event_line_color="rgba(0, 0, 255, 0.2)",
                                 event_line_width=5, spikes_marker_size=9):
+    """Plots the spikes times of neuron ``neuron_index`` in all trials.
+
+    All spikes of the same color are drawn in a single trace, and all marked
+    events of the same color and marker in another one, with the trial of
+    every point in its hover text, so the number of traces does not grow
+    with the number of trials.
+    """
     if sorting_times is not None:
         argsort = np.argsort(sorting_times)
         spikes_times = [spikes_times[r] for r in argsort]
@@ -42,49 +112,74 @@ def getSpikesTimesPlotOneNeuron(spikes_times,
         for i, behavioral_times in enumerate(behavioral_times_col):
             sorted_behavioral_times = [behavioral_times[r] for r in argsort]
             behavioral_times_col[i] = sorted_behavioral_times
+        if marked_events_times is not None:
+            marked_events_times = [marked_events_times[r] for r in argsort]
+            marked_events_colors = [marked_events_colors[r] for r in argsort]
+            marked_events_markers = [marked_events_markers[r]
+                                     for r in argsort]
+            align_event = [align_event[r] for r in argsort]
+        if trials_colors is not None:
+            trials_colors = [trials_colors[r] for r in argsort]
     n_trials = len(trials_ids)
+    if trials_colors is None:
+        trials_colors = [default_trial_color] * n_trials
+    trials_labels = ["{:02d}".format(trials_ids[r]) for r in range(n_trials)]
+
+    # np.atleast_1d is a workaround because if a trial contains only one
+    # spike spikes_times[r][neuron_index] does not respond to the len
+    # function
+    trials_spikes_times = [np.atleast_1d(np.asarray(spikes_times[r][neuron_index],
+                                                    dtype=np.float64))
+                           for r in range(n_trials)]
     fig = go.Figure()
-    for r in range(n_trials):
-        spikes_times_trial_neuron = spikes_times[r][neuron_index]
-        # workaround because if a trial contains only one spike spikes_times[n]
-        # does not respond to the len function
-        if len(spikes_times_trial_neuron) == 1:
-            spikes_times_trial_neuron = [spikes_times_trial_neuron]
-        if trials_colors is not None:
-            spikes_color = trials_colors[r]
-        else:
-            spikes_color = default_trial_color
-        trial_label = "{:02d}".format(trials_ids[r])
-        feedback_type = "{:d}".format(int(feedback_types[r]))
+    for spikes_color in dict.fromkeys(trials_colors):
+        color_trials = [r for r in range(n_trials)
+                        if trials_colors[r] == spikes_color]
+        counts = [len(trials_spikes_times[r]) for r in color_trials]
+        if sum(counts) == 0:
+            continue
+        color_texts = [f"Trial {trials_labels[r]}<br>"
+                       f"Feedback {int(feedback_types[r]):d}"
+                       for r in color_trials]
         trace = go.Scatter(
-            x=spikes_times_trial_neuron,
-            y=r*np.ones(len(spikes_times_trial_neuron)),
+            x=np.concatenate([trials_spikes_times[r] for r in color_trials]),
+            y=np.repeat(color_trials, counts),
             mode="markers",
             marker=dict(size=spikes_marker_size, color=spikes_color,
                         symbol=spikes_symbol),
-            name="trial {:s}".format(trial_label),
-            legendgroup=f"trial{trial_label}",
+            name=f"spikes {spikes_color}",
             showlegend=False,
-            text=[f"Trial {trial_label}<br>Feedback {feedback_type}"]*len(spikes_times_trial_neuron),
+            text=np.repeat(color_texts, counts),
             hovertemplate="Time %{x}<br>%{text}",
         )
         fig.add_trace(trace)
-        if marked_events_times is not None:
-            marked_events_times_centered = marked_events_times[r]-align_event[r]
-            n_marked_events = len(marked_events_times[r])
-            for i in range(n_marked_events):
-                trace_marker = go.Scatter(x=[marked_events_times_centered[i]],
-                                          y=[r],
-                                          marker=dict(color=marked_events_colors[r][i],
-                                                      symbol=marked_events_markers[r][i],
-                                                      size=marked_size),
-                                          name="trial {:s}".format(trial_label),
-                                          text=[trial_label],
-                                          hovertemplate="Time %{x}<br>" + "Trial %{text}",
-                                          mode="markers",
-                                          legendgroup=f"trial{trial_label}",
-                                          showlegend=False)
-                fig.add_trace(trace_marker)
+    if marked_events_times is not None:
+        # one trace per (color, marker) event type
+        events_points = {}
+        for r in range(n_trials):
+            marked_events_times_centered = \
+                np.asarray(marked_events_times[r]) - align_event[r]
+            for i in range(len(marked_events_times[r])):
+                event_points = events_points.setdefault(
+                    (marked_events_colors[r][i], marked_events_markers[r][i]),
+                    {"x": [], "y": [], "text": []})
+                event_points["x"].append(marked_events_times_centered[i])
+                event_points["y"].append(r)
+                event_points["text"].append(trials_labels[r])
+        for (event_color, event_marker), event_points in \
+                events_points.items():
+            trace_marker = go.Scatter(x=event_points["x"],
+                                      y=event_points["y"],
+                                      marker=dict(color=event_color,
+                                                  symbol=event_marker,
+                                                  size=marked_size),
+                                      name=f"event {event_color} "
+                                           f"{event_marker}",
+                                      text=event_points["text"],
+                                      hovertemplate="Time %{x}<br>" + "Trial %{text}",
+                                      mode="markers",
+                                      showlegend=False)
+            fig.add_trace(trace_marker)
     for i, behavioral_times in enumerate(behavioral_times_col):
         trace = go.Scatter(x=behavioral_times, y=np.arange(n_trials),
                            name=behavioral_times_labels[i])
@@ -102,27 +197,42 @@ def getSpikesTimesPlotOneNeuron(spikes_times,
 
 def subset_trials_ids_data(selected_trials_ids, trials_ids, spikes_times,
                            trials_start_times, trials_end_times):
-    indices = np.nonzero(np.in1d(trials_ids, selected_trials_ids))[0]
+    """Subsets nested ``spikes_times[trial][unit]`` lists, and their trials
+    start and end times, to the trials with ids in ``selected_trials_ids``.
+    The subset lists share the spikes times of ``spikes_times``; to subset
+    an epoched spikes store use :func:`epochedSpikesStore.subset_ids`."""
+    indices = np.nonzero(np.isin(trials_ids, selected_trials_ids))[0]
     spikes_times_subset = [spikes_times[i] for i in indices]
-    trials_start_times_subset = [trials_start_times[i] for i in indices]
-    trials_end_times_subset = [trials_end_times[i] for i in indices]
+    trials_start_times_subset = np.asarray(trials_start_times)[indices]
+    trials_end_times_subset = np.asarray(trials_end_times)[indices]
 
     return spikes_times_subset, trials_start_times_subset, trials_end_times_subset
 
 def subset_clusters_ids_data(selected_clusters_ids, clusters_ids,
                              spikes_times):
-    indices = np.nonzero(np.in1d(clusters_ids, selected_clusters_ids))[0]
-    n_trials = len(spikes_times)
-    spikes_times_subset = [[spikes_times[r][i] for i in indices]
-                           for r in range(n_trials)]
+    """Subsets nested ``spikes_times[trial][unit]`` lists to the units with
+    ids in ``selected_clusters_ids``."""
+    indices = np.nonzero(np.isin(clusters_ids, selected_clusters_ids))[0]
+    if len(indices) == 0:
+        return [[] for trial_spikes_times in spikes_times]
+    get_units = operator.itemgetter(*indices)
+    if len(indices) == 1:
+        spikes_times_subset = [[get_units(trial_spikes_times)]
+                               for trial_spikes_times in spikes_times]
+    else:
+        spikes_times_subset = [list(get_units(trial_spikes_times))
+                               for trial_spikes_times in spikes_times]
 
     return spikes_times_subset
 
 def subset_info_dict(info, ids):
+    """Subsets the one-dimensional arrays of ``info`` to the elements at
+    ``ids``, with a single indexing operation per array."""
+    ids = np.asarray(ids, dtype=np.int64)
     subset_info = dict()
     for info_key in info.keys():
         if info[info_key].ndim == 1:
-            subset_info[info_key] = [info[info_key][i] for i in ids]
+            subset_info[info_key] = info[info_key][ids]
         else:
             subset_info[info_key] = info[info_key]
     return subset_info
@@ -0,0 +1,131 @@
+import os
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+
+def get_unit_id(spikes_filename):
+    unit_id = int(spikes_filename[(spikes_filename.find("_")+1):
+                                  spikes_filename.find(".")])
+    return unit_id
+
+
+def read_unit_spikes_times(spikes_filename):
+    unit_spikes_times = pd.read_csv(spikes_filename).to_numpy(
+        dtype=np.float64).ravel()
+    return unit_spikes_times
+
+
+def get_spikes_filenames(spikes_dirname):
+    spikes_filenames = sorted(
+        f for f in os.listdir(spikes_dirname)
+        if os.path.isfile(os.path.join(spikes_dirname, f)))
+    return spikes_filenames
+
+
+def get_files_stats(spikes_dirname, spikes_filenames):
+    stats = [os.stat(os.path.join(spikes_dirname, f))
+             for f in spikes_filenames]
+    mtimes = np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64)
+    sizes = np.array([stat.st_size for stat in stats], dtype=np.int64)
+    return mtimes, sizes
+
+
+def read_units_spikes_times(spikes_dirname, spikes_filenames, n_workers=None,
+                            use_processes=False):
+    """Reads the spikes times files of all units concurrently.
+
+    Returns ``(units_spikes_times, units_offsets)``, with the spikes times of
+    all units concatenated in one float64 array and the spikes of unit ``n``
+    in ``units_spikes_times[units_offsets[n]:units_offsets[n+1]]``.
+    """
+    if use_processes:
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    else:
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    filenames = [os.path.join(spikes_dirname, f) for f in spikes_filenames]
+    with executor_class(max_workers=n_workers) as executor:
+        spikes_times_by_unit = list(executor.map(read_unit_spikes_times,
+                                                 filenames))
+    units_offsets = np.zeros(len(spikes_times_by_unit) + 1, dtype=np.int64)
+    np.cumsum([len(times) for times in spikes_times_by_unit],
+              out=units_offsets[1:])
+    if len(spikes_times_by_unit) > 0:
+        units_spikes_times = np.concatenate(spikes_times_by_unit)
+    else:
+        units_spikes_times = np.empty(0, dtype=np.float64)
+    return units_spikes_times, units_offsets
+
+
+def load_cache(cache_spikes_filename, cache_index_filename, spikes_filenames,
+               mtimes, sizes):
+    if not os.path.exists(cache_spikes_filename) or \
+            not os.path.exists(cache_index_filename):
+        return None
+    with np.load(cache_index_filename) as index:
+        if index["spikes_filenames"].tolist() != spikes_filenames or \
+                not np.array_equal(index["mtimes"], mtimes) or \
+                not np.array_equal(index["sizes"], sizes):
+            return None
+        units_offsets = index["units_offsets"]
+    units_spikes_times = np.load(cache_spikes_filename, mmap_mode="r")
+    if len(units_spikes_times) != units_offsets[-1]:
+        return None
+    return units_spikes_times, units_offsets
+
+
+def save_cache(cache_spikes_filename, cache_index_filename, spikes_filenames,
+               mtimes, sizes, units_spikes_times, units_offsets):
+    # write to temporary files and rename them so that an interrupted run
+    # never leaves a partially written cache behind
+    with open(f"{cache_spikes_filename}.tmp", "wb") as f:
+        np.save(f, units_spikes_times)
+    with open(f"{cache_index_filename}.tmp", "wb") as f:
+        np.savez(f, spikes_filenames=np.array(spikes_filenames, dtype=str),
+                 mtimes=mtimes, sizes=sizes, units_offsets=units_offsets)
+    os.replace(f"{cache_spikes_filename}.tmp", cache_spikes_filename)
+    os.replace(f"{cache_index_filename}.tmp", cache_index_filename)
+
+
+def load_units_spikes_times(spikes_dirname, cache_filename_pattern=None,
+                            n_workers=None, use_processes=False):
+    """Loads the spikes times of all units in ``spikes_dirname``.
+
+    If ``cache_filename_pattern`` is given (with one ``{:s}`` placeholder for
+    the extension) the spikes times of all units are stored in a
+    consolidated cache, which is reused, memory mapped, as long as the unit
+    files and their modification times and sizes are unchanged.
+
+    Returns ``(units_ids, units_spikes_times, units_offsets)``.
+    """
+    spikes_filenames = get_spikes_filenames(spikes_dirname=spikes_dirname)
+    units_ids = [get_unit_id(f) for f in spikes_filenames]
+    if cache_filename_pattern is None:
+        units_spikes_times, units_offsets = read_units_spikes_times(
+            spikes_dirname=spikes_dirname, spikes_filenames=spikes_filenames,
+            n_workers=n_workers, use_processes=use_processes)
+        return units_ids, units_spikes_times, units_offsets
+
+    cache_spikes_filename = cache_filename_pattern.format("spikes.npy")
+    cache_index_filename = cache_filename_pattern.format("index.npz")
+    mtimes, sizes = get_files_stats(spikes_dirname=spikes_dirname,
+                                    spikes_filenames=spikes_filenames)
+    cached = load_cache(cache_spikes_filename=cache_spikes_filename,
+                        cache_index_filename=cache_index_filename,
+                        spikes_filenames=spikes_filenames, mtimes=mtimes,
+                        sizes=sizes)
+    if cached is not None:
+        print(f"Loaded cached spikes times from {cache_spikes_filename}")
+        units_spikes_times, units_offsets = cached
+        return units_ids, units_spikes_times, units_offsets
+
+    units_spikes_times, units_offsets = read_units_spikes_times(
+        spikes_dirname=spikes_dirname, spikes_filenames=spikes_filenames,
+        n_workers=n_workers, use_processes=use_processes)
+    save_cache(cache_spikes_filename=cache_spikes_filename,
+               cache_index_filename=cache_index_filename,
+               spikes_filenames=spikes_filenames, mtimes=mtimes, sizes=sizes,
+               units_spikes_times=units_spikes_times,
+               units_offsets=units_offsets)
+    print(f"Saved cached spikes times to {cache_spikes_filename}")
+    return units_ids, units_spikes_times, units_offsets
@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+def generate_session(n_units, n_trials, min_rate=0.5, max_rate=5.0,
+                     min_door_open_delay=1.0, max_door_open_delay=3.0,
+                     min_trial_duration=4.0, max_trial_duration=8.0,
+                     min_inter_trial_interval=1.0,
+                     max_inter_trial_interval=3.0, random_seed=None):
+    """Generates a synthetic session of ``n_trials`` consecutive trials with
+    homogeneous Poisson spike trains for ``n_units`` units, with rates drawn
+    uniformly between ``min_rate`` and ``max_rate`` spikes per second.
+
+    Trial ``r`` starts at ``TrialOn[r]``, its door opens
+    ``min_door_open_delay`` to ``max_door_open_delay`` seconds later and it
+    ends ``min_trial_duration`` to ``max_trial_duration`` seconds after it
+    starts. Consecutive trials are separated by ``min_inter_trial_interval``
+    to ``max_inter_trial_interval`` seconds.
+
+    Returns a dictionary with keys ``units_ids``, ``units_spikes_times``,
+    ``units_offsets`` (as returned by
+    :func:`spikesTimesLoader.load_units_spikes_times`), ``units_rates`` and
+    ``trials_info`` (a data frame with columns ``TrialOn``, ``DoorOpen`` and
+    ``TrialOff``).
+    """
+    rng = np.random.default_rng(random_seed)
+    trials_durations = rng.uniform(min_trial_duration, max_trial_duration,
+                                   size=n_trials)
+    inter_trial_intervals = rng.uniform(min_inter_trial_interval,
+                                        max_inter_trial_interval,
+                                        size=n_trials)
+    trials_on = np.cumsum(inter_trial_intervals) + \
+        np.concatenate(([0.0], np.cumsum(trials_durations[:-1])))
+    trials_off = trials_on + trials_durations
+    doors_open = trials_on + rng.uniform(min_door_open_delay,
+                                         min(max_door_open_delay,
+                                             min_trial_duration),
+                                         size=n_trials)
+    trials_info = pd.DataFrame({"TrialOn": trials_on,
+                                "DoorOpen": doors_open,
+                                "TrialOff": trials_off})
+    session_duration = trials_off[-1] + max_inter_trial_interval
+
+    units_rates = rng.uniform(min_rate, max_rate, size=n_units)
+    units_n_spikes = rng.poisson(units_rates * session_duration)
+    units_offsets = np.zeros(n_units + 1, dtype=np.int64)
+    np.cumsum(units_n_spikes, out=units_offsets[1:])
+    units_spikes_times = rng.uniform(0.0, session_duration,
+                                     size=units_offsets[-1])
+    for n in range(n_units):
+        units_spikes_times[units_offsets[n]:units_offsets[n+1]].sort()
+    session = {"units_ids": list(range(n_units)),
+               "units_spikes_times": units_spikes_times,
+               "units_offsets": units_offsets,
+               "units_rates": units_rates,
+               "trials_info": trials_info}
+    return session
+
+
+def save_session(session, data_dirname, subject_name, region,
+                 trials_info_filename="behavior_data.csv",
+                 spikes_filename_pattern="unit_{:d}.csv"):
+    """Saves a session generated with :func:`generate_session` in the layout
+    read by ``doEpochSpikesTimes.py``: the trials information in
+    ``data_dirname/subject_name/trials_info_filename`` and the spikes times
+    of every unit in a one-column CSV file in
+    ``data_dirname/subject_name/region``.
+
+    Returns the name of the directory with the units spikes times files.
+    """
+    subject_dirname = os.path.join(data_dirname, subject_name)
+    spikes_dirname = os.path.join(subject_dirname, region)
+    os.makedirs(spikes_dirname, exist_ok=True)
+    session["trials_info"].to_csv(os.path.join(subject_dirname,
+                                               trials_info_filename),
+                                  index=False)
+    units_spikes_times = session["units_spikes_times"]
+    units_offsets = session["units_offsets"]
+    for n, unit_id in enumerate(session["units_ids"]):
+        np.savetxt(os.path.join(spikes_dirname,
+                                spikes_filename_pattern.format(unit_id)),
+                   units_spikes_times[units_offsets[n]:units_offsets[n+1]],
+                   fmt="%.6f", header="spike_times", comments="")
+    return spikes_dirname
@@ -0,0 +1,149 @@
+import pickle
+import numpy as np
+import torch
+
+import svGPFA.utils.miscUtils
+
+import modelExport
+
+
+def load_estimated_params(model_save_filename):
+    """Loads the estimated parameters of a model exported with
+    :func:`modelExport.export_model` (a ``.npz`` file) or of the results
+    saved by :func:`estimationUtils.save_estimation_results` in
+    ``model_save_filename``.
+
+    Returns the dictionary returned by
+    :func:`modelExport.get_estimated_params`, with additional keys
+    ``trials_ids`` and ``units_ids`` (None for results saved without them).
+    """
+    if model_save_filename.endswith(".npz"):
+        exported_model = modelExport.load(export_filename=model_save_filename)
+        estimated_params = exported_model.get_estimated_params()
+        estimated_params["trials_ids"] = exported_model.params["trials_ids"]
+        estimated_params["units_ids"] = exported_model.params["units_ids"]
+        return estimated_params
+    with open(model_save_filename, "rb") as f:
+        results = pickle.load(f)
+    if results["model"] is not None:
+        estimated_params = modelExport.get_estimated_params(
+            model=results["model"])
+    else:
+        estimated_params = modelExport.get_estimated_params(
+            initial_params=results["estimated_params"]["initial_params"])
+    estimated_params["trials_ids"] = results.get("trials_ids", None)
+    estimated_params["units_ids"] = results.get("units_ids", None)
+    return estimated_params
+
+
+def get_interpolation_matrix(new_locs, locs):
+    """Returns the ``len(new_locs)`` x ``len(locs)`` matrix that linearly
+    interpolates values at the sorted locations ``locs`` onto ``new_locs``
+    (with constant extrapolation)."""
+    n_locs = len(locs)
+    interpolation_matrix = np.zeros((len(new_locs), n_locs))
+    rows = np.arange(len(new_locs))
+    if n_locs == 1:
+        interpolation_matrix[:, 0] = 1.0
+        return interpolation_matrix
+    right = np.clip(np.searchsorted(locs, new_locs), 1, n_locs - 1)
+    left = right - 1
+    weights = np.clip((new_locs - locs[left]) / (locs[right] - locs[left]),
+                      0.0, 1.0)
+    interpolation_matrix[rows, left] = 1.0 - weights
+    interpolation_matrix[rows, right] += weights
+    return interpolation_matrix
+
+
+def match_ids(new_ids, ids, n_new, n):
+    """Returns the indices in the new and in the previous estimation of their
+    shared trials or units. Estimations saved without ids are matched by
+    position, which requires both estimations to have the same number of
+    trials or units."""
+    if new_ids is None or ids is None:
+        if n_new != n:
+            raise ValueError(f"Cannot match {n_new} trials or units to the "
+                             f"{n} of an estimation saved without ids")
+        return np.arange(n), np.arange(n)
+    _, new_indices, indices = np.intersect1d(new_ids, ids,
+                                             return_indices=True)
+    return new_indices, indices
+
+
+def warm_start(params, estimated_params, trials_ids=None, units_ids=None,
+               cov_jitter=1e-6):
+    """Replaces, in place, the initial parameters in ``params`` (see
+    :func:`estimationUtils.get_params_and_kernels_types`) with those of a
+    previous estimation (see :func:`load_estimated_params`) for the latents,
+    trials and units shared by both estimations.
+
+    For every shared latent, kernel parameters of the same size are copied,
+    and so are the embedding columns of shared units. The variational means
+    and covariances of shared trials are copied, together with their
+    inducing points locations, when both estimations have the same number of
+    inducing points, and are otherwise linearly interpolated onto the new
+    inducing points locations (adding ``cov_jitter`` to the diagonal of the
+    interpolated covariances). Other parameters keep their initial values.
+
+    Returns the numbers of shared latents, trials and units.
+    """
+    initial_params = params["initial_params"]
+    embedding_params = initial_params["embedding"]
+    kms_params = initial_params["posterior_on_latents"][
+        "kernels_matrices_store"]
+    variational_params = initial_params["posterior_on_latents"][
+        "posterior_on_ind_points"]
+    new_n_latents = len(kms_params["kernels_params0"])
+    n_latents = len(estimated_params["kernels_params"])
+    n_shared_latents = min(new_n_latents, n_latents)
+    new_trials, trials = match_ids(
+        new_ids=trials_ids, ids=estimated_params["trials_ids"],
+        n_new=variational_params["mean"][0].shape[0],
+        n=estimated_params["variational_means"][0].shape[0])
+    new_units, units = match_ids(
+        new_ids=units_ids, ids=estimated_params["units_ids"],
+        n_new=embedding_params["C0"].shape[0],
+        n=estimated_params["C"].shape[0])
+
+    C0 = embedding_params["C0"].clone()
+    d0 = embedding_params["d0"].clone()
+    C0[new_units, :n_shared_latents] = \
+        estimated_params["C"][units, :n_shared_latents]
+    d0[new_units] = estimated_params["d"][units]
+    embedding_params["C0"] = C0
+    embedding_params["d0"] = d0
+
+    new_covs = svGPFA.utils.miscUtils.buildCovsFromCholVecs(
+        cholVecs=variational_params["cholVecs"])
+    covs = svGPFA.utils.miscUtils.buildCovsFromCholVecs(
+        cholVecs=estimated_params["variational_chol_vecs"])
+    for k in range(n_shared_latents):
+        kernel_params = estimated_params["kernels_params"][k]
+        if kernel_params.shape == kms_params["kernels_params0"][k].shape:
+            kms_params["kernels_params0"][k] = kernel_params.clone()
+
+        new_locs = kms_params["inducing_points_locs0"][k]
+        locs = estimated_params["ind_points_locs"][k]
+        new_means = variational_params["mean"][k]
+        means = estimated_params["variational_means"][k]
+        if new_locs.shape[1] == locs.shape[1]:
+            new_locs[new_trials] = locs[trials]
+            new_means[new_trials] = means[trials]
+            new_covs[k][new_trials] = covs[k][trials]
+            continue
+        for new_r, r in zip(new_trials, trials):
+            # estimated inducing points locations need not be sorted
+            order = torch.argsort(locs[r, :, 0])
+            interpolation_matrix = torch.from_numpy(get_interpolation_matrix(
+                new_locs=new_locs[new_r, :, 0].numpy(),
+                locs=locs[r, order, 0].numpy()))
+            new_means[new_r] = interpolation_matrix @ means[r][order]
+            new_covs[k][new_r] = \
+                interpolation_matrix @ covs[k][r][order][:, order] @ \
+                interpolation_matrix.T + \
+                cov_jitter * torch.eye(new_locs.shape[1], dtype=torch.double)
+    variational_params["cholVecs"] = \
+        svGPFA.utils.miscUtils.getVectorRepOfLowerTrianMatrices(
+            lt_matrices=[svGPFA.utils.miscUtils.chol3D(new_covs[k])
+                         for k in range(new_n_latents)])
+    return n_shared_latents, len(new_trials), len(new_units)
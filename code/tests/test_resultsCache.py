@@ -0,0 +1,53 @@
+import os
+import sys
+import configparser
+
+import numpy as np
+import svGPFA.stats.svEM
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+import estimationUtils  # noqa: E402
+import resultsCache  # noqa: E402
+
+
+def _save_terminated_estimation(estim_res_metadata_filename, key,
+                                terminationInfo):
+    estim_res_config = configparser.ConfigParser()
+    estim_res_config["estimation_params"] = {"est_init_number": 0,
+                                             "cache_key": key}
+    with open(estim_res_metadata_filename, "w") as f:
+        estim_res_config.write(f)
+    estimationUtils.save_termination_metadata(
+        estim_res_metadata_filename=estim_res_metadata_filename,
+        terminationInfo=terminationInfo, lowerBoundHist=np.array([-10.0]),
+        elapsedTimeHist=np.array([0.5]))
+
+
+def test_rerun_after_error_termination(tmp_path):
+    pattern = str(tmp_path / "{:08d}_estimation_metaData.ini")
+    key = resultsCache.get_estimation_key(filenames=[],
+                                          params={"n_latents": 2})
+
+    estResNumber, completed = resultsCache.find_estim_res_number(
+        estim_res_metadata_filename_pattern=pattern, key=key)
+    assert not completed
+
+    error = RuntimeError("Cholesky decomposition failed")
+    _save_terminated_estimation(
+        estim_res_metadata_filename=pattern.format(estResNumber), key=key,
+        terminationInfo=svGPFA.stats.svEM.ErrorTerminationInfo(
+            message="Error occured", error=error, stack_trace=""))
+    # the failed estimation is retried under the same number
+    rerunResNumber, completed = resultsCache.find_estim_res_number(
+        estim_res_metadata_filename_pattern=pattern, key=key)
+    assert rerunResNumber == estResNumber
+    assert not completed
+
+    _save_terminated_estimation(
+        estim_res_metadata_filename=pattern.format(estResNumber), key=key,
+        terminationInfo=svGPFA.stats.svEM.TerminationInfo(
+            message="Maximum number of iterations reached"))
+    rerunResNumber, completed = resultsCache.find_estim_res_number(
+        estim_res_metadata_filename_pattern=pattern, key=key)
+    assert rerunResNumber == estResNumber
+    assert completed